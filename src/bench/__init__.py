@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：无 GPU 压测工具。
+- fake_llm_server：兼容 Ollama /api/chat 与 OpenAI /v1/chat/completions 的本地假服务，可注入延迟、429/5xx 与吞吐限制；
+- load_driver：对 OllamaClient / OpenAICompatClient 及抽取器在不同并发度下压测，汇总吞吐、延迟分位数与错误数。
+"""
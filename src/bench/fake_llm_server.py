@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：本地假 LLM 服务，用于无 GPU 环境下的压测与故障注入。
+- 同时提供 Ollama POST /api/chat 与 OpenAI 兼容 POST /v1/chat/completions；GET /stats 返回服务端计数；
+- 按 prompt 家族返回格式正确的回答：标注句子（@@实体## / @@实体##类型）、yes/no（含 batch 验证与 1-token logprobs）、
+  openIE / NER JSON（"output"、"triples"、"named_entities"、"entities"）；回答只取决于请求内容，同一请求结果稳定；
+- 可配置延迟分布、429 / 5xx 比例（带 Retry-After）、生成吞吐（tokens/s）与服务端并发槽位 / 排队上限；
+- 支持流式（stream=true：OpenAI 为 SSE，Ollama 为 NDJSON），trailing_tokens 模拟 JSON 模式下答案之后继续生成的空白，
+  客户端提前断开时停止生成，只计实际生成的 token。
+
+用法：
+    python -m src.bench.fake_llm_server --port 11434 --latency lognormal:300:0.5 --tokens_per_sec 40 \
+        --rate_429 0.02 --rate_5xx 0.01 --max_concurrency 64 --max_queue 512
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+_SENTENCE_RE = re.compile(r"The given sentence:\s*(.*)")
+_ENTITY_TYPES_RE = re.compile(r"The entity types:\s*(\[.*\])", re.IGNORECASE)
+_CANDIDATE_RE = re.compile(r"^\s*\d+\.", re.MULTILINE)
+# 英文取首字母大写的词组，中文取连续汉字片段的前两个字
+_EN_ENTITY_RE = re.compile(r"\b[A-Z][A-Za-z]+(?:\s+[A-Z][A-Za-z]+)*")
+_ZH_ENTITY_RE = re.compile(r"[一-鿿]{2}")
+_TOKEN_RE = re.compile(r"[一-鿿]|\w+|[^\w\s]")
+# 流式输出的切分：在 _TOKEN_RE 基础上保留空白，拼接后与原文一致
+_STREAM_TOKEN_RE = re.compile(r"[一-鿿]|\w+|[^\w\s]|\s+")
+
+
+def count_tokens(text: str) -> int:
+    """粗略的 token 数：汉字按字计，其余按词与标点计"""
+    return max(1, len(_TOKEN_RE.findall(text or "")))
+
+
+class LatencyModel:
+    """
+    单次请求的基础延迟（不含生成耗时），单位毫秒：
+      fixed:MS | uniform:LO:HI | exp:MEAN | lognormal:MEDIAN:SIGMA
+    """
+
+    KINDS = ("fixed", "uniform", "exp", "lognormal")
+
+    def __init__(self, spec: str = "fixed:0") -> None:
+        kind, *params = spec.split(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的延迟分布: {spec}，可选 {'/'.join(self.KINDS)}")
+        expected = {"fixed": 1, "uniform": 2, "exp": 1, "lognormal": 2}[kind]
+        if len(params) != expected:
+            raise ValueError(f"延迟分布 {kind} 需要 {expected} 个参数: {spec}")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+
+    def sample(self, rng: random.Random) -> float:
+        """返回秒"""
+        p = self.params
+        if self.kind == "fixed":
+            ms = p[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(p[0], p[1])
+        elif self.kind == "exp":
+            ms = rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+        else:
+            ms = rng.lognormvariate(math.log(p[0]), p[1]) if p[0] > 0 else 0.0
+        return max(0.0, ms) / 1000.0
+
+
+@dataclass
+class FakeLLMConfig:
+    latency: str = "fixed:0"        # 基础延迟分布，见 LatencyModel
+    tokens_per_sec: float = 0.0     # 每个请求的生成速度，0 表示不限
+    rate_429: float = 0.0           # 随机返回 429 的比例
+    rate_5xx: float = 0.0           # 随机返回 500/502/503 的比例
+    retry_after: float = 1.0        # 429 / 503 的 Retry-After（秒）
+    max_concurrency: int = 0        # 同时生成的请求数（模拟 GPU batch 槽位），0 表示不限
+    max_queue: int = 0              # 等待槽位的请求数上限，超出直接 429，0 表示不限
+    yes_ratio: float = 0.8          # yes/no 问题回答 yes 的比例
+    trailing_tokens: int = 0        # 答案之后继续生成的空白 token 数（JSON 模式下模型常见的拖尾）
+    seed: int = 2025
+
+
+class FakeLLM:
+    """请求处理与计数，与 HTTP 层无关，可在进程内直接调用 handle()"""
+
+    def __init__(self, config: FakeLLMConfig) -> None:
+        self.config = config
+        self.latency = LatencyModel(config.latency)
+        self._rng = random.Random(config.seed)
+        self._rng_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(config.max_concurrency) if config.max_concurrency > 0 else None
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    # ---------------------------- 计数 ----------------------------
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._status: Counter = Counter()
+            self._in_flight = 0
+            self._waiting = 0
+            self._peak_in_flight = 0
+            self._peak_waiting = 0
+            self._prompt_tokens = 0
+            self._completion_tokens = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": sum(self._status.values()), "status": {str(k): v for k, v in sorted(self._status.items())},
+                    "in_flight": self._in_flight, "waiting": self._waiting,
+                    "peak_in_flight": self._peak_in_flight, "peak_waiting": self._peak_waiting,
+                    "prompt_tokens": self._prompt_tokens, "completion_tokens": self._completion_tokens,
+                    "config": asdict(self.config)}
+
+    def _count(self, status: int, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+        with self._lock:
+            self._status[status] += 1
+            self._prompt_tokens += prompt_tokens
+            self._completion_tokens += completion_tokens
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    # ---------------------------- 请求入口 ----------------------------
+    def handle(self, api: str, body: Dict[str, Any]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        """
+        处理一次对话请求，api 为 "ollama" 或 "openai"。返回 (状态码, 额外响应头, JSON 响应体)。
+        """
+        cfg = self.config
+        roll = self._random()
+        if roll < cfg.rate_429:
+            return self._error(429, "rate limit exceeded (injected)", retry_after=True)
+        if roll < cfg.rate_429 + cfg.rate_5xx:
+            status = (500, 502, 503)[int(self._random() * 3)]
+            return self._error(status, "server error (injected)", retry_after=status == 503)
+
+        # 没有空闲槽位时排队；排队数达到上限直接 429
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                overloaded = 0 < cfg.max_queue <= self._waiting
+                if not overloaded:
+                    self._waiting += 1
+                    self._peak_waiting = max(self._peak_waiting, self._waiting)
+            if overloaded:
+                return self._error(429, "server overloaded: queue is full", retry_after=True)
+            self._slots.acquire()
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+
+        messages = body.get("messages") or []
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+        model = body.get("model", "fake")
+        try:
+            content, logprobs = self._answer(messages, body, api)
+            with self._rng_lock:
+                delay = self.latency.sample(self._rng)
+        except BaseException:
+            self._leave()
+            raise
+        if body.get("stream"):
+            # 槽位在生成结束（或客户端断开）时由生成器归还；先推进到首个 yield，之后 close() 一定会执行其 finally
+            events = self._stream(api, body, model, content, prompt_tokens, delay)
+            next(events)
+            return 200, {}, events
+
+        try:
+            started = time.perf_counter()
+            if logprobs is None:
+                content += "\n" * cfg.trailing_tokens
+            completion_tokens = 1 if logprobs is not None else count_tokens(content) + cfg.trailing_tokens
+            if cfg.tokens_per_sec > 0:
+                delay += completion_tokens / cfg.tokens_per_sec
+            time.sleep(delay)
+            elapsed = time.perf_counter() - started
+        finally:
+            self._leave()
+
+        self._count(200, prompt_tokens, completion_tokens)
+        if api == "ollama":
+            return 200, {}, {
+                "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "message": {"role": "assistant", "content": content},
+                "done": True, "done_reason": "stop", "total_duration": int(elapsed * 1e9),
+                "prompt_eval_count": prompt_tokens, "eval_count": completion_tokens,
+            }
+        choice = {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop",
+                  "logprobs": logprobs}
+        return 200, {}, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()),
+            "model": model, "choices": [choice],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _leave(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+    def _stream(self, api: str, body: Dict[str, Any], model: str, content: str, prompt_tokens: int,
+                delay: float) -> Iterator[Dict[str, Any]]:
+        """逐 token 产出增量事件；首个 token 前等待基础延迟，之后按 tokens_per_sec 节奏生成"""
+        cfg = self.config
+        tokens = _STREAM_TOKEN_RE.findall(content) + ["\n"] * cfg.trailing_tokens
+        step = 1.0 / cfg.tokens_per_sec if cfg.tokens_per_sec > 0 else 0.0
+        completion_id, created = f"chatcmpl-{uuid.uuid4().hex[:24]}", int(time.time())
+        generated = 0
+        try:
+            yield {}
+            time.sleep(delay)
+            for token in tokens:
+                if step:
+                    time.sleep(step)
+                generated += 1
+                if api == "ollama":
+                    yield {"model": model, "message": {"role": "assistant", "content": token}, "done": False}
+                else:
+                    yield {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                           "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            if api == "ollama":
+                yield {"model": model, "message": {"role": "assistant", "content": ""}, "done": True,
+                       "done_reason": "stop", "prompt_eval_count": prompt_tokens, "eval_count": generated}
+            else:
+                yield {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    yield {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                           "choices": [], "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": generated,
+                                                    "total_tokens": prompt_tokens + generated}}
+        finally:
+            # 正常结束或客户端断开（生成器被关闭）都会走到这里
+            self._leave()
+            self._count(200, prompt_tokens, generated)
+
+    def _error(self, status: int, message: str, retry_after: bool) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        self._count(status)
+        headers = {"Retry-After": f"{self.config.retry_after:g}"} if retry_after else {}
+        return status, headers, {"error": {"message": message, "type": "fake_llm_error", "code": status}}
+
+    # ---------------------------- 回答生成 ----------------------------
+    def _answer(self, messages: List[Dict[str, Any]], body: Dict[str, Any], api: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """按 prompt 家族生成 (content, logprobs)；logprobs 仅在 OpenAI 请求 logprobs=true 时返回"""
+        system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+        users = [str(m.get("content", "")) for m in messages if m.get("role") == "user"]
+        user = users[-1] if users else ""
+        if api == "ollama":
+            json_mode = body.get("format") == "json"
+        else:
+            json_mode = (body.get("response_format") or {}).get("type") == "json_object"
+        m = _SENTENCE_RE.search(user)
+        sentence = m.group(1).strip() if m else user.strip()
+        digest = hashlib.sha256(user.encode("utf-8")).digest()
+
+        if "Candidates:" in user:
+            n = len(_CANDIDATE_RE.findall(user.split("Candidates:", 1)[1]))
+            answers = [{"id": i, "answer": self._yes_no(digest, i)} for i in range(1, n + 1)]
+            return json.dumps({"answers": answers}, ensure_ascii=False), None
+
+        if "Is the word" in user and "yes" in system:
+            answer = self._yes_no(digest, 0)
+            if api == "openai" and body.get("logprobs"):
+                return answer, self._logprobs(answer, int(body.get("top_logprobs") or 5))
+            return (json.dumps({"answer": answer}) if json_mode else answer), None
+
+        entities = _pick_entities(sentence)
+        if "@@" in system:
+            types_match = _ENTITY_TYPES_RE.search(user)
+            if types_match:
+                try:
+                    types = [str(t) for t in json.loads(types_match.group(1))]
+                except ValueError:
+                    types = []
+                tags = [f"##{types[(digest[i] + i) % len(types)]}" if types else "##" for i in range(len(entities))]
+            else:
+                tags = ["##"] * len(entities)
+            tagged = sentence
+            for entity, tag in zip(entities, tags):
+                tagged = tagged.replace(entity, f"@@{entity}{tag}", 1)
+            return (json.dumps({"answer": tagged}, ensure_ascii=False) if json_mode else tagged), None
+
+        pairs = list(zip(entities, entities[1:]))
+        if '"output"' in system:
+            output = [{"subject": [s, "entity", "entity"], "relationship": "related_to", "object": [o, "entity", "entity"]}
+                      for s, o in pairs]
+            return json.dumps({"output": output}, ensure_ascii=False), None
+        if "triples" in system:
+            return json.dumps({"triples": [[s, "related to", o] for s, o in pairs]}, ensure_ascii=False), None
+        if "named_entities" in system:
+            return json.dumps({"named_entities": entities}, ensure_ascii=False), None
+        if "entities" in system:
+            return json.dumps({"entities": entities}, ensure_ascii=False), None
+        return (json.dumps({"answer": sentence}, ensure_ascii=False) if json_mode else sentence), None
+
+    def _yes_no(self, digest: bytes, i: int) -> str:
+        return "yes" if digest[i % len(digest)] / 256.0 < self.config.yes_ratio else "no"
+
+    @staticmethod
+    def _logprobs(answer: str, top: int) -> Dict[str, Any]:
+        p_answer = 0.9
+        cands = [(answer, p_answer), ("no" if answer == "yes" else "yes", 1 - p_answer - 0.02), (" ", 0.02)][:max(1, top)]
+        top_logprobs = [{"token": t, "logprob": math.log(p), "bytes": list(t.encode("utf-8"))} for t, p in cands]
+        return {"content": [{"token": answer, "logprob": math.log(p_answer), "bytes": list(answer.encode("utf-8")),
+                             "top_logprobs": top_logprobs}]}
+
+
+def _pick_entities(sentence: str, limit: int = 4) -> List[str]:
+    """从句子中挑出几个片段当作实体，保证标注后能在原句中对齐"""
+    found = _EN_ENTITY_RE.findall(sentence) or _ZH_ENTITY_RE.findall(sentence)
+    return list(dict.fromkeys(found))[:limit]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive，与客户端连接池配合
+    protocol_version = "HTTP/1.1"
+    server: "FakeLLMServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/stats":
+            self._send(200, self.server.llm.stats())
+        elif path == "/api/tags":
+            self._send(200, {"models": [{"name": "fake", "model": "fake"}]})
+        elif path == "/v1/models":
+            self._send(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+        elif path == "":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        api = {"/api/chat": "ollama", "/v1/chat/completions": "openai"}.get(path)
+        if path == "/stats/reset":
+            self.server.llm.reset_stats()
+            self._send(200, {"status": "ok"})
+            return
+        if api is None:
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": {"message": f"invalid JSON body: {e}"}})
+            return
+        try:
+            status, headers, payload = self.server.llm.handle(api, body)
+        except Exception as e:
+            status, headers, payload = 500, {}, {"error": {"message": f"fake server failed: {e!r}"}}
+        if isinstance(payload, dict):
+            self._send(status, payload, headers)
+        else:
+            self._send_stream(api, payload)
+
+    def _send_stream(self, api: str, events: Iterator[Dict[str, Any]]) -> None:
+        """分块传输：OpenAI 为 SSE（data: 行，data: [DONE] 结束），Ollama 为 NDJSON"""
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson" if api == "ollama" else "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for event in events:
+                line = json.dumps(event, ensure_ascii=False)
+                self._write_chunk(line + "\n" if api == "ollama" else f"data: {line}\n\n")
+            if api == "openai":
+                self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except ConnectionError:
+            # 客户端拿到完整答案后提前断开
+            self.close_connection = True
+        finally:
+            events.close()
+
+    def _write_chunk(self, text: str) -> None:
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # 默认 backlog 只有 5，高并发压测时会直接拒绝连接
+    request_queue_size = 1024
+
+    def __init__(self, host: str, port: int, config: FakeLLMConfig) -> None:
+        super().__init__((host, port), _Handler)
+        self.llm = FakeLLM(config)
+        self._thread: Optional[threading.Thread] = None
+
+    def handle_error(self, request: Any, client_address: Any) -> None:
+        # 客户端取消请求（如对冲请求的输家）会断开连接，不是服务端错误
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeLLMServer":
+        """在后台线程中运行"""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-llm-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def start_fake_server(host: str = "127.0.0.1", port: int = 0, **config: Any) -> FakeLLMServer:
+    """在后台线程启动假服务（port=0 时自动分配端口），config 为 FakeLLMConfig 的字段"""
+    return FakeLLMServer(host, port, FakeLLMConfig(**config)).start()
+
+
+def add_server_args(p: argparse.ArgumentParser) -> None:
+    """假服务的命令行参数（load_driver 的 --spawn 复用）"""
+    d = FakeLLMConfig()
+    p.add_argument("--latency", default=d.latency, help="基础延迟分布（毫秒）：fixed:MS | uniform:LO:HI | exp:MEAN | lognormal:MEDIAN:SIGMA")
+    p.add_argument("--tokens_per_sec", type=float, default=d.tokens_per_sec, help="每个请求的生成速度，0 表示不限")
+    p.add_argument("--rate_429", type=float, default=d.rate_429, help="随机返回 429 的比例")
+    p.add_argument("--rate_5xx", type=float, default=d.rate_5xx, help="随机返回 500/502/503 的比例")
+    p.add_argument("--retry_after", type=float, default=d.retry_after, help="429/503 响应的 Retry-After 秒数")
+    p.add_argument("--max_concurrency", type=int, default=d.max_concurrency, help="服务端同时生成的请求数，0 表示不限")
+    p.add_argument("--max_queue", type=int, default=d.max_queue, help="等待生成槽位的请求上限，超出返回 429，0 表示不限")
+    p.add_argument("--yes_ratio", type=float, default=d.yes_ratio, help="yes/no 问题回答 yes 的比例")
+    p.add_argument("--trailing_tokens", type=int, default=d.trailing_tokens,
+                   help="答案之后继续生成的空白 token 数，用于观察流式提前结束的收益")
+    p.add_argument("--seed", type=int, default=d.seed)
+
+
+def server_config_from_args(args: argparse.Namespace) -> FakeLLMConfig:
+    return FakeLLMConfig(latency=args.latency, tokens_per_sec=args.tokens_per_sec, rate_429=args.rate_429,
+                         rate_5xx=args.rate_5xx, retry_after=args.retry_after, max_concurrency=args.max_concurrency,
+                         max_queue=args.max_queue, yes_ratio=args.yes_ratio, trailing_tokens=args.trailing_tokens,
+                         seed=args.seed)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="本地假 LLM 服务（Ollama /api/chat + OpenAI /v1/chat/completions）")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=11434)
+    add_server_args(p)
+    args = p.parse_args(argv)
+    server = FakeLLMServer(args.host, args.port, server_config_from_args(args))
+    print(f"[INFO] 假 LLM 服务已启动：{server.url}（/api/chat、/v1/chat/completions、/stats）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：LLM 客户端 / 抽取器压测驱动。对每个并发度发出同一批请求，汇总吞吐、延迟分位数、错误数与服务端计数。
+- target=client：直接调用 build_llm_client 得到的 OllamaClient / OpenAICompatClient（async 用 achat，threads 用 chat）；
+- target=extractor：用 EntityExtractor.extract_and_save_all 跑完整的抽取流程（关闭响应缓存与录制回放，输出到临时目录）。
+配合 --spawn 在进程内启动 fake_llm_server，无需 GPU 即可观察 10–1000 并发下的排队、重试与错误表现。
+
+用法：
+    python -m src.bench.load_driver --spawn --provider ollama --concurrency 10,100,1000 --requests 2000 \
+        --latency lognormal:300:0.5 --rate_429 0.02 --max_concurrency 64
+    python -m src.bench.load_driver --target extractor --spawn --concurrency 10,100 --examples 200 --report outputs/bench.json
+    python -m src.bench.load_driver --base_url http://127.0.0.1:8000 --provider openai --family verify
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..utils.io_tools import load_yaml
+from ..data.dataset import load_json_dataset
+from ..extraction.client import build_llm_client
+from ..extraction.utils.http_utils import aclose_all_pools, pool_stats
+from ..extraction.utils.routing_utils import get_router, normalize_base_urls
+from .fake_llm_server import FakeLLMServer, add_server_args, server_config_from_args
+
+FAMILIES = ("per_type", "multi_type", "verify", "batch_verify", "logprob", "mixed")
+# 没有数据文件时使用的句子
+_FALLBACK_EXAMPLES = [
+    {"sentence": "Set in Montana , Michigan and Florida , Thomas McGuane 's first collection is populated by misfits .",
+     "coarse_types": ["location", "person"]},
+    {"sentence": "Only France and Britain backed Fischler 's proposal .", "coarse_types": ["location", "person"]},
+    {"sentence": "周杰伦在台北发布了新专辑《最伟大的作品》。", "coarse_types": ["人", "地点", "作品"]},
+]
+
+Request = Tuple[str, str, Dict[str, Any]]  # (system, user, overrides)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩分位数，sorted_values 需已排序"""
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _load_examples(cfg: Dict[str, Any], data_path: Optional[str], n: int) -> List[Dict[str, Any]]:
+    """读取样例并循环补足到 n 个（id 重新编号，避免续跑逻辑跳过重复样例）"""
+    base: List[Dict[str, Any]] = []
+    path = Path(data_path) if data_path else Path(cfg["paths"]["data_dir"]) / "dev2.json"
+    if path.exists():
+        base = [ex for ex in load_json_dataset(path) if ex.get("sentence") and ex.get("coarse_types")]
+    base = base or _FALLBACK_EXAMPLES
+    examples = []
+    for i in range(n):
+        ex = copy.deepcopy(base[i % len(base)])
+        ex["id"] = f"bench-{i}"
+        examples.append(ex)
+    return examples
+
+
+def _make_workload(prompt_dir: str, examples: List[Dict[str, Any]], family: str, n: int) -> List[Request]:
+    """按 prompt 家族用真实模板构造 n 个请求；句子循环使用时加编号，避免被服务端或缓存当成同一请求"""
+    def read(name: str) -> str:
+        return (Path(prompt_dir) / name).read_text(encoding="utf-8")
+
+    templates = {name: read(name) for name in (
+        "system_coarse_types_prompt.txt", "user_coarse_types_prompt.txt",
+        "system_multi_types_prompt.txt", "user_multi_types_prompt.txt",
+        "system_coarse_type_verify_prompt.txt", "user_coarse_type_verify_prompt.txt",
+        "system_coarse_type_verify_logprob_prompt.txt",
+        "system_batch_verify_prompt.txt", "user_batch_verify_prompt.txt")}
+    families = FAMILIES[:-1] if family == "mixed" else (family,)
+    workload: List[Request] = []
+    for i in range(n):
+        ex = examples[i % len(examples)]
+        fam = families[i % len(families)]
+        sentence = f"{ex['sentence']} ({i})"
+        ct = ex["coarse_types"][i % len(ex["coarse_types"])]
+        word = sentence.split()[0]
+        if fam == "per_type":
+            workload.append((templates["system_coarse_types_prompt.txt"].replace("[Entity Type]", ct),
+                             templates["user_coarse_types_prompt.txt"].replace("[Sentence]", sentence).replace("[Entity Type]", ct), {}))
+        elif fam == "multi_type":
+            workload.append((templates["system_multi_types_prompt.txt"],
+                             templates["user_multi_types_prompt.txt"].replace("[Sentence]", sentence)
+                             .replace("[Entity Types]", json.dumps(ex["coarse_types"], ensure_ascii=False)), {}))
+        elif fam in ("verify", "logprob"):
+            system = templates["system_coarse_type_verify_logprob_prompt.txt" if fam == "logprob"
+                               else "system_coarse_type_verify_prompt.txt"].replace("[Entity Type]", ct)
+            user = (templates["user_coarse_type_verify_prompt.txt"].replace("[Sentence]", sentence)
+                    .replace("[Entity]", word).replace("[Entity Type]", ct))
+            overrides = {"max_tokens": 1, "response_format": None, "logprobs": True, "top_logprobs": 5} if fam == "logprob" else {}
+            workload.append((system, user, overrides))
+        else:
+            candidates = "\n".join(f'{j}. Is the word "{w}" in the given sentence a {ct} entity?'
+                                   for j, w in enumerate(sentence.split()[:4], start=1))
+            workload.append((templates["system_batch_verify_prompt.txt"],
+                             templates["user_batch_verify_prompt.txt"].replace("[Sentence]", sentence)
+                             .replace("[Candidates]", candidates), {}))
+    return workload
+
+
+def _server_stats(base_url: str) -> Optional[Dict[str, Any]]:
+    """读取 fake_llm_server 的 /stats；真实后端没有该接口时返回 None"""
+    try:
+        r = httpx.get(f"{base_url.rstrip('/')}/stats", timeout=5)
+        return r.json() if r.status_code == 200 else None
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def _reset_server_stats(base_url: str) -> None:
+    try:
+        httpx.post(f"{base_url.rstrip('/')}/stats/reset", timeout=5)
+    except httpx.HTTPError:
+        pass
+
+
+def _summarize(concurrency: int, elapsed: float, latencies: List[float], errors: Counter) -> Dict[str, Any]:
+    lat = sorted(latencies)
+    total = len(lat) + sum(errors.values())
+    return {
+        "concurrency": concurrency, "requests": total, "ok": len(lat), "errors": dict(errors),
+        "elapsed_s": round(elapsed, 3), "throughput_rps": round(len(lat) / elapsed, 2) if elapsed > 0 else None,
+        "p50_ms": round(percentile(lat, 50) * 1000, 1), "p95_ms": round(percentile(lat, 95) * 1000, 1),
+        "p99_ms": round(percentile(lat, 99) * 1000, 1), "max_ms": round(lat[-1] * 1000, 1) if lat else None,
+    }
+
+
+# ---------------------------- target=client ----------------------------
+async def _run_client_async(client: Any, workload: List[Request], concurrency: int) -> Tuple[float, List[float], Counter]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Counter = Counter()
+
+    async def _one(req: Request) -> None:
+        system, user, overrides = req
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await client.achat(system, user, **overrides)
+                latencies.append(time.perf_counter() - t0)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[_one(req) for req in workload])
+    finally:
+        await aclose_all_pools()
+    return time.perf_counter() - start, latencies, errors
+
+
+def _run_client_threads(client: Any, workload: List[Request], concurrency: int) -> Tuple[float, List[float], Counter]:
+    latencies: List[float] = []
+    errors: Counter = Counter()
+
+    def _one(req: Request) -> None:
+        system, user, overrides = req
+        t0 = time.perf_counter()
+        try:
+            client.chat(system, user, **overrides)
+            latencies.append(time.perf_counter() - t0)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(_one, workload))
+    return time.perf_counter() - start, latencies, errors
+
+
+# ---------------------------- target=extractor ----------------------------
+def _run_extractor(cfg: Dict[str, Any], examples: List[Dict[str, Any]], concurrency: int, out_dir: str) -> Dict[str, Any]:
+    # 延迟导入：抽取器依赖检索等较重的模块，client 压测不需要
+    from ..extraction.gptner_extractor import EntityExtractor
+
+    extractor = EntityExtractor(cfg)
+    out_path = Path(out_dir) / f"bench_pred_c{concurrency}.json"
+    start = time.perf_counter()
+    extractor.extract_and_save_all(copy.deepcopy(examples), out_path, concurrency=concurrency, resume=False)
+    elapsed = time.perf_counter() - start
+    failed_path = out_path.with_name(out_path.stem + ".failed.jsonl")
+    failed = sum(1 for _ in open(failed_path, encoding="utf-8")) if failed_path.exists() else 0
+    usage = extractor.usage
+    return {
+        "concurrency": concurrency, "examples": len(examples), "failed_examples": failed,
+        "llm_calls": usage["calls"], "elapsed_s": round(elapsed, 3),
+        "examples_per_s": round(len(examples) / elapsed, 2) if elapsed > 0 else None,
+        "calls_per_s": round(usage["calls"] / elapsed, 2) if elapsed > 0 else None,
+        "prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"],
+    }
+
+
+def _print_row(row: Dict[str, Any]) -> None:
+    if "p50_ms" in row:
+        line = (f"[BENCH] c={row['concurrency']:<5} ok {row['ok']}/{row['requests']}  {row['throughput_rps']} req/s  "
+                f"p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {row['errors'] or '-'}")
+    else:
+        line = (f"[BENCH] c={row['concurrency']:<5} {row['examples']} 样例 ({row['failed_examples']} 失败)  "
+                f"{row['llm_calls']} 次调用  {row['elapsed_s']} s  {row['examples_per_s']} 样例/s  {row['calls_per_s']} 调用/s")
+    print(line)
+    routed = {ep["base_url"]: ep for ep in row.get("routing") or []}
+    for url, server in row["servers"].items():
+        parts = []
+        if url in routed:
+            ep = routed[url]
+            parts.append(f"分到 {ep['requests']} 次请求，失败 {ep['failures']}，摘除 {ep['ejections']} 次")
+        adaptive = (row.get("adaptive") or {}).get(url)
+        if adaptive:
+            parts.append(f"自适应上限 {adaptive['limit']}（减小 {adaptive['decreases']} 次）")
+        if server:
+            parts.append(f"服务端 状态码 {server['status']}  峰值在途 {server['peak_in_flight']}  峰值排队 {server['peak_waiting']}")
+        if parts:
+            print(f"        {url}: " + "  | ".join(parts))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="LLM 客户端 / 抽取器压测")
+    p.add_argument("--config", default="configs/default.yaml")
+    p.add_argument("--target", default="client", choices=["client", "extractor"])
+    p.add_argument("--provider", default=None, choices=["ollama", "openai"], help="覆盖 cfg.llm.provider")
+    p.add_argument("--base_url", default=None, help="覆盖 cfg.llm.base_url（多个副本用逗号分隔）；与 --spawn 同时使用时被忽略")
+    p.add_argument("--concurrency", default="10,100,1000", help="逗号分隔的并发度列表")
+    p.add_argument("--requests", type=int, default=1000, help="target=client：每个并发度的请求数")
+    p.add_argument("--family", default="per_type", choices=FAMILIES, help="target=client：请求使用的 prompt 家族")
+    p.add_argument("--mode", default="async", choices=["async", "threads"], help="target=client：achat + asyncio 或 chat + 线程池")
+    p.add_argument("--examples", type=int, default=100, help="target=extractor：每个并发度抽取的样例数")
+    p.add_argument("--data", default=None, help="样例文件（默认 <paths.data_dir>/dev2.json）")
+    p.add_argument("--report", default=None, help="把结果写成 JSON")
+    p.add_argument("--spawn", action="store_true", help="在进程内启动 fake_llm_server 作为后端")
+    p.add_argument("--port", type=int, default=0, help="--spawn 时假服务的端口，0 为自动分配")
+    p.add_argument("--replicas", type=int, default=1, help="--spawn 时启动的假服务副本数（测试多 endpoint 负载均衡）")
+    p.add_argument("--stream", action="store_true", help="客户端改用流式补全（JSON 对象完整即提前结束），覆盖 cfg.llm.stream")
+    add_server_args(p)
+    return p.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    cfg = load_yaml(args.config)
+    llm_cfg = cfg["llm"]
+    if args.provider:
+        llm_cfg["provider"] = args.provider
+    if args.stream:
+        llm_cfg["stream"] = True
+    # 压测只关心后端与客户端本身：关闭响应缓存与录制回放
+    llm_cfg["cache"] = {"enable": False}
+    llm_cfg["cassette"] = {"mode": "off"}
+
+    servers: List[FakeLLMServer] = []
+    if args.spawn:
+        servers = [FakeLLMServer("127.0.0.1", args.port + i if args.port else 0, server_config_from_args(args)).start()
+                   for i in range(max(1, args.replicas))]
+        llm_cfg["base_url"] = [server.url for server in servers]
+        print(f"[INFO] 假 LLM 服务：{', '.join(llm_cfg['base_url'])}（latency={args.latency}, tokens/s={args.tokens_per_sec}, "
+              f"429={args.rate_429}, 5xx={args.rate_5xx}, 服务端并发={args.max_concurrency or '不限'}）")
+    elif args.base_url:
+        llm_cfg["base_url"] = args.base_url
+    base_urls = normalize_base_urls(llm_cfg.get("base_url", ""))
+
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    pool_limit = (llm_cfg.get("pool") or {}).get("max_in_flight", 256)
+    if args.mode == "async" and max(levels) > int(pool_limit) * len(base_urls):
+        print(f"[WARN] cfg.llm.pool.max_in_flight={pool_limit}（每个副本），超出部分在客户端本地排队")
+
+    def _finish(row: Dict[str, Any]) -> None:
+        row["servers"] = {url: _server_stats(url) for url in base_urls}
+        row["adaptive"] = {url: st for url, st in pool_stats().items() if url in base_urls}
+        row["routing"] = get_router(base_urls).stats()
+        _print_row(row)
+        results.append(row)
+
+    results: List[Dict[str, Any]] = []
+    try:
+        if args.target == "client":
+            client = build_llm_client(llm_cfg)
+            examples = _load_examples(cfg, args.data, min(args.requests, 1000))
+            workload = _make_workload(cfg["paths"]["prompt_dir"], examples, args.family, args.requests)
+            for c in levels:
+                for url in base_urls:
+                    _reset_server_stats(url)
+                if args.mode == "async":
+                    elapsed, latencies, errors = asyncio.run(_run_client_async(client, workload, c))
+                else:
+                    elapsed, latencies, errors = _run_client_threads(client, workload, c)
+                _finish(_summarize(c, elapsed, latencies, errors))
+        else:
+            examples = _load_examples(cfg, args.data, args.examples)
+            with tempfile.TemporaryDirectory(prefix="llm_bench_") as out_dir:
+                for c in levels:
+                    for url in base_urls:
+                        _reset_server_stats(url)
+                    _finish(_run_extractor(cfg, examples, c, out_dir))
+    finally:
+        for server in servers:
+            server.stop()
+
+    if args.report:
+        report_dir = os.path.dirname(args.report)
+        if report_dir:
+            os.makedirs(report_dir, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"[OK] 压测结果已写入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,8 @@
 
 import json
 
+from src.utils.tracing import span, traced
+
 def _load_jsonl_or_json(path):
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -55,6 +57,7 @@ def _to_keys(sample, mode="strict"):
     return keys
 
 
+@traced("evaluate_ner")
 def evaluate_ner(dev_gold_path, pred_path, mode="strict", error_output_path=None):
     """
     评测NER性能
@@ -62,8 +65,9 @@ def evaluate_ner(dev_gold_path, pred_path, mode="strict", error_output_path=None
           "medium" - (name, coarse_type) 两个对
           "loose"  - 只对 name
     """
-    gold = _load_jsonl_or_json(dev_gold_path)  # gold: json list
-    pred = _load_jsonl_or_json(pred_path)  # pred: jsonl list
+    with span("load_dataset"):
+        gold = _load_jsonl_or_json(dev_gold_path)  # gold: json list
+        pred = _load_jsonl_or_json(pred_path)  # pred: jsonl list
 
     tp = fp = fn = 0
 
@@ -108,7 +112,8 @@ def evaluate_ner(dev_gold_path, pred_path, mode="strict", error_output_path=None
 
     # 新增：保存错误分析结果
     if error_output_path and error_analysis:
-        with open(error_output_path, 'w', encoding='utf-8') as f:
+        with span("write_output", path=str(error_output_path)), \
+                open(error_output_path, 'w', encoding='utf-8') as f:
             json.dump({
                 "error_statistics": {
                     "total_samples": len(gold),
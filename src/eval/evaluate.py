@@ -4,6 +4,8 @@ from typing import Dict, Tuple, Any, List, Optional
 from sentence_transformers import SentenceTransformer, util
 import os
 
+from src.utils.tracing import span, traced
+
 _SBER_MODEL = None
 
 
@@ -22,7 +24,8 @@ def _get_model(model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
     else:
         load_target = model_name  # 本地不可用则回退远程名
 
-    _SBER_MODEL = SentenceTransformer(load_target, device=device)
+    with span("load_model", model=str(load_target)):
+        _SBER_MODEL = SentenceTransformer(load_target, device=device)
     _SBER_MODEL.eval()  # 设置为推理模式
     return _SBER_MODEL
 
@@ -70,6 +73,7 @@ def _to_map_name_ct_2_ft(sample: Dict[str, Any]) -> Dict[Tuple[str, str], str]:
     return m
 
 
+@traced("evaluate_ner")
 def evaluate_ner(dev_gold_path: str, pred_path: str,
                  strict: bool = True, by_type: bool = False, *,
                  strict_semantic: bool = False, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
@@ -84,8 +88,9 @@ def evaluate_ner(dev_gold_path: str, pred_path: str,
     threshold: 语义相似阈值（余弦），默认 0.80
     error_output_path: 错误样例保存路径，如果未指定则不保存
     """
-    gold = _load_jsonl_or_json(dev_gold_path)  # 标准答案
-    pred = _load_jsonl_or_json(pred_path)  # 预测结果
+    with span("load_dataset"):
+        gold = _load_jsonl_or_json(dev_gold_path)  # 标准答案
+        pred = _load_jsonl_or_json(pred_path)  # 预测结果
 
     tp = fp = fn = 0
     type_counter = Counter()
@@ -206,7 +211,8 @@ def evaluate_ner(dev_gold_path: str, pred_path: str,
 
     # 如果提供了路径，则保存错误样例
     if error_output_path:
-        with open(error_output_path, 'w', encoding='utf-8') as f:
+        with span("write_output", path=str(error_output_path)), \
+                open(error_output_path, 'w', encoding='utf-8') as f:
             json.dump(error_analysis, f, ensure_ascii=False, indent=2)
         print(f"错误样例已保存到：{error_output_path}")
 
@@ -11,13 +11,19 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
+import math
 import os
+import re
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 # 复用已有的 LLM 调用能力
-from src.extraction.client import LLMClient
+from src.extraction.client import LLMClient, OpenAICompatClient
+from src.extraction.utils.metrics_utils import get_metrics
+from src.utils.io_tools import JsonlCheckpoint, record_hash
+from src.utils.tracing import traced
 
 class SelfVerifier(LLMClient):
     """
@@ -34,6 +40,7 @@ class SelfVerifier(LLMClient):
     - 调用 LLM 进行回答；
     - 保存所有样例验证结果。
     """
+    @traced("render_prompt", cat="example")
     def _make_coarse_type_verify_prompt(self, example: Dict[str, Any]) -> tuple[List[str], List[str]]:
         """
         根据传入的 json 样本构造 prompts
@@ -64,7 +71,10 @@ class SelfVerifier(LLMClient):
         """
         根据粗粒度类型生成对应的 system_prompt
         """
-        template = self._read_prompt("system_coarse_type_verify_prompt.txt")
+        if self.verify_mode == "logprob":
+            template = self._read_prompt("system_coarse_type_verify_logprob_prompt.txt")
+        else:
+            template = self._read_prompt("system_coarse_type_verify_prompt.txt")
         # TODO 替换 [examples] 为检索到的 few-shots
         return (template
             .replace("[Entity Type]", coarse_type))
@@ -81,13 +91,123 @@ class SelfVerifier(LLMClient):
                 .replace("[Entity]", name)
                 .replace("[Entity Type]", coarse_type))
         
+    metrics_stage = "verify"
+    run_cfg_section = "verification"
+
+    @property
+    def metrics_template(self) -> str:
+        return self.verify_mode
+
+    @property
+    def verify_mode(self) -> str:
+        """
+        验证模式（cfg.verification.mode）：
+        - "per_entity"：每个实体单独一次调用（默认）；
+        - "batch"：每个样例一次调用，对所有 (实体, 粗粒度) 候选逐一给出 yes/no，解析失败的候选回退到 per_entity；
+        - "logprob"：每个实体一次调用，只生成 1 个 token，用 top logprobs 中的 P(yes) 作为置信度与阈值比较
+          （仅 OpenAI 兼容后端）。
+        """
+        mode = (self.cfg.get("verification") or {}).get("mode", "per_entity")
+        if mode not in ("per_entity", "batch", "logprob"):
+            raise ValueError(f"未知的验证模式: {mode}，可选 per_entity / batch / logprob")
+        if mode == "logprob" and not isinstance(self.client, OpenAICompatClient):
+            raise ValueError("logprob 验证模式仅支持 OpenAI 兼容后端（llm.provider 不能为 ollama）")
+        return mode
+
+    def _logprob_overrides(self) -> Dict[str, Any]:
+        """logprob 模式的请求参数：只生成 1 个 token，关闭 JSON 模式，返回 top logprobs"""
+        vcfg = self.cfg.get("verification") or {}
+        return {"max_tokens": 1, "response_format": None,
+                "logprobs": True, "top_logprobs": int(vcfg.get("top_logprobs", 5))}
+
+    def _score_logprob_answer(self, resp: Dict[str, Any]) -> Tuple[str, Optional[float]]:
+        """
+        从 1-token 回答的 top logprobs 计算置信度 P(yes) / (P(yes) + P(no))。
+        返回 (生成的文本, 置信度)；没有 logprobs 或候选中既无 yes 也无 no 时置信度为 None。
+        """
+        choice = (resp.get("choices") or [{}])[0]
+        text = (choice.get("message") or {}).get("content") or ""
+        content = (choice.get("logprobs") or {}).get("content") or []
+        if not content:
+            return text, None
+
+        p_yes = p_no = 0.0
+        for cand in content[0].get("top_logprobs") or []:
+            yn = self._parse_yes_no(str(cand.get("token", "")).strip(" \"'"), strict=True)
+            if yn is True:
+                p_yes += math.exp(cand.get("logprob", float("-inf")))
+            elif yn is False:
+                p_no += math.exp(cand.get("logprob", float("-inf")))
+        if p_yes + p_no <= 0:
+            return text, None
+        return text, p_yes / (p_yes + p_no)
+
+    def _is_valid_by_score(self, score: Optional[float], llm_answer: str) -> Optional[bool]:
+        """置信度与阈值（cfg.verification.logprob_threshold，默认 0.5）比较；无置信度时退回文本解析"""
+        if score is None:
+            return self._parse_yes_no(llm_answer, strict=True)
+        threshold = float((self.cfg.get("verification") or {}).get("logprob_threshold", 0.5))
+        return score >= threshold
+
+    @traced("render_prompt", cat="example")
+    def _make_batch_verify_prompt(self, example: Dict[str, Any]) -> tuple[str, str]:
+        """
+        batch 模式：把样例中所有实体编号为候选，构造一次性验证的 system_prompt 与 user_prompt
+        """
+        candidates = "\n".join(
+            f'{i}. Is the word "{e.get("name", "")}" in the given sentence a {e.get("coarse_type", "")} entity?'
+            for i, e in enumerate(example.get("entities", []), start=1)
+        )
+        system_prompt = self._read_prompt("system_batch_verify_prompt.txt")
+        user_prompt = (self._read_prompt("user_batch_verify_prompt.txt")
+                       .replace("[Sentence]", example.get("sentence", ""))
+                       .replace("[Candidates]", candidates))
+        return system_prompt, user_prompt
+
+    @traced("parse", cat="example")
+    def _parse_batch_answer(self, text: Optional[str], n: int) -> List[Optional[str]]:
+        """
+        解析 batch 模式的回答 {"answers": [{"id": 1, "answer": "yes"}, ...]}（也接受按顺序排列的字符串列表）。
+        返回长度为 n 的逐候选答案文本，无法解析的候选为 None。
+        """
+        out: List[Optional[str]] = [None] * n
+        if not text:
+            return out
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            m = re.search(r"\{.*\}", text, flags=re.DOTALL)
+            if m is None:
+                return out
+            try:
+                data = json.loads(m.group())
+            except json.JSONDecodeError:
+                return out
+
+        answers = data.get("answers") if isinstance(data, dict) else data
+        if not isinstance(answers, list):
+            return out
+        for pos, item in enumerate(answers):
+            if isinstance(item, dict):
+                try:
+                    idx = int(item.get("id", pos + 1)) - 1
+                except (TypeError, ValueError):
+                    continue
+                ans = item.get("answer")
+            else:
+                idx, ans = pos, item
+            if 0 <= idx < n and ans is not None and out[idx] is None:
+                out[idx] = str(ans)
+        return out
+
         # ===================== 工具：解析 yes/no =====================
-    def _parse_yes_no(self, text: Optional[str]) -> Optional[bool]:
+    def _parse_yes_no(self, text: Optional[str], strict: bool = False) -> Optional[bool]:
         """
         解析 LLM 的回答为 True/False：
         - True: yes / true / 是 / 对 / 正确 / 属于 / Y（大小写不敏感）
         - False: no / false / 否 / 不 / 不是 / 不属于 / N
         - 其他：返回 None
+        strict=True 时只做精准匹配（batch 模式的逐候选答案），不做子串宽松判断。
         """
         if not text:
             return None
@@ -104,6 +224,8 @@ class SelfVerifier(LLMClient):
             return True
         if first in false_set:
             return False
+        if strict:
+            return None
 
         # 宽松判断：句子里包含明显肯/否定词
         for t in true_set:
@@ -116,6 +238,7 @@ class SelfVerifier(LLMClient):
         return None
 
     # ===================== 对单条样例的自我验证 =====================
+    @traced("verify_example", cat="example")
     def verify_for_one_example(self, ex: Dict[str, Any]) -> Dict[str, Any]:
         """
         对单条样例进行自我验证：
@@ -141,32 +264,114 @@ class SelfVerifier(LLMClient):
           ]
         }
         """
-        sample_id = ex.get("id")
-        sentence = ex.get("sentence", "")
-        coarse_list = list(ex.get("coarse_types", []))
         entities = list(ex.get("entities", []))  # [{"name":..., "coarse_type":...}, ...]
 
+        if self.verify_mode == "batch" and entities:
+            sp, up = self._make_batch_verify_prompt(ex)
+            batch_answer = self._call_llm(sys_prompt=sp, user_prompt=up)
+            parsed = self._parse_batch_answer(batch_answer, len(entities))
+            # 仅对解析不出结论的候选回退到逐实体验证
+            fallback: Dict[int, Tuple[str, str, str]] = {}
+            missing = [i for i, a in enumerate(parsed) if self._parse_yes_no(a, strict=True) is None]
+            if missing:
+                # 回退的候选最终仍解析不出时由 _finalize_verify_result 计入解析失败，这里单独计数，避免重复
+                get_metrics().inc("llm_batch_fallbacks_total", len(missing), **self._metric_labels())
+                fb_sps, fb_ups = self._make_coarse_type_verify_prompt(ex)
+                for i in missing:
+                    fallback[i] = (fb_sps[i], fb_ups[i], self._call_llm(sys_prompt=fb_sps[i], user_prompt=fb_ups[i]))
+            return self._build_batch_verify_result(ex, entities, sp, up, batch_answer, parsed, fallback)
+
         # 1) 生成 prompts（与 entities 数量对齐）
         system_prompts, user_prompts = self._make_coarse_type_verify_prompt(ex)
         if len(system_prompts) != len(entities) or len(user_prompts) != len(entities):
             raise ValueError("prompts 与 entities 数量不一致，请检查 _make_coarse_type_verify_prompt 的构造逻辑。")
 
+        # 2) 逐实体进行验证
+        if self.verify_mode == "logprob":
+            scored = [self._score_logprob_answer(self._call_llm_raw(sp, up, **self._logprob_overrides()))
+                      for sp, up in zip(system_prompts, user_prompts)]
+            return self._build_verify_result(ex, entities, system_prompts, user_prompts,
+                                             [a for a, _ in scored], scores=[sc for _, sc in scored])
+
+        answers = [self._call_llm(sys_prompt=sp, user_prompt=up) for sp, up in zip(system_prompts, user_prompts)]
+
+        return self._build_verify_result(ex, entities, system_prompts, user_prompts, answers)
+
+    @traced("verify_example", cat="example")
+    async def averify_for_one_example(self, ex: Dict[str, Any], sem: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+        """
+        verify_for_one_example 的异步版本：该样例所有实体的验证请求同时发出，
+        sem 用于限制全局在途请求数。结果与同步版本完全一致。
+        """
+        entities = list(ex.get("entities", []))
+
+        async def _one(sp: str, up: str) -> str:
+            if sem is None:
+                return await self._acall_llm(sys_prompt=sp, user_prompt=up)
+            async with sem:
+                return await self._acall_llm(sys_prompt=sp, user_prompt=up)
+
+        if self.verify_mode == "batch" and entities:
+            sp, up = self._make_batch_verify_prompt(ex)
+            batch_answer = await _one(sp, up)
+            parsed = self._parse_batch_answer(batch_answer, len(entities))
+            fallback: Dict[int, Tuple[str, str, str]] = {}
+            missing = [i for i, a in enumerate(parsed) if self._parse_yes_no(a, strict=True) is None]
+            if missing:
+                # 回退的候选最终仍解析不出时由 _finalize_verify_result 计入解析失败，这里单独计数，避免重复
+                get_metrics().inc("llm_batch_fallbacks_total", len(missing), **self._metric_labels())
+                fb_sps, fb_ups = self._make_coarse_type_verify_prompt(ex)
+                fb_answers = await asyncio.gather(*[_one(fb_sps[i], fb_ups[i]) for i in missing])
+                fallback = {i: (fb_sps[i], fb_ups[i], a) for i, a in zip(missing, fb_answers)}
+            return self._build_batch_verify_result(ex, entities, sp, up, batch_answer, parsed, fallback)
+
+        system_prompts, user_prompts = self._make_coarse_type_verify_prompt(ex)
+        if len(system_prompts) != len(entities) or len(user_prompts) != len(entities):
+            raise ValueError("prompts 与 entities 数量不一致，请检查 _make_coarse_type_verify_prompt 的构造逻辑。")
+
+        if self.verify_mode == "logprob":
+            async def _one_scored(sp: str, up: str) -> Tuple[str, Optional[float]]:
+                if sem is None:
+                    return self._score_logprob_answer(await self._acall_llm_raw(sp, up, **self._logprob_overrides()))
+                async with sem:
+                    return self._score_logprob_answer(await self._acall_llm_raw(sp, up, **self._logprob_overrides()))
+
+            scored = await asyncio.gather(*[_one_scored(sp, up) for sp, up in zip(system_prompts, user_prompts)])
+            return self._build_verify_result(ex, entities, system_prompts, user_prompts,
+                                             [a for a, _ in scored], scores=[sc for _, sc in scored])
+
+        answers = await asyncio.gather(*[_one(sp, up) for sp, up in zip(system_prompts, user_prompts)])
+
+        return self._build_verify_result(ex, entities, system_prompts, user_prompts, list(answers))
+
+    @traced("parse", cat="example")
+    def _build_verify_result(self, ex: Dict[str, Any], entities: List[Dict[str, Any]], system_prompts: List[str],
+                             user_prompts: List[str], answers: List[str],
+                             scores: Optional[List[Optional[float]]] = None) -> Dict[str, Any]:
+        """
+        将每个实体的 LLM 回答解析为 yes/no 并汇总为单个样例的验证结果。
+        logprob 模式传入 scores（P(yes) 置信度），按阈值判定并在 verification 中附带 "score"。
+        """
         verification_items: List[Dict[str, Any]] = []
         trace_items: List[Dict[str, Any]] = []
 
-        # 2) 逐实体进行验证
-        for ent, sp, up in zip(entities, system_prompts, user_prompts):
+        for i, (ent, sp, up, llm_answer) in enumerate(zip(entities, system_prompts, user_prompts, answers)):
             name = ent.get("name", "")
             ct = ent.get("coarse_type", "")
-            llm_answer = self._call_llm(sys_prompt=sp, user_prompt=up)  # 返回字符串
-            yn = self._parse_yes_no(llm_answer)
+            if scores is None:
+                yn = self._parse_yes_no(llm_answer)
+            else:
+                yn = self._is_valid_by_score(scores[i], llm_answer)
 
-            verification_items.append({
+            item = {
                 "name": name,
                 "coarse_type": ct,
                 "is_valid": yn,
                 "llm_answer": llm_answer
-            })
+            }
+            if scores is not None:
+                item["score"] = scores[i]
+            verification_items.append(item)
 
             trace_items.append({
                 "name": name,
@@ -176,6 +381,55 @@ class SelfVerifier(LLMClient):
                 "llm_answer": llm_answer
             })
 
+        return self._finalize_verify_result(ex, entities, verification_items, trace_items)
+
+    @traced("parse", cat="example")
+    def _build_batch_verify_result(self, ex: Dict[str, Any], entities: List[Dict[str, Any]], system_prompt: str,
+                                   user_prompt: str, batch_answer: str, parsed: List[Optional[str]],
+                                   fallback: Dict[int, Tuple[str, str, str]]) -> Dict[str, Any]:
+        """
+        batch 模式：合并一次性回答与逐实体回退的结果，输出结构与 per_entity 模式一致。
+        fallback: {实体下标: (system_prompt, user_prompt, llm_answer)}
+        """
+        verification_items: List[Dict[str, Any]] = []
+        trace_items: List[Dict[str, Any]] = [{
+            "candidates": [{"name": e.get("name", ""), "coarse_type": e.get("coarse_type", "")} for e in entities],
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "llm_answer": batch_answer
+        }]
+
+        for i, ent in enumerate(entities):
+            name = ent.get("name", "")
+            ct = ent.get("coarse_type", "")
+            if i in fallback:
+                sp, up, llm_answer = fallback[i]
+                trace_items.append({
+                    "name": name,
+                    "coarse_type": ct,
+                    "system_prompt": sp,
+                    "user_prompt": up,
+                    "llm_answer": llm_answer
+                })
+                is_valid = self._parse_yes_no(llm_answer)
+            else:
+                llm_answer = parsed[i]
+                is_valid = self._parse_yes_no(llm_answer, strict=True)
+            verification_items.append({
+                "name": name,
+                "coarse_type": ct,
+                "is_valid": is_valid,
+                "llm_answer": llm_answer
+            })
+
+        return self._finalize_verify_result(ex, entities, verification_items, trace_items)
+
+    def _finalize_verify_result(self, ex: Dict[str, Any], entities: List[Dict[str, Any]],
+                                verification_items: List[Dict[str, Any]],
+                                trace_items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        unparsed = sum(1 for v in verification_items if v["is_valid"] is None)
+        if unparsed:
+            get_metrics().record_parse_failure(unparsed, **self._metric_labels())
         # 3) 提取判定为 True 的实体
         verified_entities = [
             {"name": v["name"], "coarse_type": v["coarse_type"]}
@@ -184,10 +438,10 @@ class SelfVerifier(LLMClient):
         ]
 
         return {
-            "id": sample_id,
+            "id": ex.get("id"),
             "source": ex.get("source"),
-            "sentence": sentence,
-            "coarse_types": coarse_list,
+            "sentence": ex.get("sentence", ""),
+            "coarse_types": list(ex.get("coarse_types", [])),
             "entities": entities,                 # 原始抽取的实体
             "verification": verification_items,   # 每个实体的验证结论
             "verified_entities": verified_entities,
@@ -195,24 +449,36 @@ class SelfVerifier(LLMClient):
         }
 
     # ===================== 批量处理并保存 =====================
-    def verify_and_save_all(self, ex_list: List[Dict[str, Any]], output_json_path: Union[str, os.PathLike]) -> Path:
+    def verify_and_save_all(self, ex_list: List[Dict[str, Any]], output_json_path: Union[str, os.PathLike],
+                            resume: Optional[bool] = None) -> Path:
         """
-        对传入的样例列表逐一自我验证，汇总为 JSON 并保存（若已存在则先删除后写入）。
+        对传入的样例列表逐一自我验证，汇总为 JSON 并保存（覆盖写入）。
+        - 每完成一个样例即追加到 <out>.jsonl；失败样例记录到 <out>.failed.jsonl 并继续处理其余样例；
+        - resume=True（默认读取 cfg.runtime.resume）时跳过 <out>.jsonl 中已完成、且输入预测未变的样例；
+          模型 / 验证模式 / prompt / 生成参数与上次运行不同时丢弃旧断点。
         返回输出文件的 Path。
         """
-        all_results: List[Dict[str, Any]] = []
+        if resume is None:
+            resume = bool(self.cfg.get("runtime", {}).get("resume", True))
+
         for idx, ex in enumerate(ex_list):
             # 若 id 为空则按顺序生成
             if not ex.get("id", ""):
                 ex["id"] = f"{idx}"
-            one = self.verify_for_one_example(ex)
-            all_results.append(one)
 
-        out_path = Path(output_json_path)
-        if out_path.exists():
-            out_path.unlink()
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        ckpt = JsonlCheckpoint(Path(output_json_path), resume=resume, fingerprint=self.run_fingerprint())
+        todo = [ex for ex in ex_list if not ckpt.is_done(ex["id"], record_hash(ex))]
+        if len(todo) < len(ex_list):
+            print(f"[INFO] 续跑：跳过 {len(ex_list) - len(todo)} 个已完成样例（{ckpt.jsonl_path}）")
+
+        try:
+            for ex in todo:
+                try:
+                    input_hash = record_hash(ex)
+                    ckpt.write(self.verify_for_one_example(ex), input_hash)
+                except Exception as e:
+                    ckpt.write_failure(ex["id"], e)
+        finally:
+            ckpt.close()
 
-        return out_path
+        return ckpt.finalize([ex["id"] for ex in ex_list])
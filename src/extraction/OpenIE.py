@@ -5,6 +5,8 @@ from dataclasses import asdict
 from src.extraction.information_extraction.openie_vllm_offline import VLLMOfflineOpenIE
 
 from src.extraction.utils.misc_utils import *
+from src.extraction.utils.metrics_utils import get_metrics, metric_labels
+from src.utils.tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +84,7 @@ class OpenIE:
     #
     #     print(f"NER 输出已保存到: {openie_results_path}")
 
+    @traced("pre_openie")
     def pre_openie(self, docs: Dict, temp=0.0, tp=0.0):
         logger.info(f"Performing OpenIE Offline")
 
@@ -91,26 +94,31 @@ class OpenIE:
         # new_openie_rows = {k : chunks[k] for k in chunk_keys_to_process}
 
         # if len(chunk_keys_to_process) > 0:
-        new_ner_results_list, new_triple_results_list = self.openie.batch_openie(docs, temp, tp)  # 批处理
+        with metric_labels(stage="openie", template=self.global_config.prompt), span("batch_openie"):
+            new_ner_results_list, new_triple_results_list = self.openie.batch_openie(docs, temp, tp)  # 批处理
         # self.merge_openie_results(all_openie_info, new_openie_rows, new_ner_results_dict, new_triple_results_dict)
 
         # 融入文档 ID
         doc_ids = list(docs.keys())
         new_ner_results_with_id = []
 
-        for doc_id, ner_str in zip(doc_ids, new_ner_results_list):
-            try:
-                ner_obj = json.loads(ner_str)  # 解析字符串
-            except json.JSONDecodeError:
-                ner_obj = {"entities": []}
-            # 将 ID 加入对象
-            ner_with_id = {"id": doc_id}
-            ner_with_id.update(ner_obj)
+        with span("parse"):
+            for doc_id, ner_str in zip(doc_ids, new_ner_results_list):
+                try:
+                    ner_obj = json.loads(ner_str)  # 解析字符串
+                except json.JSONDecodeError:
+                    get_metrics().record_parse_failure(stage="openie", template=self.global_config.prompt,
+                                                       backend=type(self.openie.llm_model).__name__)
+                    ner_obj = {"entities": []}
+                # 将 ID 加入对象
+                ner_with_id = {"id": doc_id}
+                ner_with_id.update(ner_obj)
 
-            new_ner_results_with_id.append(ner_with_id)
+                new_ner_results_with_id.append(ner_with_id)
 
         # if self.global_config.save_openie:
         # self.save_openie_results(new_ner_results_dict)
-        self.save_ner_outputs(new_ner_results_with_id, self.openie_results_path)
+        with span("write_output", path=self.openie_results_path):
+            self.save_ner_outputs(new_ner_results_with_id, self.openie_results_path)
 
         # assert False, logger.info('Done with OpenIE, run online indexing for future retrieval.') #终止程序运行
@@ -1,22 +1,196 @@
-import requests
+import asyncio
+import json
 import time, os
 from typing import Dict, Any, Optional, List
 
+from .utils.concurrency_utils import backoff_delay, parse_retry_after
+from .utils.http_utils import get_endpoint_pool
+from .utils.hedging_utils import Hedger
+from .utils.metrics_utils import current_labels, get_metrics, metric_labels
+from .utils.rate_limit_utils import get_rate_limiter
+from .utils.routing_utils import get_router, normalize_base_urls
+from .utils.singleflight_utils import get_single_flight
+from .utils.stream_utils import StreamReader
+from .llm.cache_store import TieredResponseCache, fingerprint_dir, get_response_cache, make_cache_key
+from .llm.cassette import Cassette, get_cassette
+from src.utils.tracing import span
+
 class LLMClient:
+    # 埋点标签：子类声明所属阶段，metrics_template 给出当前的 prompt 模板 / 模式
+    metrics_stage = "llm"
+    metrics_template: Optional[str] = None
+    # 断点续跑：cfg 中决定本阶段输出的配置段（如 "extraction"），计入运行指纹
+    run_cfg_section: Optional[str] = None
+
     def __init__(self, cfg: Dict[str, Any]):
         """
         初始化 LLM 客户端配置
         """
         self.cfg = cfg
         self.client = build_llm_client(cfg["llm"])
+        # 本实例累计的调用次数与 token 用量，便于比较不同抽取/验证模式的开销（命中缓存的请求不计入）
+        self.usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.cache = build_response_cache(cfg)
+        self.cache_namespace = cache_namespace(cfg)
+        self.cassette = build_cassette(cfg)
+        # 在途请求合并：进程内所有 LLMClient 共用，相同请求同时只发一次
+        self.flights = get_single_flight("llm_client")
 
     def _call_llm(self, sys_prompt: str, user_prompt: str, assistant_prompt: Optional[str] = None, fewshots: Optional[List[Dict[str, str]]] = None) -> str:
         """
         返回 LLM 的回答
         """
-        resp = self.client.chat(system=sys_prompt, user=user_prompt, assistant=assistant_prompt, fewshots=fewshots)
+        resp = self._call_llm_raw(sys_prompt, user_prompt, assistant_prompt, fewshots)
         # print(f"[DEBUG] LLM 返回内容：{resp}")
+        return self._content_or_count(resp)
+
+    async def _acall_llm(self, sys_prompt: str, user_prompt: str, assistant_prompt: Optional[str] = None, fewshots: Optional[List[Dict[str, str]]] = None) -> str:
+        """
+        _call_llm 的异步版本：走共享连接池，可在同一事件循环里并发大量请求
+        """
+        resp = await self._acall_llm_raw(sys_prompt, user_prompt, assistant_prompt, fewshots)
+        return self._content_or_count(resp)
+
+    def _call_llm_raw(self, sys_prompt: str, user_prompt: str, assistant_prompt: Optional[str] = None,
+                      fewshots: Optional[List[Dict[str, str]]] = None, **overrides: Any) -> Dict[str, Any]:
+        """
+        返回后端的原始响应（含 usage / logprobs 等字段）。
+        overrides 覆盖本次请求的生成参数，如 max_tokens、response_format=None、logprobs、top_logprobs。
+        """
+        labels = self._metric_labels()
+        with metric_labels(**labels), span("llm_call", cat="llm", **labels):
+            start = time.perf_counter()
+            key = self._request_key(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)
+            cached = self._cache_get(key)
+            if cached is not None:
+                self._record_call(start, "hit")
+                return cached
+
+            leader = []
+
+            def fetch():
+                leader.append(True)
+                resp = self._backend_chat(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)
+                self._record_usage(resp)
+                self._cache_put(key, resp)
+                return resp
+            # 相同请求仍在进行时（如多个样例含同一句子）等待并共享其结果，不再重复发送
+            try:
+                resp = self.flights.do(key, fetch)
+            except Exception:
+                self._record_call(start, "miss" if leader else "shared", ok=False)
+                raise
+            self._record_call(start, "miss" if leader else "shared", resp if leader else None)
+            return resp
+
+    async def _acall_llm_raw(self, sys_prompt: str, user_prompt: str, assistant_prompt: Optional[str] = None,
+                             fewshots: Optional[List[Dict[str, str]]] = None, **overrides: Any) -> Dict[str, Any]:
+        labels = self._metric_labels()
+        with metric_labels(**labels), span("llm_call", cat="llm", **labels):
+            start = time.perf_counter()
+            key = self._request_key(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)
+            cached = self._cache_get(key)
+            if cached is not None:
+                self._record_call(start, "hit")
+                return cached
+
+            leader = []
+
+            async def fetch():
+                leader.append(True)
+                resp = await self._abackend_chat(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)
+                self._record_usage(resp)
+                self._cache_put(key, resp)
+                return resp
+            try:
+                resp = await self.flights.ado(key, fetch)
+            except Exception:
+                self._record_call(start, "miss" if leader else "shared", ok=False)
+                raise
+            self._record_call(start, "miss" if leader else "shared", resp if leader else None)
+            return resp
+
+    # ---- 后端调用：开启 cassette 时录制（record）或回放（replay）请求/响应 ----
+    def _backend_chat(self, sys_prompt, user_prompt, assistant_prompt=None, fewshots=None, **overrides) -> Dict[str, Any]:
+        def live():
+            return self.client.chat(system=sys_prompt, user=user_prompt, assistant=assistant_prompt, fewshots=fewshots, **overrides)
+        if self.cassette is None:
+            return live()
+        request = self.client._build_request(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)[1]
+        return self.cassette.call(type(self.client).__name__, request, live)
+
+    async def _abackend_chat(self, sys_prompt, user_prompt, assistant_prompt=None, fewshots=None, **overrides) -> Dict[str, Any]:
+        def live():
+            return self.client.achat(system=sys_prompt, user=user_prompt, assistant=assistant_prompt, fewshots=fewshots, **overrides)
+        if self.cassette is None:
+            return await live()
+        request = self.client._build_request(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)[1]
+        return await self.cassette.acall(type(self.client).__name__, request, live)
+
+    # ---- 响应缓存与在途合并：以完整请求体（模型、messages、temperature、max_tokens、response_format 等）为键 ----
+    def _request_key(self, sys_prompt, user_prompt, assistant_prompt=None, fewshots=None, **overrides) -> str:
+        request = self.client._build_request(sys_prompt, user_prompt, assistant_prompt, fewshots, **overrides)
+        # 流式与非流式拼装出的响应结构相同，切换 llm.stream 不应使缓存失效
+        body = {k: v for k, v in request[1].items() if k not in ("stream", "stream_options")}
+        return make_cache_key({"provider": type(self.client).__name__, "namespace": self.cache_namespace, "body": body})
+
+    # 开启 cassette 时不读写响应缓存：录制要覆盖每一次请求（缓存命中不会经过 cassette，回放时会缺条目），
+    # 回放也应按录制的耗时返回且不写入真实缓存
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.cache is None or self.cassette is not None:
+            return None
+        row = self.cache.get(key)
+        return json.loads(row[0]) if row is not None else None
+
+    def _cache_put(self, key: str, resp: Any) -> None:
+        if self.cache is None or self.cassette is not None or not isinstance(resp, dict):
+            return
+        self.cache.put(key, json.dumps(resp, ensure_ascii=False), {"usage": resp.get("usage") or {}},
+                       namespace=self.cache_namespace)
+
+    # ---- 断点续跑：运行指纹与上次不一致时不复用 <输出>.jsonl ----
+    def run_fingerprint(self) -> Dict[str, Any]:
+        """决定本阶段输出的配置：阶段与模式、后端与模型、prompt 目录内容指纹、生成参数及本阶段的配置段"""
+        llm_cfg = self.cfg["llm"]
+        return {
+            "stage": self.metrics_stage,
+            "mode": self.metrics_template,
+            "provider": type(self.client).__name__,
+            "model": self.client.model,
+            "prompts": fingerprint_dir(self.cfg.get("paths", {}).get("prompt_dir", "")),
+            "generation": {k: llm_cfg.get(k) for k in ("temperature", "max_tokens", "response_format")},
+            "settings": self.cfg.get(self.run_cfg_section) if self.run_cfg_section else None,
+        }
 
+    # ---- 埋点：按 backend / stage / 模板记录延迟、缓存命中、token 与解析失败 ----
+    def _metric_labels(self) -> Dict[str, str]:
+        # 调用方用 metric_labels() 声明的 stage / template 优先于实例默认值
+        labels = {"stage": self.metrics_stage, "template": self.metrics_template}
+        labels.update(current_labels())
+        labels["backend"] = type(self.client).__name__
+        return labels
+
+    def _record_call(self, start: float, cache: str, resp: Any = None, ok: bool = True) -> None:
+        usage = _usage_of(resp)
+        get_metrics().record_call(type(self.client).__name__, time.perf_counter() - start, cache=cache, ok=ok,
+                                  prompt_tokens=usage[0], completion_tokens=usage[1])
+
+    def _content_or_count(self, resp: Any) -> str:
+        try:
+            return self._extract_content(resp)
+        except RuntimeError:
+            get_metrics().record_parse_failure(**self._metric_labels())
+            raise
+
+    def _record_usage(self, resp: Any) -> None:
+        # OpenAI/vLLM: usage.prompt_tokens / completion_tokens；Ollama: prompt_eval_count / eval_count
+        self.usage["calls"] += 1
+        prompt_tokens, completion_tokens = _usage_of(resp)
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+
+    @staticmethod
+    def _extract_content(resp: Any) -> str:
         # 兼容两种返回结构：1) Ollama /api/chat: {"message":{"content":"..."}}
         # 2) OpenAI/vLLM /v1/chat/completions: {"choices":[{"message":{"content":"..."}}]}
         content = None
@@ -32,84 +206,387 @@ class LLMClient:
             raise RuntimeError(f"LLM 返回结构不含文本内容: {str(resp)[:500]}")
 
         return content
-    
+
+def _usage_of(resp: Any) -> tuple:
+    """(prompt_tokens, completion_tokens)；OpenAI/vLLM 读 usage，Ollama 读 prompt_eval_count / eval_count"""
+    if not isinstance(resp, dict):
+        return 0, 0
+    usage = resp.get("usage") or {}
+    return (int(usage.get("prompt_tokens") or resp.get("prompt_eval_count") or 0),
+            int(usage.get("completion_tokens") or resp.get("eval_count") or 0))
+
+def build_messages(system, user, assistant=None, fewshots=None) -> List[Dict[str, str]]:
+    messages = []
+    if system: messages.append({"role":"system","content":system})
+    if assistant: messages.append({"role":"assistant","content":assistant})
+    if fewshots: messages.extend(fewshots)
+    messages.append({"role":"user","content":user})
+    # print(f"[PROMPT]\n")
+    # print("\n".join(f"[{m['role']}] {m['content']}" for m in messages))
+    return messages
+
+RETRY_STATUS = (429,500,502,503,504)
+
+def _retry_delay(r, attempt):
+    """可重试响应的等待时间：优先服从服务端的 Retry-After，否则带抖动的指数退避"""
+    return backoff_delay(attempt, parse_retry_after(r.headers.get("Retry-After")))
+
 # ---- 两个轻量客户端 ----
-class OllamaClient:
+class _RoutedEndpoints:
+    """
+    两个客户端共用的请求发送：base_url 可以是多个副本，每次尝试由路由器挑选在途最少的健康副本，
+    重试自然落到其他副本上；连接错误 / 超时 / 5xx 计为该副本的失败（429 只是限流，不计）。
+    开启对冲（hedging_cfg）时，chat / achat 超过近期延迟分位数仍未返回会再发一份，先返回者生效。
+    配置了 RPM / TPM（rate_limit_cfg）时，每次尝试先按估算用量向限速器预约配额，返回后按 usage 修正。
+    开启流式（stream）时逐行读取增量，JSON 模式下第一个 JSON 对象完整即关闭连接，返回值与非流式结构相同。
+    """
+    def _init_endpoints(self, base_url, timeout, pool_cfg=None, routing_cfg=None, hedging_cfg=None, rate_limit_cfg=None):
+        urls = normalize_base_urls(base_url)
+        self.base_urls = urls
+        self.base_url = urls[0]
+        self.pools = {u: get_endpoint_pool(u, timeout=timeout, **(pool_cfg or {})) for u in urls}
+        self.router = get_router(urls, **(routing_cfg or {}))
+        self.hedger = Hedger(**hedging_cfg) if hedging_cfg else None
+        # 配额按服务商账号 + 模型计，同一组 endpoint、同一模型的客户端共享一个限速器
+        self.rate_limiter = (get_rate_limiter(f"{','.join(urls)}|{self.model}", **rate_limit_cfg)
+                             if rate_limit_cfg else None)
+
+    def chat(self, system, user, assistant=None, fewshots=None, **overrides):
+        if self.hedger is None:
+            return self._chat(system, user, assistant, fewshots, **overrides)
+        # 按 max_tokens 区分请求类别：1-token 验证与完整抽取的延迟分布差别很大
+        return self.hedger.run(lambda: self._chat(system, user, assistant, fewshots, **overrides),
+                               kind=overrides.get("max_tokens"))
+
+    async def achat(self, system, user, assistant=None, fewshots=None, **overrides):
+        if self.hedger is None:
+            return await self._achat(system, user, assistant, fewshots, **overrides)
+        return await self.hedger.arun(lambda: self._achat(system, user, assistant, fewshots, **overrides),
+                                      kind=overrides.get("max_tokens"))
+
+    @staticmethod
+    def _token_budget(payload):
+        """本次请求最多生成的 token 数（OpenAI: max_tokens；Ollama: options.num_predict）"""
+        if "max_tokens" in payload:
+            return int(payload["max_tokens"] or 0)
+        return int((payload.get("options") or {}).get("num_predict") or 0)
+
+    def _settle_rate_limit(self, ticket, r, reader=None):
+        if r.status_code == 429:
+            self.rate_limiter.penalize()
+        prompt = total = None
+        if r.status_code == 200:
+            try:
+                data = reader.response() if reader is not None else r.json()
+            except ValueError:
+                data = {}
+            usage = data.get("usage") or {}
+            if usage.get("total_tokens") is not None:
+                prompt, total = usage.get("prompt_tokens"), int(usage["total_tokens"])
+            elif data.get("prompt_eval_count") is not None:
+                prompt = int(data["prompt_eval_count"])
+                total = prompt + int(data.get("eval_count") or 0)
+        elif r.status_code < 500:
+            # 请求被拒绝，没有生成 token；5xx 可能已计费，保守地保留估算值
+            total = 0
+        self.rate_limiter.settle(ticket, prompt, total)
+
+    def _note_retry(self, attempt, reason):
+        """失败的尝试之后还会再试时计一次重试（reason 为状态码或异常类型）"""
+        if attempt < self.retry:
+            get_metrics().record_retry(type(self).__name__, reason)
+
+    def _send(self, path, payload, headers=None):
+        """
+        一次尝试：返回 (HTTP 响应, 成功时的响应体)；流式请求的响应体由 StreamReader 拼装。
+        流中报错或中途断开时 _post 抛出 StreamError（副本与自适应上限都记为失败），交给重试逻辑处理。
+        """
+        reader = self._stream_reader(payload)
+        r = self._post(path, reader=reader, json=payload, headers=headers)
+        if r.status_code != 200:
+            return r, None
+        return r, reader.response() if reader is not None else r.json()
+
+    async def _asend(self, path, payload, headers=None):
+        reader = self._stream_reader(payload)
+        r = await self._apost(path, reader=reader, json=payload, headers=headers)
+        if r.status_code != 200:
+            return r, None
+        return r, reader.response() if reader is not None else r.json()
+
+    def _post(self, path, reader=None, **kwargs):
+        ticket = None
+        if self.rate_limiter is not None:
+            payload = kwargs.get("json") or {}
+            ticket = self.rate_limiter.acquire(payload, self._token_budget(payload))
+        ep = self.router.acquire()
+        start = time.monotonic()
+        try:
+            # 流式响应读完后先检查是否出错 / 完整，再向路由器报告该副本的结果
+            r = self.pools[ep.base_url].post(ep.base_url + path, on_line=reader.feed_line if reader else None,
+                                             on_end=reader.check if reader else None, **kwargs)
+        except Exception:
+            self.router.release(ep, time.monotonic() - start, ok=False)
+            raise
+        self.router.release(ep, time.monotonic() - start, ok=r.status_code < 500)
+        if ticket is not None:
+            self._settle_rate_limit(ticket, r, reader)
+        return r
+
+    async def _apost(self, path, reader=None, **kwargs):
+        ticket = None
+        if self.rate_limiter is not None:
+            payload = kwargs.get("json") or {}
+            ticket = await self.rate_limiter.aacquire(payload, self._token_budget(payload))
+        ep = self.router.acquire()
+        start = time.monotonic()
+        try:
+            r = await self.pools[ep.base_url].apost(ep.base_url + path, on_line=reader.feed_line if reader else None,
+                                                    on_end=reader.check if reader else None, **kwargs)
+        except asyncio.CancelledError:
+            # 被对冲请求取代或调用方取消：既不算副本故障，也不能当作试探成功
+            self.router.release(ep, time.monotonic() - start, ok=None)
+            raise
+        except Exception:
+            self.router.release(ep, time.monotonic() - start, ok=False)
+            raise
+        self.router.release(ep, time.monotonic() - start, ok=r.status_code < 500)
+        if ticket is not None:
+            self._settle_rate_limit(ticket, r, reader)
+        return r
+
+class OllamaClient(_RoutedEndpoints):
     def __init__(self, base_url, model, temperature=0.0, max_tokens=1024,
-                 response_format="json_object", retry=3, timeout=60, alias_map=None):
-        self.base_url = base_url.rstrip("/")
+                 response_format="json_object", retry=3, timeout=60, alias_map=None, pool_cfg=None, routing_cfg=None, hedging_cfg=None,
+                 rate_limit_cfg=None, stream=False):
         self.model = (alias_map or {}).get(model, model)
         self.temperature = float(temperature)
         self.max_tokens = int(max_tokens)
         self.response_format = response_format
+        self.stream = bool(stream)
         self.retry = int(retry); self.timeout = int(timeout)
+        self._init_endpoints(base_url, self.timeout, pool_cfg, routing_cfg, hedging_cfg, rate_limit_cfg)
 
-    def chat(self, system, user, assistant=None, fewshots=None):
-        messages = []
-        if system: messages.append({"role":"system","content":system})
-        if assistant: messages.append({"role":"assistant","content":assistant})
-        if fewshots: messages.extend(fewshots)
-        messages.append({"role":"user","content":user})
-        # print(f"[PROMPT]\n")
-        # print("\n".join(f"[{m['role']}] {m['content']}" for m in messages))
+    def _build_request(self, system, user, assistant=None, fewshots=None, **overrides):
+        messages = build_messages(system, user, assistant, fewshots)
         payload = {
-            "model": self.model, "messages": messages, "stream": False,
-            "options": {"temperature": self.temperature, "num_predict": self.max_tokens}
+            "model": self.model, "messages": messages, "stream": self.stream,
+            "options": {"temperature": overrides.pop("temperature", self.temperature),
+                        "num_predict": overrides.pop("max_tokens", self.max_tokens)}
         }
-        if self.response_format == "json_object":
+        if overrides.pop("response_format", self.response_format) == "json_object":
             payload["format"] = "json"
-        url = f"{self.base_url}/api/chat"
+        payload.update(overrides)
+        return "/api/chat", payload
+
+    @staticmethod
+    def _stream_reader(payload):
+        if not payload.get("stream"):
+            return None
+        return StreamReader("ollama", stop_at_json=payload.get("format") == "json")
+
+    def _chat(self, system, user, assistant=None, fewshots=None, **overrides):
+        path, payload = self._build_request(system, user, assistant, fewshots, **overrides)
+        last = None
+        for a in range(1, self.retry+1):
+            try:
+                r, resp = self._send(path, payload)
+                if r.status_code == 200:
+                    return resp  # {"message":{"content": "..."}}
+                if r.status_code in RETRY_STATUS:
+                    self._note_retry(a, r.status_code)
+                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); time.sleep(_retry_delay(r, a)); continue
+                r.raise_for_status()
+            except Exception as e:
+                self._note_retry(a, type(e).__name__)
+                last = e; time.sleep(backoff_delay(a))
+        raise last or RuntimeError("ollama failed")
+
+    async def _achat(self, system, user, assistant=None, fewshots=None, **overrides):
+        path, payload = self._build_request(system, user, assistant, fewshots, **overrides)
         last = None
         for a in range(1, self.retry+1):
             try:
-                r = requests.post(url, json=payload, timeout=self.timeout)
-                if r.status_code == 200: 
-                    return r.json()  # {"message":{"content": "..."}}
-                if r.status_code in (429,500,502,503,504):
-                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); time.sleep(min(2**a,10)); continue
+                r, resp = await self._asend(path, payload)
+                if r.status_code == 200:
+                    return resp
+                if r.status_code in RETRY_STATUS:
+                    self._note_retry(a, r.status_code)
+                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); await asyncio.sleep(_retry_delay(r, a)); continue
                 r.raise_for_status()
             except Exception as e:
-                last = e; time.sleep(min(2**a,10))
+                self._note_retry(a, type(e).__name__)
+                last = e; await asyncio.sleep(backoff_delay(a))
         raise last or RuntimeError("ollama failed")
 
-class OpenAICompatClient:
+class OpenAICompatClient(_RoutedEndpoints):
     def __init__(self, base_url, model, api_key=None, temperature=0.0, max_tokens=1024,
-                 response_format="json_object", retry=3, timeout=60):
-        self.base_url = base_url.rstrip("/")
+                 response_format="json_object", retry=3, timeout=60, pool_cfg=None, routing_cfg=None, hedging_cfg=None,
+                 rate_limit_cfg=None, stream=False):
         self.model = model; self.api_key = api_key or ""
         self.temperature = float(temperature); self.max_tokens = int(max_tokens)
         self.response_format = response_format; self.retry = int(retry); self.timeout = int(timeout)
+        self.stream = bool(stream)
+        self._init_endpoints(base_url, self.timeout, pool_cfg, routing_cfg, hedging_cfg, rate_limit_cfg)
 
-    def chat(self, system, user, assistant=None, fewshots=None):
-        messages = []
-        if system: messages.append({"role":"system","content":system})
-        if assistant: messages.append({"role":"assistant","content":assistant})
-        if fewshots: messages.extend(fewshots)
-        messages.append({"role":"user","content":user})
-        # print(f"[PROMPT]\n")
-        # print("\n".join(f"[{m['role']}] {m['content']}" for m in messages))
+    def _build_request(self, system, user, assistant=None, fewshots=None, **overrides):
+        messages = build_messages(system, user, assistant, fewshots)
         body = {"model": self.model, "messages": messages,
-                "temperature": self.temperature, "max_tokens": self.max_tokens}
-        if self.response_format == "json_object":
+                "temperature": overrides.pop("temperature", self.temperature),
+                "max_tokens": overrides.pop("max_tokens", self.max_tokens)}
+        if overrides.pop("response_format", self.response_format) == "json_object":
             body["response_format"] = {"type":"json_object"}
+        body.update(overrides)  # 如 logprobs / top_logprobs
+        # logprob 验证只生成 1 个 token，流式没有收益，且增量里的 logprobs 需另行拼装
+        if self.stream and not body.get("logprobs"):
+            body["stream"] = True
+            body["stream_options"] = {"include_usage": True}
         headers = {"Content-Type":"application/json"}
         if self.api_key: headers["Authorization"] = f"Bearer {self.api_key}"
-        url = f"{self.base_url}/v1/chat/completions"
+        return "/v1/chat/completions", body, headers
+
+    @staticmethod
+    def _stream_reader(body):
+        if not body.get("stream"):
+            return None
+        return StreamReader("openai", stop_at_json=(body.get("response_format") or {}).get("type") == "json_object")
+
+    def _chat(self, system, user, assistant=None, fewshots=None, **overrides):
+        path, body, headers = self._build_request(system, user, assistant, fewshots, **overrides)
         last=None
         for a in range(1, self.retry+1):
             try:
-                r = requests.post(url, json=body, headers=headers, timeout=self.timeout)
-                if r.status_code == 200: return r.json() 
-                if r.status_code in (429,500,502,503,504):
-                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); time.sleep(min(2**a,10)); continue
+                r, resp = self._send(path, body, headers)
+                if r.status_code == 200: return resp
+                if r.status_code in RETRY_STATUS:
+                    self._note_retry(a, r.status_code)
+                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); time.sleep(_retry_delay(r, a)); continue
                 r.raise_for_status()
             except Exception as e:
-                last=e; time.sleep(min(2**a,10))
+                self._note_retry(a, type(e).__name__)
+                last=e; time.sleep(backoff_delay(a))
         raise last or RuntimeError("openai-compatible failed")
-    
+
+    async def _achat(self, system, user, assistant=None, fewshots=None, **overrides):
+        path, body, headers = self._build_request(system, user, assistant, fewshots, **overrides)
+        last=None
+        for a in range(1, self.retry+1):
+            try:
+                r, resp = await self._asend(path, body, headers)
+                if r.status_code == 200: return resp
+                if r.status_code in RETRY_STATUS:
+                    self._note_retry(a, r.status_code)
+                    last = RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}"); await asyncio.sleep(_retry_delay(r, a)); continue
+                r.raise_for_status()
+            except Exception as e:
+                self._note_retry(a, type(e).__name__)
+                last=e; await asyncio.sleep(backoff_delay(a))
+        raise last or RuntimeError("openai-compatible failed")
+
+def _pool_cfg(llm_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    读取 llm.pool 配置（均可省略）：
+      max_connections / max_keepalive：每个 endpoint 的连接数上限
+      max_in_flight：每个 endpoint 的异步在途请求上限
+      http2：服务端支持时启用 HTTP/2（需安装 h2）
+      adaptive：按 AIMD 自动调整每个 endpoint 的在途上限（不超过 max_in_flight），遇到 429/503/超时减半并服从 Retry-After；
+        可为 true 或 {initial, min, backoff, latency_tolerance}
+    """
+    pool = dict(llm_cfg.get("pool") or {})
+    adaptive = pool.get("adaptive")
+    if adaptive is True:
+        pool["adaptive"] = {"enable": True}
+    elif not isinstance(adaptive, dict) or not adaptive.get("enable", True):
+        pool.pop("adaptive", None)
+    keys = ("max_connections", "max_keepalive", "max_in_flight", "http2", "adaptive")
+    return {k: pool[k] for k in keys if k in pool}
+
+def _routing_cfg(llm_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    读取 llm.routing 配置（base_url 为多个副本时生效，均可省略）：
+      eject_after：连续失败多少次后摘除该副本；cooldown_s：摘除时长（秒），到期后只放行一个试探请求，成功才恢复分配
+    """
+    routing = llm_cfg.get("routing") or {}
+    out = {}
+    if "eject_after" in routing:
+        out["eject_after"] = int(routing["eject_after"])
+    if "cooldown_s" in routing:
+        out["cooldown"] = float(routing["cooldown_s"])
+    return out
+
+def _hedging_cfg(llm_cfg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    读取 llm.hedging 配置（enable 为 false 时返回 None，不对冲）：
+      percentile：超过近期延迟的该分位数仍未返回时发出对冲请求；max_extra：对冲请求数占原请求数的上限；
+      min_samples：延迟样本数达到后才开始对冲；min_delay_s：对冲等待时间的下限（秒）
+    """
+    hedging = llm_cfg.get("hedging") or {}
+    if not hedging.get("enable", False):
+        return None
+    return {"percentile": float(hedging.get("percentile", 95)), "max_extra": float(hedging.get("max_extra", 0.05)),
+            "min_samples": int(hedging.get("min_samples", 20)), "min_delay": float(hedging.get("min_delay_s", 0.0))}
+
+def _rate_limit_cfg(llm_cfg: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    读取 llm.rate_limit 配置（rpm / tpm 都未配置或 enable 为 false 时返回 None，不限速）：
+      rpm / tpm：服务商给出的每分钟请求数 / token 数配额；
+      headroom：按配额的该比例持续放行，其余作为突发容量，保证任意一分钟内不超过配额
+    """
+    rate_limit = llm_cfg.get("rate_limit") or {}
+    if not rate_limit.get("enable", True) or not (rate_limit.get("rpm") or rate_limit.get("tpm")):
+        return None
+    return {"rpm": rate_limit.get("rpm"), "tpm": rate_limit.get("tpm"),
+            "headroom": float(rate_limit.get("headroom", 0.9))}
+
+def build_response_cache(cfg: Dict[str, Any]) -> Optional[TieredResponseCache]:
+    """
+    读取 llm.cache 配置构建磁盘响应缓存（未开启时返回 None）：
+      enable：是否开启；dir：缓存目录（默认 <paths.output_dir>/llm_cache）；
+      max_mb：缓存文件大小上限，超出后按 LRU 淘汰（省略则不限制）；
+      memory_entries / memory_mb：磁盘前的进程内 LRU 层的条目数与大小上限（memory_entries 为 0 时关闭）；
+      ttl_hours：条目有效期（省略则永不过期）；compress：是否以训练出的字典压缩存储响应（默认开启）。
+    同一文件的缓存在进程内共享，抽取与验证的命中统计合并计算。
+    """
+    cache_cfg = cfg["llm"].get("cache") or {}
+    if not cache_cfg.get("enable", False):
+        return None
+    cache_dir = cache_cfg.get("dir") or os.path.join(cfg.get("paths", {}).get("output_dir", "./outputs"), "llm_cache")
+    filename = f"{str(cfg['llm']['model']).replace('/', '_')}_client_cache.sqlite"
+    max_mb = cache_cfg.get("max_mb")
+    memory_mb = cache_cfg.get("memory_mb", 64)
+    ttl_hours = cache_cfg.get("ttl_hours")
+    return get_response_cache(os.path.join(cache_dir, filename),
+                              max_bytes=int(float(max_mb) * 1024 * 1024) if max_mb else None,
+                              memory_entries=int(cache_cfg.get("memory_entries", 4096)),
+                              memory_bytes=int(float(memory_mb) * 1024 * 1024) if memory_mb else None,
+                              ttl=float(ttl_hours) * 3600 if ttl_hours else None,
+                              compress=bool(cache_cfg.get("compress", True)))
+
+def build_cassette(cfg: Dict[str, Any]) -> Optional[Cassette]:
+    """
+    读取 llm.cassette 配置（mode 为 off 时返回 None）：
+      mode：off / record（照常请求后端并录制请求、响应与耗时）/ replay（不访问后端，从录制文件回放）；
+      path：录制文件（JSONL）；replay_latency：回放时是否按录制的耗时等待。
+    """
+    cassette_cfg = cfg["llm"].get("cassette") or {}
+    return get_cassette(cassette_cfg.get("path"), cassette_cfg.get("mode", "off"),
+                        replay_latency=bool(cassette_cfg.get("replay_latency", False)))
+
+def cache_namespace(cfg: Dict[str, Any]) -> str:
+    """
+    缓存命名空间：默认为 "<模型>@<prompt 目录内容指纹>"，修改任一 prompt 文件后自动切换到新命名空间，
+    旧条目可用 `python -m src.extraction.llm.cache_cli purge --namespace ...` 清理；也可用 llm.cache.namespace 显式指定。
+    """
+    cache_cfg = cfg["llm"].get("cache") or {}
+    if cache_cfg.get("namespace"):
+        return str(cache_cfg["namespace"])
+    prompt_dir = cfg.get("paths", {}).get("prompt_dir", "")
+    return f"{cfg['llm']['model']}@{fingerprint_dir(prompt_dir)}"
+
 def build_llm_client(llm_cfg: Dict[str, Any]):
     """
-    根据配置构建 LLM 客户端
+    根据配置构建 LLM 客户端。
+    llm.base_url 可以是多个副本的列表（或逗号分隔的字符串），请求按最少在途数分发到健康副本。
     """
     provider = (llm_cfg.get("provider") or "").lower()
     if provider == "ollama":
@@ -126,7 +603,12 @@ def build_llm_client(llm_cfg: Dict[str, Any]):
             response_format=llm_cfg.get("response_format","json_object"),
             retry=llm_cfg.get("retry",3),
             timeout=llm_cfg.get("timeout",60),
-            alias_map=alias_map
+            alias_map=alias_map,
+            pool_cfg=_pool_cfg(llm_cfg),
+            routing_cfg=_routing_cfg(llm_cfg),
+            hedging_cfg=_hedging_cfg(llm_cfg),
+            rate_limit_cfg=_rate_limit_cfg(llm_cfg),
+            stream=bool(llm_cfg.get("stream", False))
         )
     # default: openai-compatible
     base_url = llm_cfg.get("base_url", os.environ.get("OPENAI_BASE_URL","http://127.0.0.1:8000"))
@@ -135,5 +617,8 @@ def build_llm_client(llm_cfg: Dict[str, Any]):
         temperature=llm_cfg.get("temperature",0.0),
         max_tokens=llm_cfg.get("max_tokens",1024),
         response_format=llm_cfg.get("response_format","json_object"),
-        retry=llm_cfg.get("retry",3), timeout=llm_cfg.get("timeout",60)
+        retry=llm_cfg.get("retry",3), timeout=llm_cfg.get("timeout",60),
+        pool_cfg=_pool_cfg(llm_cfg), routing_cfg=_routing_cfg(llm_cfg),
+        hedging_cfg=_hedging_cfg(llm_cfg), rate_limit_cfg=_rate_limit_cfg(llm_cfg),
+        stream=bool(llm_cfg.get("stream", False))
     )
\ No newline at end of file
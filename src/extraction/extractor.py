@@ -13,6 +13,9 @@ torch._dynamo.disable()
 from src.extraction.OpenIE import OpenIE
 from src.extraction.utils.misc_utils import string_to_bool
 from src.extraction.utils.config_utils import BaseConfig
+from src.extraction.utils.metrics_utils import get_metrics
+from src.utils.tracing import get_tracer, span
+from src.utils.memprof import MemoryProfiler, format_report
 
 import argparse
 
@@ -40,6 +43,16 @@ def extractor(dataset: str, mode, temp, tp):
     parser.add_argument('--llm_name', type=str, default=llm_name, help='LLM name')
     parser.add_argument('--save_dir', type=str, default='outputs', help='Save directory')
     parser.add_argument('--prompt', type=str, default=f'openIE')
+    parser.add_argument('--cassette_mode', type=str, default='off', choices=['off', 'record', 'replay'],
+                        help='record: 录制 LLM 请求/响应；replay: 不加载模型，从录制文件回放')
+    parser.add_argument('--cassette_path', type=str, default=None, help='录制文件路径')
+    parser.add_argument('--replay_latency', action='store_true', help='回放时按录制的耗时等待')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='记录各阶段耗时并导出 Chrome trace JSON 到该路径（chrome://tracing 或 ui.perfetto.dev 打开）')
+    parser.add_argument('--memory_profile', action='store_true',
+                        help='按阶段记录峰值 RSS 与 tracemalloc 增长最多的分配位置，报告写到 <save_dir>/memory_report.json')
+    parser.add_argument('--metrics_interval', type=float, default=30,
+                        help='运行中每隔多少秒写一次 <save_dir>/metrics/metrics.{json,prom}，0 表示只在结束时写')
     args = parser.parse_args()
 
     dataset_name = args.dataset
@@ -50,9 +63,16 @@ def extractor(dataset: str, mode, temp, tp):
     else:
         save_dir = save_dir + '/' + dataset_name
 
+    tracer = get_tracer()
+    if args.trace:
+        tracer.enable()
+    profiler = MemoryProfiler() if args.memory_profile else None
+    if profiler is not None:
+        profiler.start()
+
     corpus_path = f"/home/penglin.ge/code/OpenIE/data/{dataset_name}.json"
     # corpus_path = f"reproduce/dataset/{dataset_name}_corpus.json" #语料库，title+text
-    with open(corpus_path, "r") as f:
+    with span("load_dataset", path=corpus_path), open(corpus_path, "r") as f:
         corpus = json.load(f)
 
     # 读取实体
@@ -70,39 +90,53 @@ def extractor(dataset: str, mode, temp, tp):
             entities_list = json.load(f)
         id2triples = {item["id"]: item.get("triples", []) for item in entities_list}
 
-    docs = {}
-    for i, item in enumerate(corpus):
-        if args.prompt == 'ner_2':
-            item_no_id = {k: v for k, v in item.items() if
-                          k == "sentence" or k == "coarse_types" or k == "schema"}  # 去掉 id  or k == "coarse_types"
-        elif args.prompt == 'ner_1' or args.prompt == 'openIE':
-            item_no_id = {k: v for k, v in item.items() if
-                          k == "sentence" or k == "coarse_types" or k == "schema"}  # 去掉 id
-        else:
-            item_no_id = {k: v for k, v in item.items() if k == "sentence"}  # 去掉 id
+    with span("build_docs"):  # 每条语料 json.dumps 成 prompt 输入
+        docs = {}
+        for i, item in enumerate(corpus):
+            if args.prompt == 'ner_2':
+                item_no_id = {k: v for k, v in item.items() if
+                              k == "sentence" or k == "coarse_types" or k == "schema"}  # 去掉 id  or k == "coarse_types"
+            elif args.prompt == 'ner_1' or args.prompt == 'openIE':
+                item_no_id = {k: v for k, v in item.items() if
+                              k == "sentence" or k == "coarse_types" or k == "schema"}  # 去掉 id
+            else:
+                item_no_id = {k: v for k, v in item.items() if k == "sentence"}  # 去掉 id
 
-        item_id = item.get("id", i)
+            item_id = item.get("id", i)
 
-        if args.prompt == 'ner_2':
-            item_no_id["entities"] = id2entities.get(item_id, [])
-        if args.prompt == 'ner_3':
-            item_no_id["triples"] = id2triples.get(item_id, [])
+            if args.prompt == 'ner_2':
+                item_no_id["entities"] = id2entities.get(item_id, [])
+            if args.prompt == 'ner_3':
+                item_no_id["triples"] = id2triples.get(item_id, [])
 
-        json_str = json.dumps(item_no_id, ensure_ascii=False, indent=2)
-        docs[item_id] = json_str  # 保留 id 对应的内容（不含 id）
+            json_str = json.dumps(item_no_id, ensure_ascii=False, indent=2)
+            docs[item_id] = json_str  # 保留 id 对应的内容（不含 id）
 
     config = BaseConfig(
         save_dir=save_dir,
         llm_name=llm_name,
         dataset=dataset_name,
         prompt=args.prompt,
+        llm_cassette_mode=args.cassette_mode,
+        llm_cassette_path=args.cassette_path,
+        llm_cassette_replay_latency=args.replay_latency,
     )
 
     logging.basicConfig(level=logging.INFO)
     llm = OpenIE(global_config=config)
 
     # hipporag.index(docs) #openIE
-    llm.pre_openie(docs, temp, tp)
+    metrics = get_metrics()
+    metrics.start_flush(os.path.join(save_dir, "metrics"), args.metrics_interval)
+    try:
+        llm.pre_openie(docs, temp, tp)
+    finally:
+        print("[INFO] LLM 调用埋点：", metrics.close())
+        if tracer.enabled:
+            print("[INFO] 阶段耗时追踪：", tracer.export(args.trace))
+        if profiler is not None:
+            mem_path = os.path.join(save_dir, "memory_report.json")
+            print(f"[INFO] 分阶段内存报告：{mem_path}\n{format_report(profiler.stop(mem_path))}")
 
     # search_best_params(hipporag, docs)
 
@@ -1,10 +1,15 @@
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import re, json, os
+import asyncio
 
 from .client import LLMClient
+from .utils.http_utils import aclose_all_pools
+from src.utils.io_tools import JsonlCheckpoint, record_hash
+from src.utils.tracing import traced
 
 class EntityExtractor(LLMClient): 
+    @traced("render_prompt", cat="example")
     def _make_prompt_by_coarse_type(self, ex: Dict[str, Any]) -> tuple[List[str], List[str]]:
         """
         根据传入的样本构造根据 coarse_types 抽取实体的 user_prompt
@@ -29,6 +34,39 @@ class EntityExtractor(LLMClient):
 
         return system_prompts, user_prompts
 
+    @traced("render_prompt", cat="example")
+    def _make_prompt_multi_type(self, ex: Dict[str, Any]) -> tuple[str, str]:
+        """
+        multi_type 模式：根据传入的样本构造一次性标注所有 coarse_types 的 system_prompt 与 user_prompt
+        """
+        coarse_types = ex.get('coarse_types', [])
+        sentence = ex.get('sentence', '')
+
+        system_prompt = self._read_prompt("system_multi_types_prompt.txt")
+        user_prompt = (self._read_prompt("user_multi_types_prompt.txt")
+                       .replace("[Sentence]", sentence)
+                       .replace("[Entity Types]", json.dumps(list(coarse_types), ensure_ascii=False)))
+        return system_prompt, user_prompt
+
+    metrics_stage = "extract"
+    run_cfg_section = "extraction"
+
+    @property
+    def metrics_template(self) -> str:
+        return self.extract_mode
+
+    @property
+    def extract_mode(self) -> str:
+        """
+        抽取模式（cfg.extraction.mode）：
+        - "per_type"：每个 coarse_type 单独一次调用，标注为 @@实体##（默认）；
+        - "multi_type"：每个样例一次调用，标注为 @@实体##类型。
+        """
+        mode = self.cfg.get("extraction", {}).get("mode", "per_type")
+        if mode not in ("per_type", "multi_type"):
+            raise ValueError(f"未知的抽取模式: {mode}，可选 per_type / multi_type")
+        return mode
+
     def _read_prompt(self, filename: str) -> str:
         """从 cfg.paths.prompt_dir 读取模板文本"""
         prompt_dir = Path(self.cfg.get("paths", {}).get("prompt_dir", "./prompts"))
@@ -58,6 +96,7 @@ class EntityExtractor(LLMClient):
         user_prompt = user_prompt_template.replace("[Sentence]", sentence).replace("[Entity Type]", coarse_type)
         
         return user_prompt
+    @traced("extract_example", cat="example")
     def extract_for_one_example(self, ex: Dict[str, Any]) -> Dict[str, Any]:
         """
         对单个样例：
@@ -78,22 +117,67 @@ class EntityExtractor(LLMClient):
           ]
         }
         """
-        sample_id   = ex.get("id")
-        sentence    = ex.get("sentence", "")
         coarse_list = list(ex.get("coarse_types", []))
 
+        if self.extract_mode == "multi_type":
+            sp, up = self._make_prompt_multi_type(ex)
+            llm_answer = self._call_llm(sys_prompt=sp, user_prompt=up) if coarse_list else ""
+            return self._build_multi_type_result(ex, coarse_list, sp, up, llm_answer)
+
         # 1) 生成 prompts（与 coarse_types 对齐）
         system_prompts, user_prompts = self._make_prompt_by_coarse_type(ex)
         if len(system_prompts) != len(coarse_list) or len(user_prompts) != len(coarse_list):
             raise ValueError("prompts 与 coarse_types 数量不一致，请检查构造逻辑。")
 
+        # 2) 逐 coarse_type 推理
+        answers = [self._call_llm(sys_prompt=sp, user_prompt=up) for sp, up in zip(system_prompts, user_prompts)]
+
+        return self._build_result(ex, coarse_list, system_prompts, user_prompts, answers)
+
+    @traced("extract_example", cat="example")
+    async def aextract_for_one_example(self, ex: Dict[str, Any], sem: Optional[asyncio.Semaphore] = None) -> Dict[str, Any]:
+        """
+        extract_for_one_example 的异步版本：该样例所有 coarse_type 的请求同时发出，
+        sem 用于限制全局并发的 (样例, coarse_type) 请求数。结果与串行版本完全一致。
+        """
+        coarse_list = list(ex.get("coarse_types", []))
+
+        if self.extract_mode == "multi_type":
+            sp, up = self._make_prompt_multi_type(ex)
+            llm_answer = ""
+            if coarse_list:
+                if sem is None:
+                    llm_answer = await self._acall_llm(sys_prompt=sp, user_prompt=up)
+                else:
+                    async with sem:
+                        llm_answer = await self._acall_llm(sys_prompt=sp, user_prompt=up)
+            return self._build_multi_type_result(ex, coarse_list, sp, up, llm_answer)
+
+        system_prompts, user_prompts = self._make_prompt_by_coarse_type(ex)
+        if len(system_prompts) != len(coarse_list) or len(user_prompts) != len(coarse_list):
+            raise ValueError("prompts 与 coarse_types 数量不一致，请检查构造逻辑。")
+
+        async def _one(sp: str, up: str) -> str:
+            if sem is None:
+                return await self._acall_llm(sys_prompt=sp, user_prompt=up)
+            async with sem:
+                return await self._acall_llm(sys_prompt=sp, user_prompt=up)
+
+        # gather 按提交顺序返回，保证与 coarse_types 对齐
+        answers = await asyncio.gather(*[_one(sp, up) for sp, up in zip(system_prompts, user_prompts)])
+
+        return self._build_result(ex, coarse_list, system_prompts, user_prompts, list(answers))
+
+    @traced("parse", cat="example")
+    def _build_result(self, ex: Dict[str, Any], coarse_list: List[str], system_prompts: List[str],
+                      user_prompts: List[str], answers: List[str]) -> Dict[str, Any]:
+        """
+        将各 coarse_type 的 LLM 回答解析为实体并汇总为单个样例的结果
+        """
         results_entities: List[Dict[str, str]] = []
         trace_items: List[Dict[str, str]] = []
 
-        # 2) 逐 coarse_type 推理并解析
-        for ct, sp, up in zip(coarse_list, system_prompts, user_prompts):
-            llm_answer = self._call_llm(sys_prompt=sp, user_prompt=up)
-
+        for ct, sp, up, llm_answer in zip(coarse_list, system_prompts, user_prompts, answers):
             # 3) 解析已标注句子中的实体
             names = self._parse_tagged_entities(
                 llm_answer if llm_answer else "",  # 若还未接入 LLM，则解析到空列表
@@ -116,54 +200,119 @@ class EntityExtractor(LLMClient):
         deduped = self._dedup_name_ct(results_entities)
 
         return {
-            "id": sample_id,
+            "id": ex.get("id"),
             "source": ex.get("source"),
-            "sentence": sentence,
+            "sentence": ex.get("sentence", ""),
             "coarse_types": coarse_list,
             "entities": deduped,                 # 目标产物：实体-粗粒度列表
             "prompts_and_answers": trace_items   # 便于追踪每个 coarse_type 的答案
         }
 
+    @traced("parse", cat="example")
+    def _build_multi_type_result(self, ex: Dict[str, Any], coarse_list: List[str], system_prompt: str,
+                                 user_prompt: str, llm_answer: str) -> Dict[str, Any]:
+        """
+        multi_type 模式：从一次回答中解析 (实体, 类型)，输出结构与 per_type 模式一致
+        """
+        pairs = self._parse_tagged_entities(
+            llm_answer if llm_answer else "",
+            markers=self.cfg["extraction"]["entity_markers"],
+            coarse_types=coarse_list
+        )
+
+        return {
+            "id": ex.get("id"),
+            "source": ex.get("source"),
+            "sentence": ex.get("sentence", ""),
+            "coarse_types": coarse_list,
+            "entities": self._dedup_name_ct(pairs),
+            "prompts_and_answers": [{
+                "coarse_types": coarse_list,
+                "system_prompt": system_prompt,
+                "user_prompt": user_prompt,
+                "llm_answer": llm_answer
+            }]
+        }
+
     # ===================== 核心新增：批量处理并保存 =====================
-    def extract_and_save_all(self, ex_list: List[Dict[str, Any]], output_json_path: str | os.PathLike) -> Path:
+    def extract_and_save_all(self, ex_list: List[Dict[str, Any]], output_json_path: str | os.PathLike,
+                             concurrency: Optional[int] = None, resume: Optional[bool] = None) -> Path:
         """
-        对传入的样例列表逐一抽取，汇总为 JSON 并保存（若已存在则先删除后写入）。
+        对传入的样例列表逐一抽取，汇总为 JSON 并保存（覆盖写入）。
+        - 每完成一个样例即追加到 <out>.jsonl；失败样例记录到 <out>.failed.jsonl 并继续处理其余样例；
+        - resume=True（默认读取 cfg.runtime.resume）时跳过 <out>.jsonl 中已完成、且输入未变的样例；
+          模型 / 抽取模式 / prompt / 生成参数与上次运行不同时丢弃旧断点；
+        - concurrency > 1 时所有 (样例, coarse_type) 请求并发执行，最多 concurrency 个同时在途；
+          默认读取 cfg.runtime.concurrency，缺省为 1（串行）。两种模式的输出完全一致。
         返回输出文件的 Path。
         """
-        all_results: List[Dict[str, Any]] = []
+        runtime = self.cfg.get("runtime", {})
+        if concurrency is None:
+            concurrency = int(runtime.get("concurrency", 1))
+        if resume is None:
+            resume = bool(runtime.get("resume", True))
+
         for idx, ex in enumerate(ex_list):
             # 对 ex 的 id 进行处理，如果 id 为空，则根据顺序生成 id
             if not ex.get("id", ""):
                 ex["id"] = f"{idx}"
-            one = self.extract_for_one_example(ex)
-            all_results.append(one)
 
-        out_path = Path(output_json_path)
-        # 覆盖写入（若存在先删）
-        if out_path.exists():
-            out_path.unlink()
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(all_results, f, ensure_ascii=False, indent=2)
+        ckpt = JsonlCheckpoint(Path(output_json_path), resume=resume, fingerprint=self.run_fingerprint())
+        todo = [ex for ex in ex_list if not ckpt.is_done(ex["id"], record_hash(ex))]
+        if len(todo) < len(ex_list):
+            print(f"[INFO] 续跑：跳过 {len(ex_list) - len(todo)} 个已完成样例（{ckpt.jsonl_path}）")
+
+        try:
+            if concurrency > 1:
+                asyncio.run(self._aextract_all(todo, concurrency, ckpt))
+            else:
+                for ex in todo:
+                    try:
+                        input_hash = record_hash(ex)
+                        ckpt.write(self.extract_for_one_example(ex), input_hash)
+                    except Exception as e:
+                        ckpt.write_failure(ex["id"], e)
+        finally:
+            ckpt.close()
+
+        return ckpt.finalize([ex["id"] for ex in ex_list])
+
+    async def _aextract_all(self, ex_list: List[Dict[str, Any]], concurrency: int, ckpt: JsonlCheckpoint) -> None:
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(ex: Dict[str, Any]) -> None:
+            try:
+                input_hash = record_hash(ex)
+                ckpt.write(await self.aextract_for_one_example(ex, sem), input_hash)
+            except Exception as e:
+                ckpt.write_failure(ex["id"], e)
 
-        return out_path
+        try:
+            await asyncio.gather(*[_one(ex) for ex in ex_list])
+        finally:
+            await aclose_all_pools()
 
     # ===================== 工具：解析标注实体 =====================
     def _parse_tagged_entities(
         self,
         text: str,
-        markers: Optional[List[Dict[str, str]]] = None
-    ) -> List[str]:
+        markers: Optional[List[Dict[str, str]]] = None,
+        coarse_types: Optional[List[str]] = None
+    ) -> List[Any]:
         """
         从“已标注的句子”中解析实体字符串。
         - 自定义：cfg["entity_markers"] = [{"begin":"<<","end":">>"}, ...]
+        - 传入 coarse_types 时按 multi_type 格式解析 begin实体end类型（如 @@实体##类型），
+          类型取紧跟 end 标记、且在 coarse_types 中的最长匹配；无法匹配类型的实体被丢弃。
 
-        返回去重后的实体名称列表，按出现顺序稳定。
+        返回去重后的实体名称列表（multi_type 格式下为 {"name", "coarse_type"} 列表），按出现顺序稳定。
         """
         if not text:
             return []
 
-        found: List[str] = []
+        found: List[Any] = []
+        # 长类型优先，避免 "人" 抢先匹配 "人物"
+        types_by_len = sorted(coarse_types or [], key=len, reverse=True)
 
         # 2) 解析 cfg 中的自定义标记对
         if markers:
@@ -174,8 +323,18 @@ class EntityExtractor(LLMClient):
                     pattern = rf"{beg}(.*?){end}"
                     for m in re.finditer(pattern, text, flags=re.DOTALL):
                         val = m.group(1).strip()
-                        if val:
+                        if not val:
+                            continue
+                        if coarse_types is None:
                             found.append(val)
+                            continue
+                        tail = text[m.end():]
+                        ct = next((t for t in types_by_len if t and tail.startswith(t)), None)
+                        if ct is None:
+                            # 英文类型大小写不一致时兜底
+                            ct = next((t for t in types_by_len if t and tail.lower().startswith(t.lower())), None)
+                        if ct is not None:
+                            found.append((val, ct))
 
         # 3) 去重并保持次序
         seen = set()
@@ -185,6 +344,8 @@ class EntityExtractor(LLMClient):
             if key not in seen:
                 seen.add(key)
                 uniq.append(s)
+        if coarse_types is not None:
+            return [{"name": n, "coarse_type": ct} for n, ct in uniq]
         return uniq
 
     # ===================== 工具：按 (name, coarse_type) 去重 =====================
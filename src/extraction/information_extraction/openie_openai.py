@@ -2,11 +2,10 @@ import json
 import re
 from dataclasses import dataclass
 from typing import Dict, Any, List, TypedDict, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 
 from src.extraction.prompts.prompt_template_manager import PromptTemplateManager
 from src.extraction.utils.logging_utils import get_logger
+from src.extraction.utils.metrics_utils import get_metrics, metric_labels
 from src.extraction.utils.llm_utils import fix_broken_generated_json, filter_invalid_triples
 from src.extraction.utils.misc_utils import TripleRawOutput, NerRawOutput
 from src.extraction.llm.openai_gpt import CacheOpenAI
@@ -36,6 +35,14 @@ def _extract_ner_from_response(real_response):
     return eval(match.group())["named_entities"]
 
 
+def _log_batch_usage(stage: str, results) -> None:
+    total_prompt_tokens = sum(res.metadata.get('prompt_tokens', 0) for res in results)
+    total_completion_tokens = sum(res.metadata.get('completion_tokens', 0) for res in results)
+    num_cache_hit = sum(1 for res in results if res.metadata.get('cache_hit'))
+    logger.info(f"{stage}: {len(results)} chunks, total_prompt_tokens={total_prompt_tokens}, "
+                f"total_completion_tokens={total_completion_tokens}, num_cache_hit={num_cache_hit}")
+
+
 class OpenIE:
     def __init__(self, llm_model: CacheOpenAI):
         # Init prompt template manager
@@ -45,14 +52,21 @@ class OpenIE:
     def ner(self, chunk_key: str, passage: str) -> NerRawOutput:
         # PREPROCESSING
         ner_input_message = self.prompt_template_manager.render(name='ner', passage=passage)
-        raw_response = ""
-        metadata = {}
         try:
             # LLM INFERENCE
-            raw_response, metadata, cache_hit = self.llm_model.infer(
-                messages=ner_input_message,
-            )
+            with metric_labels(stage="ner", template="ner"):
+                raw_response, metadata, cache_hit = self.llm_model.infer(
+                    messages=ner_input_message,
+                )
             metadata['cache_hit'] = cache_hit
+        except Exception as e:
+            raw_response, metadata = e, {}
+        return self._ner_output(chunk_key, raw_response, metadata)
+
+    def _ner_output(self, chunk_key: str, raw_response, metadata: dict) -> NerRawOutput:
+        try:
+            if isinstance(raw_response, Exception):
+                raise raw_response
             if metadata['finish_reason'] == 'length':
                 real_response = fix_broken_generated_json(raw_response)
             else:
@@ -63,10 +77,12 @@ class OpenIE:
         except Exception as e:
             # For any other unexpected exceptions, log them and return with the error message
             logger.warning(e)
+            if not isinstance(raw_response, Exception):
+                get_metrics().record_parse_failure(stage="ner", template="ner")
             metadata.update({'error': str(e)})
             return NerRawOutput(
                 chunk_id=chunk_key,
-                response=raw_response,  # Store the error message in metadata
+                response="" if isinstance(raw_response, Exception) else raw_response,  # Store the error message in metadata
                 unique_entities=[],
                 metadata=metadata  # Store the error message in metadata
             )
@@ -78,7 +94,28 @@ class OpenIE:
             metadata=metadata
         )
 
+    def _triple_messages(self, passage: str, named_entities: List[str]) -> List[Dict]:
+        return self.prompt_template_manager.render(
+            name='triple_extraction',
+            passage=passage,
+            named_entity_json=json.dumps({"named_entities": named_entities})
+        )
+
     def triple_extraction(self, chunk_key: str, passage: str, named_entities: List[str]) -> TripleRawOutput:
+        # PREPROCESSING
+        messages = self._triple_messages(passage, named_entities)
+        try:
+            # LLM INFERENCE
+            with metric_labels(stage="triples", template="triple_extraction"):
+                raw_response, metadata, cache_hit = self.llm_model.infer(
+                    messages=messages,
+                )
+            metadata['cache_hit'] = cache_hit
+        except Exception as e:
+            raw_response, metadata = e, {}
+        return self._triple_output(chunk_key, raw_response, metadata)
+
+    def _triple_output(self, chunk_key: str, raw_response, metadata: dict) -> TripleRawOutput:
         def _extract_triples_from_response(real_response):
             pattern = r'\{[^{}]*"triples"\s*:\s*\[[^\]]*\][^{}]*\}'
             match = re.search(pattern, real_response, re.DOTALL)
@@ -87,21 +124,9 @@ class OpenIE:
                 return []
             return eval(match.group())["triples"]
 
-        # PREPROCESSING
-        messages = self.prompt_template_manager.render(
-            name='triple_extraction',
-            passage=passage,
-            named_entity_json=json.dumps({"named_entities": named_entities})
-        )
-
-        raw_response = ""
-        metadata = {}
         try:
-            # LLM INFERENCE
-            raw_response, metadata, cache_hit = self.llm_model.infer(
-                messages=messages,
-            )
-            metadata['cache_hit'] = cache_hit
+            if isinstance(raw_response, Exception):
+                raise raw_response
             if metadata['finish_reason'] == 'length':
                 real_response = fix_broken_generated_json(raw_response)
             else:
@@ -111,10 +136,12 @@ class OpenIE:
 
         except Exception as e:
             logger.warning(f"Exception for chunk {chunk_key}: {e}")
+            if not isinstance(raw_response, Exception):
+                get_metrics().record_parse_failure(stage="triples", template="triple_extraction")
             metadata.update({'error': str(e)})
             return TripleRawOutput(
                 chunk_id=chunk_key,
-                response=raw_response,
+                response="" if isinstance(raw_response, Exception) else raw_response,
                 metadata=metadata,
                 triples=[]
             )
@@ -134,7 +161,8 @@ class OpenIE:
 
     def batch_openie(self, chunks: Dict[str, ChunkInfo]) -> Tuple[Dict[str, NerRawOutput], Dict[str, TripleRawOutput]]:
         """
-        Conduct batch OpenIE synchronously using multi-threading which includes NER and triple extraction.
+        Conduct batch OpenIE synchronously which includes NER and triple extraction. Each stage goes through
+        `CacheOpenAI.batch_infer`, so cached prompts are resolved in one bulk lookup and only misses are sent out.
 
         Args:
             chunks (Dict[str, ChunkInfo]): chunks to be incorporated into graph. Each key is a hashed chunk 
@@ -149,60 +177,23 @@ class OpenIE:
         # Extract passages from the provided chunks
         chunk_passages = {chunk_key: chunk["content"] for chunk_key, chunk in chunks.items()}
 
-        ner_results_list = []
-        total_prompt_tokens = 0
-        total_completion_tokens = 0
-        num_cache_hit = 0
-
-        with ThreadPoolExecutor() as executor:
-            # Create NER futures for each chunk
-            ner_futures = {
-                executor.submit(self.ner, chunk_key, passage): chunk_key #使用self.ner进行ner
-                for chunk_key, passage in chunk_passages.items()
-            }
-
-            pbar = tqdm(as_completed(ner_futures), total=len(ner_futures), desc="NER")
-            for future in pbar:
-                result = future.result()
-                ner_results_list.append(result)
-                # Update metrics based on the metadata from the result
-                metadata = result.metadata
-                total_prompt_tokens += metadata.get('prompt_tokens', 0)
-                total_completion_tokens += metadata.get('completion_tokens', 0)
-                if metadata.get('cache_hit'):
-                    num_cache_hit += 1
-
-                pbar.set_postfix({
-                    'total_prompt_tokens': total_prompt_tokens,
-                    'total_completion_tokens': total_completion_tokens,
-                    'num_cache_hit': num_cache_hit
-                })
-
-        triple_results_list = []
-        total_prompt_tokens, total_completion_tokens, num_cache_hit = 0, 0, 0
-        with ThreadPoolExecutor() as executor:
-            # Create triple extraction futures for each chunk
-            re_futures = {
-                executor.submit(self.triple_extraction, ner_result.chunk_id,
-                                chunk_passages[ner_result.chunk_id],
-                                ner_result.unique_entities): ner_result.chunk_id
-                for ner_result in ner_results_list
-            }
-            # Collect triple extraction results with progress bar
-            pbar = tqdm(as_completed(re_futures), total=len(re_futures), desc="Extracting triples")
-            for future in pbar:
-                result = future.result()
-                triple_results_list.append(result)
-                metadata = result.metadata
-                total_prompt_tokens += metadata.get('prompt_tokens', 0)
-                total_completion_tokens += metadata.get('completion_tokens', 0)
-                if metadata.get('cache_hit'):
-                    num_cache_hit += 1
-                pbar.set_postfix({
-                    'total_prompt_tokens': total_prompt_tokens,
-                    'total_completion_tokens': total_completion_tokens,
-                    'num_cache_hit': num_cache_hit
-                })
+        # NER: every prompt is resolved against the cache in one bulk lookup, only the misses reach the model
+        chunk_keys = list(chunk_passages.keys())
+        ner_messages = [self.prompt_template_manager.render(name='ner', passage=chunk_passages[k]) for k in chunk_keys]
+        with metric_labels(stage="ner", template="ner"):
+            responses, metadatas = self.llm_model.batch_infer(ner_messages, return_exceptions=True, progress_desc="NER")
+        ner_results_list = [self._ner_output(chunk_key, response, metadata)
+                            for chunk_key, response, metadata in zip(chunk_keys, responses, metadatas)]
+        _log_batch_usage("NER", ner_results_list)
+
+        # Triple extraction, conditioned on the NER results
+        triple_messages = [self._triple_messages(chunk_passages[res.chunk_id], res.unique_entities) for res in ner_results_list]
+        with metric_labels(stage="triples", template="triple_extraction"):
+            responses, metadatas = self.llm_model.batch_infer(triple_messages, return_exceptions=True,
+                                                              progress_desc="Extracting triples")
+        triple_results_list = [self._triple_output(res.chunk_id, response, metadata)
+                               for res, response, metadata in zip(ner_results_list, responses, metadatas)]
+        _log_batch_usage("Extracting triples", triple_results_list)
 
         ner_results_dict = {res.chunk_id: res for res in ner_results_list}
         triple_results_dict = {res.chunk_id: res for res in triple_results_list}
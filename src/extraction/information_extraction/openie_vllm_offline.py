@@ -6,6 +6,7 @@ from .openie_openai import ChunkInfo
 from ..utils.logging_utils import get_logger
 from ..prompts import PromptTemplateManager
 from ..llm.vllm_offline import VLLMOffline
+from src.utils.tracing import span
 
 from src.retrieval.inverted_retrieval import InvertedRetrieval
 
@@ -66,46 +67,48 @@ class VLLMOfflineOpenIE(OpenIE):
                 "coarse_types": passage_coarse_types
             }
 
-            # --- 1. 按 schema/coarse_type 检索 topk ---
-            schema_shots = [shot for schema in passage_schemas for shot in
-                            retriever.retrieve_by_schema(schema, k=3, seed=42)]
-            coarse_shots = [shot for ctype in passage_coarse_types for shot in
-                            retriever.retrieve_by_coarse_type(ctype, k=3, seed=42)]
-
-            # --- 2. 交集 few-shot ---
-            intersect_shots = [shot for shot in schema_shots if shot in coarse_shots]
-
-            few_shot_selected = []
-            num_needed = 5
-
-            # 按优先级选择 few-shot
-            for source in [intersect_shots,
-                           [s for s in schema_shots if s not in intersect_shots],
-                           [s for s in coarse_shots if s not in intersect_shots],
-                           fallback_few_shot]:
-                take = min(len(source), num_needed)
-                few_shot_selected.extend(source[:take])
-                num_needed -= take
-                if num_needed <= 0:
-                    break
-
-            # --- 3. 转成结构化 [input, output] ---
-            few_shot_pairs = [
-                (
-                    {"sentence": shot.get("sentence"),
-                     "schema": shot.get("schema"),
-                     "coarse_types": shot.get("coarse_types")},
-                    {"output": shot.get("output")}
+            with span("fewshot_retrieval", cat="example"):
+                # --- 1. 按 schema/coarse_type 检索 topk ---
+                schema_shots = [shot for schema in passage_schemas for shot in
+                                retriever.retrieve_by_schema(schema, k=3, seed=42)]
+                coarse_shots = [shot for ctype in passage_coarse_types for shot in
+                                retriever.retrieve_by_coarse_type(ctype, k=3, seed=42)]
+
+                # --- 2. 交集 few-shot ---
+                intersect_shots = [shot for shot in schema_shots if shot in coarse_shots]
+
+                few_shot_selected = []
+                num_needed = 5
+
+                # 按优先级选择 few-shot
+                for source in [intersect_shots,
+                               [s for s in schema_shots if s not in intersect_shots],
+                               [s for s in coarse_shots if s not in intersect_shots],
+                               fallback_few_shot]:
+                    take = min(len(source), num_needed)
+                    few_shot_selected.extend(source[:take])
+                    num_needed -= take
+                    if num_needed <= 0:
+                        break
+
+            with span("render_prompt", cat="example"):
+                # --- 3. 转成结构化 [input, output] ---
+                few_shot_pairs = [
+                    (
+                        {"sentence": shot.get("sentence"),
+                         "schema": shot.get("schema"),
+                         "coarse_types": shot.get("coarse_types")},
+                        {"output": shot.get("output")}
+                    )
+                    for shot in few_shot_selected
+                ]
+
+                # --- 4. 构建 prompt ---
+                prompt = self.prompt_template_manager.build_chat_prompt(
+                    template_name="openIE2",
+                    new_passage=current_passage_input,
+                    few_shot=few_shot_pairs
                 )
-                for shot in few_shot_selected
-            ]
-
-            # --- 4. 构建 prompt ---
-            prompt = self.prompt_template_manager.build_chat_prompt(
-                template_name="openIE2",
-                new_passage=current_passage_input,
-                few_shot=few_shot_pairs
-            )
             ner_input_messages.append(prompt)
 
         # for j, prompt in enumerate(ner_input_messages[:5]):
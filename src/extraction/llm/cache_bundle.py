@@ -0,0 +1,103 @@
+"""
+Portable export/import bundles for the SQLite LLM response caches.
+
+A bundle is a gzip-compressed JSONL file:
+    line 1        header   {"format": "llm-cache-bundle", "version": 1, "source": ..., "namespaces": ..., "created_at": ...}
+    lines 2..n-1  one cache row each, sorted by key (messages stored decompressed, so any cache can read them)
+    line n        trailer  {"count": <rows>, "sha256": <hash of the row lines>}
+
+Sorting makes bundles of the same cache content byte-for-byte reproducible (up to the header timestamp) and lets the
+checksum catch truncated or edited files before anything is merged.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from .cache_store import SQLiteResponseCache
+
+BUNDLE_FORMAT = "llm-cache-bundle"
+BUNDLE_VERSION = 1
+# rows handed to the cache writer per merge call
+MERGE_BATCH_SIZE = 1000
+
+
+def export_bundle(cache: SQLiteResponseCache, bundle_path: str, namespaces: Optional[List[str]] = None) -> int:
+    """Write all live rows of `cache` (optionally only `namespaces`) to `bundle_path`; returns the row count."""
+    dir_path = os.path.dirname(bundle_path)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    tmp_path = bundle_path + ".tmp"
+    digest, count = hashlib.sha256(), 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=9) as f:
+        header = {"format": BUNDLE_FORMAT, "version": BUNDLE_VERSION, "source": os.path.basename(cache.path),
+                  "namespaces": namespaces, "created_at": time.time()}
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for row in cache.iter_rows(namespaces):
+            line = json.dumps(row, ensure_ascii=False, sort_keys=True) + "\n"
+            digest.update(line.encode("utf-8"))
+            f.write(line)
+            count += 1
+        f.write(json.dumps({"count": count, "sha256": digest.hexdigest()}) + "\n")
+    os.replace(tmp_path, bundle_path)
+    return count
+
+
+def _read_rows(bundle_path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the rows of a bundle after checking its header; the trailer is returned as the last item."""
+    with gzip.open(bundle_path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != BUNDLE_FORMAT or header.get("version") != BUNDLE_VERSION:
+            raise ValueError(f"{bundle_path} is not a version {BUNDLE_VERSION} cache bundle")
+        for line in f:
+            yield json.loads(line)
+
+
+def verify_bundle(bundle_path: str) -> int:
+    """Check the row count and checksum of a bundle; returns the row count, raises ValueError if it is damaged."""
+    digest, count, trailer = hashlib.sha256(), 0, None
+    for item in _read_rows(bundle_path):
+        if trailer is not None:
+            raise ValueError(f"{bundle_path}: data after the trailer line")
+        if "key" in item:
+            digest.update((json.dumps(item, ensure_ascii=False, sort_keys=True) + "\n").encode("utf-8"))
+            count += 1
+        else:
+            trailer = item
+    if trailer is None:
+        raise ValueError(f"{bundle_path}: missing trailer, the bundle is truncated")
+    if trailer.get("count") != count or trailer.get("sha256") != digest.hexdigest():
+        raise ValueError(f"{bundle_path}: checksum mismatch ({count} rows read, trailer says {trailer.get('count')})")
+    return count
+
+
+def import_bundle(cache: SQLiteResponseCache, bundle_path: str, namespaces: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Verify `bundle_path` and merge it into `cache`, last writer wins on `created_at`. Rows that expired since the
+    export are skipped. Returns counts of inserted / updated / skipped rows.
+    """
+    verify_bundle(bundle_path)
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    batch: List[Dict[str, Any]] = []
+    now = time.time()
+
+    def _merge() -> None:
+        for k, v in cache.merge_rows(batch).items():
+            totals[k] += v
+        batch.clear()
+
+    for row in _read_rows(bundle_path):
+        if "key" not in row:
+            continue
+        if (namespaces and row["namespace"] not in namespaces) or (row["expires_at"] is not None and row["expires_at"] <= now):
+            totals["skipped"] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= MERGE_BATCH_SIZE:
+            _merge()
+    if batch:
+        _merge()
+    return totals
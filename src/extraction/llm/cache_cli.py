@@ -0,0 +1,197 @@
+"""
+Command-line administration of the SQLite LLM response caches.
+
+    python -m src.extraction.llm.cache_cli stats outputs/llm_cache
+    python -m src.extraction.llm.cache_cli purge outputs/llm_cache --namespace "Llama3-8B@0123abcd4567" --expired
+    python -m src.extraction.llm.cache_cli vacuum outputs/llm_cache/Llama3-8B_client_cache.sqlite
+    python -m src.extraction.llm.cache_cli compress outputs/llm_cache --vacuum
+    python -m src.extraction.llm.cache_cli export outputs/llm_cache/Llama3-8B_client_cache.sqlite run1.bundle.gz
+    python -m src.extraction.llm.cache_cli import run1.bundle.gz outputs/llm_cache/Llama3-8B_client_cache.sqlite
+
+stats / purge / compress / vacuum accept cache files or directories (all `*.sqlite` files directly inside them);
+export / import work on one cache file.
+"""
+
+import argparse
+import os
+import time
+from typing import List, Optional
+
+from .cache_bundle import export_bundle, import_bundle, verify_bundle
+from .cache_store import SQLiteResponseCache
+
+
+def _cache_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".sqlite"))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            raise FileNotFoundError(f"No cache file or directory at {path}")
+    return files
+
+
+def _fmt_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+
+
+def _fmt_time(ts: Optional[float]) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts)) if ts else "-"
+
+
+def _file_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def cmd_stats(args: argparse.Namespace) -> None:
+    for path in _cache_files(args.paths):
+        cache = SQLiteResponseCache(path)
+        try:
+            namespaces = cache.namespace_stats()
+            runs = cache.recent_runs(args.runs)
+            compression = cache.compression_stats()
+            print(f"== {path}  ({_fmt_bytes(_file_size(path))} on disk)")
+            print(f"  {'namespace':<48} {'entries':>9} {'size':>10} {'expired':>8}  {'oldest':<16}  {'last used':<16}")
+            for ns in namespaces:
+                print(f"  {ns['namespace'] or '(none)':<48} {ns['entries']:>9} {_fmt_bytes(ns['bytes']):>10} "
+                      f"{ns['expired']:>8}  {_fmt_time(ns['oldest']):<16}  {_fmt_time(ns['last_used']):<16}")
+            dicts = ", ".join(f"#{d['id']} {d['codec']} {_fmt_bytes(d['bytes'])}" for d in compression["dicts"]) or "none"
+            print(f"  compression: {compression['compressed_rows']} compressed / {compression['plain_rows']} plain rows, "
+                  f"dictionaries: {dicts}")
+            if runs:
+                print("  recent runs:")
+                for run in runs:
+                    print(f"    {_fmt_time(run['started_at'])} -> {_fmt_time(run['finished_at'])}  "
+                          f"hit rate {run['hit_rate']:.1%} (memory {run['memory_hits']}, disk {run['disk_hits']}, "
+                          f"misses {run['misses']})")
+        finally:
+            cache.close()
+
+
+def cmd_purge(args: argparse.Namespace) -> None:
+    if not args.namespace and not args.expired:
+        raise SystemExit("purge: give at least one --namespace or --expired")
+    for path in _cache_files(args.paths):
+        cache = SQLiteResponseCache(path)
+        try:
+            deleted = 0
+            for namespace in args.namespace or []:
+                deleted += cache.purge(namespace=namespace)
+            if args.expired:
+                deleted += cache.purge(expired=True)
+            if args.vacuum:
+                cache.vacuum()
+        finally:
+            cache.close()
+        print(f"[OK] {path}: deleted {deleted} rows")
+
+
+def cmd_compress(args: argparse.Namespace) -> None:
+    for path in _cache_files(args.paths):
+        cache = SQLiteResponseCache(path)
+        try:
+            result = cache.compress_existing(retrain=args.retrain, dict_size=args.dict_kb * 1024)
+            if args.vacuum:
+                cache.vacuum()
+        finally:
+            cache.close()
+        if result["dict_id"] is None:
+            print(f"[WARN] {path}: could not train a dictionary, rows left as they are")
+            continue
+        print(f"[OK] {path}: {result['rows']} rows rewritten with {result['codec']} dictionary #{result['dict_id']}, "
+              f"{_fmt_bytes(result['bytes_before'])} -> {_fmt_bytes(result['bytes_after'])}")
+
+
+def cmd_vacuum(args: argparse.Namespace) -> None:
+    for path in _cache_files(args.paths):
+        before = _file_size(path)
+        cache = SQLiteResponseCache(path)
+        try:
+            cache.vacuum()
+        finally:
+            cache.close()
+        print(f"[OK] {path}: {_fmt_bytes(before)} -> {_fmt_bytes(_file_size(path))}")
+
+
+def cmd_export(args: argparse.Namespace) -> None:
+    cache = SQLiteResponseCache(_cache_files([args.cache])[0])
+    try:
+        count = export_bundle(cache, args.bundle, namespaces=args.namespace)
+    finally:
+        cache.close()
+    print(f"[OK] exported {count} rows to {args.bundle} ({_fmt_bytes(os.path.getsize(args.bundle))})")
+
+
+def cmd_import(args: argparse.Namespace) -> None:
+    cache = SQLiteResponseCache(args.cache)
+    try:
+        counts = import_bundle(cache, args.bundle, namespaces=args.namespace)
+    finally:
+        cache.close()
+    print(f"[OK] merged {args.bundle} into {args.cache}: {counts['inserted']} inserted, "
+          f"{counts['updated']} updated, {counts['skipped']} kept local/skipped")
+
+
+def cmd_verify(args: argparse.Namespace) -> None:
+    for bundle in args.bundles:
+        print(f"[OK] {bundle}: {verify_bundle(bundle)} rows, checksum matches")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src.extraction.llm.cache_cli",
+                                     description="Inspect and maintain SQLite LLM response caches.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("stats", help="per-namespace entries/size and hit rates of recent runs")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--runs", type=int, default=5, help="number of recent runs to show")
+    p.set_defaults(func=cmd_stats)
+
+    p = sub.add_parser("purge", help="delete a namespace and/or expired rows")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--namespace", action="append", help="namespace to delete (repeatable)")
+    p.add_argument("--expired", action="store_true", help="delete rows whose TTL has passed")
+    p.add_argument("--vacuum", action="store_true", help="vacuum afterwards to shrink the file")
+    p.set_defaults(func=cmd_purge)
+
+    p = sub.add_parser("compress", help="train a compression dictionary and compress existing rows")
+    p.add_argument("paths", nargs="+")
+    p.add_argument("--retrain", action="store_true", help="train a new dictionary even if one exists")
+    p.add_argument("--dict-kb", type=int, default=64, help="dictionary size in KB (zlib uses at most 32)")
+    p.add_argument("--vacuum", action="store_true", help="vacuum afterwards to shrink the file")
+    p.set_defaults(func=cmd_compress)
+
+    p = sub.add_parser("vacuum", help="rebuild the file to return freed space")
+    p.add_argument("paths", nargs="+")
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser("export", help="write a cache (or some namespaces) to a sorted, checksummed bundle")
+    p.add_argument("cache")
+    p.add_argument("bundle")
+    p.add_argument("--namespace", action="append", help="only export this namespace (repeatable)")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="merge a bundle into a cache, newest row wins on conflicts")
+    p.add_argument("bundle")
+    p.add_argument("cache")
+    p.add_argument("--namespace", action="append", help="only import this namespace (repeatable)")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("verify", help="check bundle checksums without importing")
+    p.add_argument("bundles", nargs="+")
+    p.set_defaults(func=cmd_verify)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
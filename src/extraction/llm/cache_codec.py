@@ -0,0 +1,100 @@
+"""
+Dictionary compression for cached LLM responses.
+
+Responses to the same prompt template share most of their structure (JSON keys, entity types, boilerplate), so a
+dictionary trained on existing responses compresses them far better than compressing each one on its own.
+zstd is used when the optional `zstandard` package is installed; otherwise zlib with a preset dictionary (`zdict`).
+"""
+
+import importlib.util
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# zstandard is optional; zlib (stdlib) is the fallback codec
+ZSTD_AVAILABLE = importlib.util.find_spec("zstandard") is not None
+if ZSTD_AVAILABLE:
+    import zstandard
+
+# zlib can only reference the last 32 KB of a preset dictionary
+ZLIB_MAX_DICT_SIZE = 32 * 1024
+# fragments a zlib dictionary is assembled from: runs ending at JSON / line punctuation
+_FRAGMENT_RE = re.compile(rb"[^,{}\[\]\n]*[,{}\[\]\n]?")
+
+
+def default_codec() -> str:
+    return "zstd" if ZSTD_AVAILABLE else "zlib"
+
+
+def train_dictionary(samples: List[str], codec: str, dict_size: int = 64 * 1024) -> bytes:
+    """Build a compression dictionary for `codec` from sample responses."""
+    encoded = [s.encode("utf-8") for s in samples if s]
+    if not encoded:
+        raise ValueError("No samples to train a compression dictionary on")
+    if codec == "zstd":
+        return zstandard.train_dictionary(dict_size, encoded).as_bytes()
+    if codec == "zlib":
+        # zlib has no trainer: a preset dictionary is just content that later data can back-reference. Split the
+        # samples at JSON/line punctuation, keep the fragments that would save the most bytes, and put the most
+        # valuable ones last, where back-references are cheapest.
+        counts: Dict[bytes, int] = {}
+        for sample in encoded:
+            for fragment in _FRAGMENT_RE.findall(sample):
+                if len(fragment) >= 4:
+                    counts[fragment] = counts.get(fragment, 0) + 1
+        ranked = sorted((kv for kv in counts.items() if kv[1] > 1), key=lambda kv: len(kv[0]) * (kv[1] - 1), reverse=True)
+        size = min(dict_size, ZLIB_MAX_DICT_SIZE)
+        chosen, total = [], 0
+        for fragment, _ in ranked:
+            if total + len(fragment) > size:
+                continue
+            chosen.append(fragment)
+            total += len(fragment)
+        if not chosen:
+            # nothing repeats: fall back to raw sample text
+            return b"".join(encoded)[-size:]
+        return b"".join(reversed(chosen))
+    raise ValueError(f"Unknown cache codec: {codec}")
+
+
+class DictCodec:
+    """Compress/decompress with one trained dictionary. Safe to share between threads."""
+
+    # default compression level per codec
+    DEFAULT_LEVELS = {"zstd": 3, "zlib": 6}
+
+    def __init__(self, codec: str, dict_data: bytes, level: Optional[int] = None) -> None:
+        if codec == "zstd" and not ZSTD_AVAILABLE:
+            raise RuntimeError("This cache was compressed with zstd; install the `zstandard` package to read it")
+        if codec not in ("zstd", "zlib"):
+            raise ValueError(f"Unknown cache codec: {codec}")
+        self.codec = codec
+        self.dict_data = dict_data
+        self.level = level if level is not None else self.DEFAULT_LEVELS[codec]
+        # zstd (de)compressor objects are not thread-safe, so each thread keeps its own
+        self._local = threading.local()
+        if codec == "zstd":
+            self._zstd_dict = zstandard.ZstdCompressionDict(dict_data)
+            self._zstd_dict.precompute_compress(level=self.level)
+
+    def compress(self, text: str) -> bytes:
+        data = text.encode("utf-8")
+        if self.codec == "zstd":
+            return self._zstd_pair()[0].compress(data)
+        c = zlib.compressobj(level=self.level, zdict=self.dict_data)
+        return c.compress(data) + c.flush()
+
+    def decompress(self, blob: bytes) -> str:
+        if self.codec == "zstd":
+            return self._zstd_pair()[1].decompress(blob).decode("utf-8")
+        d = zlib.decompressobj(zdict=self.dict_data)
+        return (d.decompress(blob) + d.flush()).decode("utf-8")
+
+    def _zstd_pair(self) -> Tuple["zstandard.ZstdCompressor", "zstandard.ZstdDecompressor"]:
+        pair = getattr(self._local, "zstd", None)
+        if pair is None:
+            pair = (zstandard.ZstdCompressor(level=self.level, dict_data=self._zstd_dict),
+                    zstandard.ZstdDecompressor(dict_data=self._zstd_dict))
+            self._local.zstd = pair
+        return pair
@@ -0,0 +1,837 @@
+import hashlib
+import json
+import atexit
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from ..utils.logging_utils import get_logger
+from .cache_codec import DictCodec, default_codec, train_dictionary
+
+logger = get_logger(__name__)
+
+_STOP = object()  # writer-thread shutdown marker
+_UNSET = object()  # "no expiry given": MemoryLRUCache.put then applies its own ttl
+
+
+def _stored_size(stored: Any) -> int:
+    return len(stored) if isinstance(stored, bytes) else len(stored.encode("utf-8"))
+
+
+def _alive(expires_at: Optional[float], now: float) -> bool:
+    return expires_at is None or expires_at > now
+
+
+def fingerprint_dir(path: str, length: int = 12) -> str:
+    """
+    Short content hash of every file under `path` (names and bytes), used as the prompt template version in cache
+    namespaces. Returns "none" if the directory does not exist.
+    """
+    if not os.path.isdir(path):
+        return "none"
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            h.update(os.path.relpath(file_path, path).encode("utf-8"))
+            with open(file_path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()[:length]
+
+
+def make_cache_key(key_data: Dict[str, Any]) -> str:
+    """Content-addressed key: sha256 of the canonical JSON of everything that determines the response."""
+    key_str = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+
+class SQLiteResponseCache:
+    """
+    On-disk LLM response cache backed by a single SQLite file.
+
+    Rows keep the `cache(key, message, metadata)` layout used by `CacheOpenAI`, plus bookkeeping columns
+    (`size`, `created_at`, `accessed_at`, `namespace`, `expires_at`) that are added in place to older cache files.
+    Each row is tagged with the namespace of the client that wrote it (model + prompt template version), so old
+    template versions can be purged. When `ttl` (seconds) is set, rows expire that long after being written; when
+    `max_bytes` is set, the least recently used rows are evicted once the stored size exceeds it.
+
+    With `compress` on, messages are stored compressed with a dictionary trained on the cache's own responses
+    (`cache_dicts` table; zstd if available, else zlib). The dictionary is trained automatically once the cache holds
+    `TRAIN_MIN_ROWS` rows; rows written before that are converted by `compress_existing` (the `compress` CLI command).
+    `dict_id` records which dictionary a row uses, NULL meaning plain text.
+
+    The database runs in WAL mode so readers never block the writer or each other: every thread reads through
+    its own long-lived connection, and all writes (inserts, LRU touches, evictions) are queued to one background
+    thread that commits them in batches. Entries still waiting in the queue are served from memory, so a `get`
+    right after a `put` always sees the new value.
+    """
+
+    # after an eviction the cache is trimmed down to this fraction of max_bytes, so we do not evict on every put
+    EVICT_LOW_WATERMARK = 0.9
+    # keys per `IN (...)` query in get_many, kept well below SQLite's bound-parameter limit
+    LOOKUP_CHUNK = 500
+    # how often (seconds) the writer deletes expired rows when a TTL is configured
+    EXPIRY_SWEEP_INTERVAL = 300
+    # compression: rows needed before a dictionary is trained automatically, rows sampled for training,
+    # and the message length below which compression is not worth it
+    TRAIN_MIN_ROWS = 500
+    TRAIN_SAMPLE_ROWS = 2000
+    MIN_COMPRESS_CHARS = 128
+
+    def __init__(self, path: str, max_bytes: Optional[int] = None, ttl: Optional[float] = None,
+                 compress: bool = True, write_batch_size: int = 256) -> None:
+        self.path = path
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.ttl = float(ttl) if ttl else None
+        self.compress = bool(compress)
+        self.write_batch_size = max(1, int(write_batch_size))
+        dir_path = os.path.dirname(path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+
+        # the writer connection is only touched by the writer thread once it has started
+        self._write_conn = self._connect()
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        self._ensure_schema()
+        self._total_bytes = self._write_conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        # writer-owned: the dictionary new rows are compressed with, and the row count used to decide when to train
+        latest = self._write_conn.execute("SELECT MAX(id) FROM cache_dicts").fetchone()[0]
+        self._codecs: Dict[int, DictCodec] = {}
+        self._active_dict_id: Optional[int] = latest
+        self._row_count = self._write_conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._state_lock = threading.Lock()
+        # key -> queued put op, visible to readers until the writer has committed it
+        self._pending: Dict[str, Tuple] = {}
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._closed = False
+        # set when the writer thread has died; from then on writes raise instead of queueing into nothing
+        self._writer_error: Optional[BaseException] = None
+
+        self.hits = 0
+        self.misses = 0
+        self._started_at = time.time()
+        self._last_expiry_sweep = 0.0
+
+        self._writer = threading.Thread(target=self._writer_loop, name=f"cache-writer:{os.path.basename(path)}",
+                                        daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+
+    def _ensure_schema(self) -> None:
+        c = self._write_conn
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                message TEXT,
+                metadata TEXT
+            )
+        """)
+        columns = {row[1] for row in c.execute("PRAGMA table_info(cache)")}
+        if "size" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            c.execute("UPDATE cache SET size = LENGTH(CAST(message AS BLOB)) + LENGTH(CAST(metadata AS BLOB))")
+        if "created_at" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        if "accessed_at" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+        if "namespace" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+        if "expires_at" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN expires_at REAL")
+        if "dict_id" not in columns:
+            c.execute("ALTER TABLE cache ADD COLUMN dict_id INTEGER")
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS cache_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                samples INTEGER,
+                created_at REAL
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache(accessed_at)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cache_namespace ON cache(namespace)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache(expires_at)")
+        # one row per process that used the cache, so hit rates can be inspected after the fact
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS cache_runs (
+                started_at REAL,
+                finished_at REAL,
+                memory_hits INTEGER,
+                disk_hits INTEGER,
+                misses INTEGER
+            )
+        """)
+        c.commit()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._state_lock:
+                self._readers.append(conn)
+        return conn
+
+    # ---------------------------- public API ----------------------------
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return (message, metadata) for `key`, or None on a miss. A hit refreshes the row's LRU position."""
+        row = self.get_raw(key)
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        """
+        Bulk lookup: returns {key: (message, metadata)} for the keys that are cached, resolving the rest with
+        `IN (...)` queries of at most `LOOKUP_CHUNK` keys each. Every key counts as one hit or miss.
+        """
+        return {key: (message, json.loads(metadata_str))
+                for key, (message, metadata_str) in self.get_many_raw(keys).items()}
+
+    def put(self, key: str, message: str, metadata: Dict[str, Any], namespace: str = "") -> None:
+        """Queue a write; it becomes visible to `get` immediately and is committed by the writer thread."""
+        self.put_raw(key, message, json.dumps(metadata, ensure_ascii=False), namespace)
+
+    # the *_raw variants exchange metadata as its stored JSON string, so tiers can pass rows along without re-encoding
+    # with_expiry=True adds the row's expires_at as a third element, so the memory tier can honour it
+    def get_raw(self, key: str, with_expiry: bool = False) -> Optional[Tuple]:
+        now = time.time()
+        with self._state_lock:
+            op = self._pending.get(key)
+        if op is not None:
+            row = (op[2], op[3], op[7]) if _alive(op[7], now) else None
+        else:
+            row = self._reader().execute(
+                "SELECT message, metadata, dict_id, expires_at FROM cache "
+                "WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, now)).fetchone()
+            if row is not None:
+                row = (self._decode(row[0], row[2]), row[1], row[3])
+        with self._state_lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if op is None:
+            self._enqueue(("touch", key, now), strict=False)
+        return row if with_expiry else (row[0], row[1])
+
+    def get_many_raw(self, keys: List[str], with_expiry: bool = False) -> Dict[str, Tuple]:
+        now = time.time()
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, Tuple] = {}
+        with self._state_lock:
+            pending = {key: self._pending[key] for key in unique_keys if key in self._pending}
+        for key, op in pending.items():
+            if _alive(op[7], now):
+                found[key] = (op[2], op[3], op[7])
+        on_disk = [key for key in unique_keys if key not in pending]
+        conn = self._reader()
+        for i in range(0, len(on_disk), self.LOOKUP_CHUNK):
+            chunk = on_disk[i:i + self.LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            for key, message, metadata_str, dict_id, expires_at in conn.execute(
+                    f"SELECT key, message, metadata, dict_id, expires_at FROM cache WHERE key IN ({placeholders}) "
+                    f"AND (expires_at IS NULL OR expires_at > ?)", chunk + [now]):
+                found[key] = (self._decode(message, dict_id), metadata_str, expires_at)
+
+        for key in on_disk:
+            if key in found:
+                self._enqueue(("touch", key, now), strict=False)
+        with self._state_lock:
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found if with_expiry else {key: row[:2] for key, row in found.items()}
+
+    def put_raw(self, key: str, message: str, metadata_str: str, namespace: str = "") -> None:
+        now = time.time()
+        # size is filled in by the writer once the message has been encoded
+        op = ("put", key, message, metadata_str, None, now, namespace, now + self.ttl if self.ttl else None)
+        with self._state_lock:
+            if self._closed:
+                raise RuntimeError(f"Cache {self.path} is closed")
+            self._check_writer()
+            self._pending[key] = op
+            self._queue.put(op)
+
+    def flush(self) -> None:
+        """Block until every queued write has been committed."""
+        with self._state_lock:
+            self._check_writer()
+        self._queue.join()
+        with self._state_lock:
+            self._check_writer()
+
+    def _check_writer(self) -> None:
+        # callers hold _state_lock
+        if self._writer_error is not None:
+            raise RuntimeError(f"Cache writer for {self.path} has stopped") from self._writer_error
+
+    def _enqueue(self, op: Tuple, strict: bool = True) -> None:
+        """Queue an op for the writer; with strict=False a dead writer drops it silently (access-time touches)."""
+        with self._state_lock:
+            if self._writer_error is not None:
+                if strict:
+                    self._check_writer()
+                return
+            self._queue.put(op)
+
+    # ---------------------------- administration ----------------------------
+    # these run on the writer thread too, ordered after every write queued before them
+
+    def purge(self, namespace: Optional[str] = None, expired: bool = False) -> int:
+        """Delete every row of `namespace` and/or every expired row; returns the number of rows deleted."""
+        return self._admin("purge", namespace, expired)
+
+    def vacuum(self) -> None:
+        """Checkpoint the WAL and rebuild the file so that space freed by evictions and purges is returned."""
+        self._admin("vacuum")
+
+    def namespace_stats(self) -> List[Dict[str, Any]]:
+        self.flush()
+        now = time.time()
+        rows = self._reader().execute("""
+            SELECT namespace, COUNT(*), COALESCE(SUM(size), 0), MIN(created_at), MAX(accessed_at),
+                   SUM(CASE WHEN expires_at IS NOT NULL AND expires_at <= ? THEN 1 ELSE 0 END)
+            FROM cache GROUP BY namespace ORDER BY namespace
+        """, (now,)).fetchall()
+        return [{"namespace": ns, "entries": n, "bytes": size, "oldest": created, "last_used": accessed, "expired": expired}
+                for ns, n, size, created, accessed, expired in rows]
+
+    def recent_runs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        rows = self._reader().execute(
+            "SELECT started_at, finished_at, memory_hits, disk_hits, misses FROM cache_runs "
+            "ORDER BY started_at DESC LIMIT ?", (limit,)).fetchall()
+        return [{"started_at": started, "finished_at": finished, "memory_hits": memory_hits, "disk_hits": disk_hits,
+                 "misses": misses,
+                 "hit_rate": (memory_hits + disk_hits) / (memory_hits + disk_hits + misses) if misses + memory_hits + disk_hits else 0.0}
+                for started, finished, memory_hits, disk_hits, misses in rows]
+
+    def iter_rows(self, namespaces: Optional[List[str]] = None, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """
+        Yield every live (unexpired) row as a plain dict, decompressed, in key order; optionally only `namespaces`.
+        Used for exporting bundles.
+        """
+        self.flush()
+        conn = self._reader()
+        condition, params = "(expires_at IS NULL OR expires_at > ?)", [time.time()]
+        if namespaces:
+            condition += f" AND namespace IN ({','.join('?' * len(namespaces))})"
+            params += list(namespaces)
+        last_key = ""
+        while True:
+            rows = conn.execute(
+                f"SELECT key, namespace, message, metadata, dict_id, created_at, accessed_at, expires_at FROM cache "
+                f"WHERE key > ? AND {condition} ORDER BY key LIMIT ?", [last_key] + params + [batch_size]).fetchall()
+            if not rows:
+                return
+            for key, namespace, message, metadata_str, dict_id, created_at, accessed_at, expires_at in rows:
+                yield {"key": key, "namespace": namespace, "message": self._decode(message, dict_id),
+                       "metadata": metadata_str, "created_at": created_at, "accessed_at": accessed_at,
+                       "expires_at": expires_at}
+            last_key = rows[-1][0]
+
+    def merge_rows(self, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Merge rows shaped like `iter_rows` output, last writer wins: a row replaces the local one only if its
+        `created_at` is newer. Returns counts of inserted / updated / skipped rows.
+        """
+        return self._admin("merge", rows)
+
+    def compress_existing(self, retrain: bool = False, dict_size: int = 64 * 1024) -> Dict[str, Any]:
+        """
+        One-off migration: train a dictionary if there is none (or `retrain`), then rewrite every row that is plain
+        or uses an older dictionary. Returns the dictionary used and the stored size before/after.
+        """
+        return self._admin("compress", retrain, dict_size)
+
+    def compression_stats(self) -> Dict[str, Any]:
+        self.flush()
+        conn = self._reader()
+        dicts = [{"id": i, "codec": codec, "bytes": size, "samples": samples, "created_at": created}
+                 for i, codec, size, samples, created in conn.execute(
+                     "SELECT id, codec, LENGTH(data), samples, created_at FROM cache_dicts ORDER BY id")]
+        plain, compressed = conn.execute(
+            "SELECT SUM(dict_id IS NULL), SUM(dict_id IS NOT NULL) FROM cache").fetchone()
+        return {"dicts": dicts, "plain_rows": plain or 0, "compressed_rows": compressed or 0}
+
+    # ---------------------------- compression ----------------------------
+    def _codec(self, dict_id: int, conn: Optional[sqlite3.Connection] = None) -> DictCodec:
+        with self._state_lock:
+            codec = self._codecs.get(dict_id)
+        if codec is None:
+            row = (conn or self._reader()).execute("SELECT codec, data FROM cache_dicts WHERE id = ?", (dict_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"Compression dictionary {dict_id} missing from {self.path}")
+            codec = DictCodec(row[0], row[1])
+            with self._state_lock:
+                self._codecs[dict_id] = codec
+        return codec
+
+    def _decode(self, message: Any, dict_id: Optional[int]) -> str:
+        return message if dict_id is None else self._codec(dict_id).decompress(message)
+
+    def _encode(self, message: str) -> Tuple[Any, Optional[int]]:
+        if not self.compress or self._active_dict_id is None or len(message) < self.MIN_COMPRESS_CHARS:
+            return message, None
+        blob = self._codec(self._active_dict_id, self._write_conn).compress(message)
+        if len(blob) >= len(message.encode("utf-8")):
+            return message, None
+        return blob, self._active_dict_id
+
+    def _train_dict(self, dict_size: int) -> Optional[int]:
+        c = self._write_conn
+        rows = c.execute("SELECT message, dict_id FROM cache ORDER BY RANDOM() LIMIT ?", (self.TRAIN_SAMPLE_ROWS,)).fetchall()
+        samples = [self._decode(message, dict_id) for message, dict_id in rows]
+        codec = default_codec()
+        try:
+            data = train_dictionary(samples, codec, dict_size)
+        except Exception as e:  # e.g. zstd refuses to train on too few / too uniform samples
+            logger.warning(f"Could not train a {codec} dictionary for {self.path}: {e}")
+            return None
+        cur = c.execute("INSERT INTO cache_dicts (codec, data, samples, created_at) VALUES (?, ?, ?, ?)",
+                        (codec, data, len(samples), time.time()))
+        self._active_dict_id = cur.lastrowid
+        logger.info(f"Trained {codec} dictionary #{self._active_dict_id} ({len(data)} bytes) on {len(samples)} rows of {self.path}")
+        return self._active_dict_id
+
+    def _compress_existing(self, retrain: bool, dict_size: int) -> Dict[str, Any]:
+        c = self._write_conn
+        if retrain or self._active_dict_id is None:
+            self._train_dict(dict_size)
+        if self._active_dict_id is None:
+            return {"dict_id": None, "rows": 0, "bytes_before": self._total_bytes, "bytes_after": self._total_bytes}
+        bytes_before, rows, last_rowid = self._total_bytes, 0, 0
+        while True:
+            batch = c.execute(
+                "SELECT rowid, message, metadata, dict_id, size FROM cache WHERE rowid > ? "
+                "AND (dict_id IS NULL OR dict_id != ?) ORDER BY rowid LIMIT 500",
+                (last_rowid, self._active_dict_id)).fetchall()
+            if not batch:
+                break
+            for rowid, message, metadata_str, dict_id, old_size in batch:
+                last_rowid = rowid
+                stored, new_dict_id = self._encode(self._decode(message, dict_id))
+                size = _stored_size(stored) + len(metadata_str.encode("utf-8"))
+                c.execute("UPDATE cache SET message = ?, dict_id = ?, size = ? WHERE rowid = ?",
+                          (stored, new_dict_id, size, rowid))
+                self._total_bytes += size - old_size
+                rows += 1
+            c.commit()
+        # dictionaries no row refers to any more
+        c.execute("DELETE FROM cache_dicts WHERE id != ? AND id NOT IN "
+                  "(SELECT DISTINCT dict_id FROM cache WHERE dict_id IS NOT NULL)", (self._active_dict_id,))
+        c.commit()
+        codec = self._codec(self._active_dict_id, c)
+        return {"dict_id": self._active_dict_id, "codec": codec.codec, "rows": rows,
+                "bytes_before": bytes_before, "bytes_after": self._total_bytes}
+
+    def _admin(self, *op: Any) -> Any:
+        result: "queue.Queue[Any]" = queue.Queue(maxsize=1)
+        self._enqueue(("admin", result) + op)
+        outcome = result.get()
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def stats(self) -> Dict[str, Any]:
+        self.flush()
+        entries = self._reader().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        with self._state_lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "path": self.path,
+            "entries": entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def close(self, memory_hits: int = 0) -> None:
+        """Commit queued writes, record this run's hit counts in `cache_runs` and close all connections."""
+        with self._state_lock:
+            if self._closed:
+                return
+            self._closed = True
+            hits, misses = self.hits, self.misses
+        try:
+            if memory_hits or hits or misses:
+                self._enqueue(("run", self._started_at, time.time(), memory_hits, hits, misses))
+            self._enqueue(_STOP)
+        except RuntimeError as e:
+            logger.warning(f"Closing {self.path} without committing queued writes: {e}")
+        self._writer.join()
+        with self._state_lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        self._write_conn.close()
+
+    # ---------------------------- writer thread ----------------------------
+    def _writer_loop(self) -> None:
+        try:
+            self._write_until_stopped()
+        except BaseException as e:
+            logger.error(f"Cache writer for {self.path} stopped: {e!r}")
+            with self._state_lock:
+                self._writer_error = e
+                self._pending.clear()
+            # nothing is queued after _writer_error is set, so this empties the queue for good
+            while True:
+                try:
+                    op = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._fail_admin([op], e)
+                self._queue.task_done()
+
+    @staticmethod
+    def _fail_admin(batch: List[Any], error: BaseException) -> None:
+        """Answer admin callers with `error` instead of leaving them waiting for a result that will never come."""
+        for op in batch:
+            if op is not _STOP and op[0] == "admin":
+                try:
+                    op[1].put_nowait(error)
+                except queue.Full:
+                    pass
+
+    def _write_until_stopped(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # take whatever else is already queued, so a burst of writes shares a single commit
+            while len(batch) < self.write_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(op is _STOP for op in batch)
+            try:
+                self._apply_batch([op for op in batch if op is not _STOP])
+            except Exception as e:
+                # not only sqlite errors: encoding, decoding or dictionary training can fail too, and
+                # letting any of them escape would kill the writer and hang flush(), admin calls and close()
+                logger.warning(f"Failed to write {len(batch)} cache ops to {self.path}: {e!r}")
+                self._fail_admin(batch, e)
+                self._write_conn.rollback()
+                self._resync_after_rollback()
+            finally:
+                with self._state_lock:
+                    for op in batch:
+                        if op is not _STOP and op[0] == "put" and self._pending.get(op[1]) is op:
+                            del self._pending[op[1]]
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _resync_after_rollback(self) -> None:
+        """Re-read the writer-owned state a rolled-back transaction may have advanced past what is on disk."""
+        c = self._write_conn
+        self._total_bytes = c.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        self._row_count = c.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        # a dictionary trained in the rolled-back transaction is gone, and its id may be handed out again
+        dict_ids = {row[0] for row in c.execute("SELECT id FROM cache_dicts")}
+        self._active_dict_id = max(dict_ids) if dict_ids else None
+        with self._state_lock:
+            for dict_id in [d for d in self._codecs if d not in dict_ids]:
+                del self._codecs[dict_id]
+
+    def _apply_batch(self, batch: List[Tuple]) -> None:
+        if not batch:
+            return
+        c = self._write_conn
+        for op in batch:
+            if op[0] == "put":
+                _, key, message, metadata_str, _, now, namespace, expires_at = op
+                stored, dict_id = self._encode(message)
+                size = _stored_size(stored) + len(metadata_str.encode("utf-8"))
+                old = c.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+                c.execute(
+                    "INSERT OR REPLACE INTO cache (key, message, metadata, size, created_at, accessed_at, namespace, expires_at, dict_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, stored, metadata_str, size, now, now, namespace, expires_at, dict_id))
+                self._total_bytes += size - (old[0] if old else 0)
+                self._row_count += 0 if old else 1
+            elif op[0] == "touch":
+                _, key, now = op
+                c.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            elif op[0] == "run":
+                c.execute("INSERT INTO cache_runs VALUES (?, ?, ?, ?, ?)", op[1:])
+            else:
+                self._apply_admin(op)
+        if self.ttl is not None and time.time() - self._last_expiry_sweep > self.EXPIRY_SWEEP_INTERVAL:
+            self._last_expiry_sweep = time.time()
+            self._delete_where("expires_at IS NOT NULL AND expires_at <= ?", (self._last_expiry_sweep,))
+        if self.compress and self._active_dict_id is None and self._row_count >= self.TRAIN_MIN_ROWS:
+            if self._train_dict(64 * 1024) is None:
+                # do not retry on every batch; try again after as many new rows
+                self._row_count = 0
+        if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+            self._evict()
+        c.commit()
+
+    def _apply_admin(self, op: Tuple) -> None:
+        result, action, args = op[1], op[2], op[3:]
+        try:
+            if action == "purge":
+                namespace, expired = args
+                deleted = 0
+                if namespace is not None:
+                    deleted += self._delete_where("namespace = ?", (namespace,))
+                if expired:
+                    deleted += self._delete_where("expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+                self._write_conn.commit()
+                outcome: Any = deleted
+            elif action == "merge":
+                outcome = self._merge_rows(*args)
+            elif action == "compress":
+                outcome = self._compress_existing(*args)
+            else:
+                self._write_conn.commit()
+                self._write_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._write_conn.execute("VACUUM")
+                outcome = None
+        except Exception as e:
+            outcome = e
+        result.put(outcome)
+
+    def _merge_rows(self, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        c = self._write_conn
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for row in rows:
+            local = c.execute("SELECT created_at, accessed_at, size FROM cache WHERE key = ?", (row["key"],)).fetchone()
+            if local is not None and local[0] >= row["created_at"]:
+                counts["skipped"] += 1
+                continue
+            stored, dict_id = self._encode(row["message"])
+            size = _stored_size(stored) + len(row["metadata"].encode("utf-8"))
+            accessed_at = max(row["accessed_at"], local[1]) if local is not None else row["accessed_at"]
+            c.execute(
+                "INSERT OR REPLACE INTO cache (key, message, metadata, size, created_at, accessed_at, namespace, expires_at, dict_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (row["key"], stored, row["metadata"], size, row["created_at"], accessed_at, row["namespace"],
+                 row["expires_at"], dict_id))
+            self._total_bytes += size - (local[2] if local is not None else 0)
+            self._row_count += 0 if local is not None else 1
+            counts["updated" if local is not None else "inserted"] += 1
+        if self.max_bytes is not None and self._total_bytes > self.max_bytes:
+            self._evict()
+        c.commit()
+        return counts
+
+    def _delete_where(self, condition: str, params: Tuple) -> int:
+        c = self._write_conn
+        freed, count = c.execute(f"SELECT COALESCE(SUM(size), 0), COUNT(*) FROM cache WHERE {condition}", params).fetchone()
+        if count:
+            c.execute(f"DELETE FROM cache WHERE {condition}", params)
+            self._total_bytes -= freed
+        return count
+
+    def _evict(self) -> None:
+        target = int(self.max_bytes * self.EVICT_LOW_WATERMARK)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._write_conn.execute("SELECT key, size FROM cache ORDER BY accessed_at ASC LIMIT 256").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                self._write_conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._total_bytes -= size
+                evicted += 1
+        logger.debug(f"Evicted {evicted} LRU rows from {self.path}, {self._total_bytes} bytes left")
+
+
+class MemoryLRUCache:
+    """
+    In-process LRU tier, bounded both by entry count and by the total size of the stored strings.
+    Rows are kept as (message, metadata JSON string), so callers always get a fresh metadata dict.
+    With `ttl` (seconds) set, rows also expire the same way as on disk.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_bytes: Optional[int] = 64 * 1024 * 1024,
+                 ttl: Optional[float] = None) -> None:
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes) if max_bytes else None
+        self.ttl = float(ttl) if ttl else None
+        self._rows: "OrderedDict[str, Tuple[str, str, int, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None and not _alive(row[3], time.time()):
+                del self._rows[key]
+                self._bytes -= row[2]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end(key)
+            self.hits += 1
+        return row[0], row[1]
+
+    def put(self, key: str, message: str, metadata_str: str, expires_at: Any = _UNSET) -> None:
+        """`expires_at` carries over a disk row's expiry when it is promoted; fresh writes get now + ttl."""
+        if expires_at is _UNSET:
+            expires_at = time.time() + self.ttl if self.ttl else None
+        # len() of str is close enough to the encoded size and avoids encoding every row
+        size = len(message) + len(metadata_str)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._rows.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._rows[key] = (message, metadata_str, size, expires_at)
+            self._bytes += size
+            while self._rows and (len(self._rows) > self.max_entries
+                                  or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, evicted = self._rows.popitem(last=False)
+                self._bytes -= evicted[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._rows),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class TieredResponseCache:
+    """
+    Memory LRU in front of the SQLite store, with the same get / get_many / put interface.
+
+    Reads try memory first and promote disk hits into memory; writes go through to both tiers. Hot prompts are
+    answered without touching the filesystem (they also do not refresh their on-disk LRU position, which only
+    matters once they fall out of memory).
+    """
+
+    def __init__(self, disk: SQLiteResponseCache, memory: Optional[MemoryLRUCache] = None) -> None:
+        self.disk = disk
+        self.memory = memory
+        # forwarded to the disk tier for administration (namespace_stats, recent_runs, vacuum)
+        self.namespace_stats = disk.namespace_stats
+        self.recent_runs = disk.recent_runs
+        self.vacuum = disk.vacuum
+
+    @property
+    def path(self) -> str:
+        return self.disk.path
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        row = self.memory.get(key) if self.memory is not None else None
+        if row is None:
+            row = self.disk.get_raw(key, with_expiry=True)
+            if row is None:
+                return None
+            if self.memory is not None:
+                # keep the disk row's expiry, so promotion does not extend its lifetime
+                self.memory.put(key, row[0], row[1], expires_at=row[2])
+        return row[0], json.loads(row[1])
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+        found: Dict[str, Tuple[str, str]] = {}
+        if self.memory is not None:
+            for key in dict.fromkeys(keys):
+                row = self.memory.get(key)
+                if row is not None:
+                    found[key] = row
+        from_disk = self.disk.get_many_raw([key for key in keys if key not in found], with_expiry=True)
+        for key, (message, metadata_str, expires_at) in from_disk.items():
+            if self.memory is not None:
+                self.memory.put(key, message, metadata_str, expires_at=expires_at)
+            found[key] = (message, metadata_str)
+        return {key: (message, json.loads(metadata_str)) for key, (message, metadata_str) in found.items()}
+
+    def put(self, key: str, message: str, metadata: Dict[str, Any], namespace: str = "") -> None:
+        metadata_str = json.dumps(metadata, ensure_ascii=False)
+        if self.memory is not None:
+            self.memory.put(key, message, metadata_str)
+        self.disk.put_raw(key, message, metadata_str, namespace)
+
+    def purge(self, namespace: Optional[str] = None, expired: bool = False) -> int:
+        # the memory tier does not know namespaces, so it is simply dropped
+        if self.memory is not None:
+            self.memory.clear()
+        return self.disk.purge(namespace, expired)
+
+    def flush(self) -> None:
+        self.disk.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        disk = self.disk.stats()
+        memory = self.memory.stats() if self.memory is not None else None
+        hits = disk["hits"] + (memory["hits"] if memory else 0)
+        lookups = hits + disk["misses"]
+        return {
+            "path": self.path,
+            "hits": hits,
+            "misses": disk["misses"],
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory": memory,
+            "disk": disk,
+        }
+
+    def close(self) -> None:
+        self.disk.close(memory_hits=self.memory.hits if self.memory is not None else 0)
+
+
+_CACHES: Dict[str, TieredResponseCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_response_cache(path: str, max_bytes: Optional[int] = None, memory_entries: int = 4096,
+                       memory_bytes: Optional[int] = 64 * 1024 * 1024, ttl: Optional[float] = None,
+                       **kwargs: Any) -> TieredResponseCache:
+    """
+    Process-wide shared cache instance per file, so every client writing to the same file shares counters.
+    `memory_entries=0` disables the in-memory tier; `ttl` is in seconds. Arguments only apply when the file is
+    first opened.
+    """
+    key = os.path.abspath(path)
+    with _CACHES_LOCK:
+        cache = _CACHES.get(key)
+        if cache is None:
+            memory = MemoryLRUCache(memory_entries, memory_bytes, ttl=ttl) if memory_entries else None
+            cache = TieredResponseCache(SQLiteResponseCache(path, max_bytes=max_bytes, ttl=ttl, **kwargs), memory)
+            _CACHES[key] = cache
+        return cache
+
+
+@atexit.register
+def close_all_caches() -> None:
+    """Commit queued writes and close every shared cache (also runs at interpreter exit)."""
+    with _CACHES_LOCK:
+        caches = list(_CACHES.values())
+        _CACHES.clear()
+    for cache in caches:
+        cache.close()
@@ -0,0 +1,138 @@
+"""
+Record/replay cassettes for LLM backends.
+
+In `record` mode every backend call goes out as usual and the (request, response, latency) triple is appended to a
+JSONL cassette. In `replay` mode no backend is contacted: responses are served from the cassette, either instantly
+or after sleeping for the recorded latency, so the rest of the pipeline can be profiled on a machine without GPUs.
+
+Requests are matched on the canonical JSON of everything sent to the backend. A request recorded several times is
+replayed in recording order, repeating the last response once exhausted.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..utils.logging_utils import get_logger
+from .cache_store import make_cache_key
+
+logger = get_logger(__name__)
+
+CASSETTE_MODES = ("off", "record", "replay")
+
+
+class CassetteMiss(KeyError):
+    """Replay mode got a request that is not on the cassette."""
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str, replay_latency: bool = False) -> None:
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}, expected 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.replay_latency = bool(replay_latency)
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursor: Dict[str, int] = defaultdict(int)
+        self.recorded = 0
+        self.replayed = 0
+
+        if mode == "replay":
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Cassette {path} does not exist, record it first")
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries[entry["key"]].append(entry)
+            logger.info(f"Loaded cassette {path}: {sum(len(v) for v in self._entries.values())} recorded calls")
+        else:
+            dir_path = os.path.dirname(path)
+            if dir_path:
+                os.makedirs(dir_path, exist_ok=True)
+            # appended to, so several backends (and reruns) can share one cassette
+            self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def request_key(backend: str, request: Any) -> str:
+        return make_cache_key({"backend": backend, "request": request})
+
+    # ---------------------------- sync ----------------------------
+    def call(self, backend: str, request: Any, live: Callable[[], Any]) -> Any:
+        """Serve `request` from the cassette (replay) or run `live()` and record its result (record)."""
+        key = self.request_key(backend, request)
+        if self.mode == "replay":
+            entry = self._next(key, backend)
+            if self.replay_latency:
+                time.sleep(entry["latency"])
+            return entry["response"]
+        start = time.perf_counter()
+        response = live()
+        self._record(key, backend, request, response, time.perf_counter() - start)
+        return response
+
+    # ---------------------------- async ----------------------------
+    async def acall(self, backend: str, request: Any, live: Callable[[], Awaitable[Any]]) -> Any:
+        key = self.request_key(backend, request)
+        if self.mode == "replay":
+            entry = self._next(key, backend)
+            if self.replay_latency:
+                await asyncio.sleep(entry["latency"])
+            return entry["response"]
+        start = time.perf_counter()
+        response = await live()
+        self._record(key, backend, request, response, time.perf_counter() - start)
+        return response
+
+    # ---------------------------- internals ----------------------------
+    def _next(self, key: str, backend: str) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise CassetteMiss(f"{backend} request not found on cassette {self.path} (key {key[:12]}); "
+                                   f"re-record it with the current prompts and settings")
+            i = self._cursor[key]
+            self._cursor[key] = i + 1
+            self.replayed += 1
+            return entries[min(i, len(entries) - 1)]
+
+    def _record(self, key: str, backend: str, request: Any, response: Any, latency: float) -> None:
+        line = json.dumps({"key": key, "backend": backend, "request": request, "response": response,
+                           "latency": round(latency, 6)}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.recorded += 1
+
+    def close(self) -> None:
+        if self.mode == "record":
+            with self._lock:
+                self._file.close()
+
+
+_CASSETTES: Dict[str, Cassette] = {}
+_CASSETTES_LOCK = threading.Lock()
+
+
+def get_cassette(path: Optional[str], mode: Optional[str], replay_latency: bool = False) -> Optional[Cassette]:
+    """Shared cassette per file (None when mode is off/empty), so every backend of a run records into one file."""
+    if not mode or mode == "off":
+        return None
+    if mode not in CASSETTE_MODES:
+        raise ValueError(f"Unknown cassette mode: {mode}, expected one of {CASSETTE_MODES}")
+    if not path:
+        raise ValueError(f"Cassette mode '{mode}' needs a cassette path")
+    key = os.path.abspath(path)
+    with _CASSETTES_LOCK:
+        cassette = _CASSETTES.get(key)
+        if cassette is None:
+            cassette = Cassette(path, mode, replay_latency)
+            _CASSETTES[key] = cassette
+        elif cassette.mode != mode:
+            raise ValueError(f"Cassette {path} is already open in {cassette.mode} mode")
+        return cassette
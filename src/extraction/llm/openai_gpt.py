@@ -2,110 +2,123 @@ import functools
 import hashlib
 import json
 import os
-import sqlite3
+import time
 from copy import deepcopy
-from typing import List, Tuple
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 import openai
-from filelock import FileLock
 from openai import OpenAI
 from openai import AzureOpenAI
 from packaging import version
 from tenacity import retry, stop_after_attempt, wait_fixed
+from tqdm import tqdm
 
 from ..utils.config_utils import BaseConfig
 from ..utils.llm_utils import (
     TextChatMessage
 )
 from ..utils.logging_utils import get_logger
+from ..utils.metrics_utils import current_labels, get_metrics, metric_labels
+from ..utils.singleflight_utils import get_single_flight
 from .base import BaseLLM, LLMConfig
+from .cache_store import fingerprint_dir, get_response_cache
+from .cassette import get_cassette
 
 logger = get_logger(__name__)
 
+PROMPT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts", "templates")
+
+def _cache_key_hash(self, messages, kwargs) -> str:
+    # get model, seed and temperature from kwargs or self.llm_config.generate_params
+    gen_params = getattr(self, "llm_config", {}).generate_params if hasattr(self, "llm_config") else {}
+    model = kwargs.get("model", gen_params.get("model"))
+    seed = kwargs.get("seed", gen_params.get("seed"))
+    temperature = kwargs.get("temperature", gen_params.get("temperature"))
+    max_completion_tokens = kwargs.get("max_completion_tokens", gen_params.get("max_completion_tokens"))
+    response_format = kwargs.get("response_format", gen_params.get("response_format"))
+
+    # build key data, convert to JSON string and hash to generate key_hash
+    key_data = {
+        "messages": messages,  # messages requires JSON serializable
+        "model": model,
+        "seed": seed,
+        "temperature": temperature,
+        "max_completion_tokens": max_completion_tokens,
+        "response_format": response_format,
+        "namespace": getattr(self, "cache_namespace", ""),
+    }
+    key_str = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(key_str.encode("utf-8")).hexdigest()
+
+# concurrent identical requests across CacheOpenAI instances of this process are sent once
+_IN_FLIGHT = get_single_flight("cache_openai")
+
 def cache_response(func):
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         # get messages from args or kwargs
         if args:
-            messages = args[0]
+            messages, args = args[0], args[1:]
         else:
-            messages = kwargs.get("messages")
+            messages = kwargs.pop("messages", None)
         if messages is None:
             raise ValueError("Missing required 'messages' parameter for caching.")
 
-        # get model, seed and temperature from kwargs or self.llm_config.generate_params
-        gen_params = getattr(self, "llm_config", {}).generate_params if hasattr(self, "llm_config") else {}
-        model = kwargs.get("model", gen_params.get("model"))
-        seed = kwargs.get("seed", gen_params.get("seed"))
-        temperature = kwargs.get("temperature", gen_params.get("temperature"))
-
-        # build key data, convert to JSON string and hash to generate key_hash
-        key_data = {
-            "messages": messages,  # messages requires JSON serializable
-            "model": model,
-            "seed": seed,
-            "temperature": temperature,
-        }
-        key_str = json.dumps(key_data, sort_keys=True, default=str)
-        key_hash = hashlib.sha256(key_str.encode("utf-8")).hexdigest()
-
-        # the file name of lock, ensure mutual exclusion when accessing concurrently
-        lock_file = self.cache_file_name + ".lock"
-
-        # Try to read from SQLite cache
-        with FileLock(lock_file):
-            conn = sqlite3.connect(self.cache_file_name)
-            c = conn.cursor()
-            # if the table does not exist, create it
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS cache (
-                    key TEXT PRIMARY KEY,
-                    message TEXT,
-                    metadata TEXT
-                )
-            """)
-            conn.commit()  # commit to save the table creation
-            c.execute("SELECT message, metadata FROM cache WHERE key = ?", (key_hash,))
-            row = c.fetchone()
-            conn.close()
-            if row is not None:
-                message, metadata_str = row
-                metadata = json.loads(metadata_str)
-                # return cached result and mark as hit
-                return message, metadata, True
-
-        # if cache miss, call the original function to get the result
-        result = func(self, *args, **kwargs)
-        message, metadata = result
-
-        # insert new result into cache
-        with FileLock(lock_file):
-            conn = sqlite3.connect(self.cache_file_name)
-            c = conn.cursor()
-            # make sure the table exists again (if it doesn't exist, it would be created)
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS cache (
-                    key TEXT PRIMARY KEY,
-                    message TEXT,
-                    metadata TEXT
-                )
-            """)
-            metadata_str = json.dumps(metadata)
-            c.execute("INSERT OR REPLACE INTO cache (key, message, metadata) VALUES (?, ?, ?)",
-                      (key_hash, message, metadata_str))
-            conn.commit()
-            conn.close()
+        start = time.perf_counter()
+        key_hash = _cache_key_hash(self, messages, kwargs)
 
+        # memory LRU first, then the shared SQLite store (WAL reads, writes batched by a background thread);
+        # bypassed while a cassette is active, so every call is recorded and replays never touch the real cache
+        use_cache = self.cassette is None
+        row = self.response_cache.get(key_hash) if use_cache else None
+        if row is not None:
+            message, metadata = row
+            _record_call(self, start, "hit")
+            # return cached result and mark as hit
+            return message, metadata, True
+
+        # if cache miss, call the original function to get the result and insert it into cache;
+        # identical prompts already in flight (e.g. from another thread) share that call instead of sending their own
+        leader = []
+
+        def fetch():
+            leader.append(True)
+            message, metadata = func(self, messages, *args, **kwargs)
+            if use_cache:
+                self.response_cache.put(key_hash, message, metadata, namespace=self.cache_namespace)
+            return message, metadata
+
+        try:
+            message, metadata = _IN_FLIGHT.do(key_hash, fetch)
+        except Exception:
+            _record_call(self, start, "miss" if leader else "shared", ok=False)
+            raise
+        _record_call(self, start, "miss" if leader else "shared", metadata if leader else None)
         return message, metadata, False
 
     return wrapper
 
+def _record_call(llm, start: float, cache: str, metadata: Optional[dict] = None, ok: bool = True) -> None:
+    """Report one cache-aware call to the shared metrics registry (tokens only for calls that reached the API)."""
+    metadata = metadata or {}
+    get_metrics().record_call(type(llm).__name__, time.perf_counter() - start, cache=cache, ok=ok,
+                              prompt_tokens=int(metadata.get("prompt_tokens") or 0),
+                              completion_tokens=int(metadata.get("completion_tokens") or 0))
+
 def dynamic_retry_decorator(func):
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
         max_retries = getattr(self, "max_retries", 5)  
-        dynamic_retry = retry(stop=stop_after_attempt(max_retries), wait=wait_fixed(1))
+        backend = type(self).__name__
+
+        def _note_retry(retry_state):
+            error = retry_state.outcome.exception() if retry_state.outcome else None
+            get_metrics().record_retry(backend, type(error).__name__ if error else "unknown")
+
+        dynamic_retry = retry(stop=stop_after_attempt(max_retries), wait=wait_fixed(1), before_sleep=_note_retry)
         decorated_func = dynamic_retry(func)
         return decorated_func(self, *args, **kwargs)
     return wrapper
@@ -134,6 +147,16 @@ class CacheOpenAI(BaseLLM):
         if cache_filename is None:
             cache_filename = f"{self.llm_name.replace('/', '_')}_cache.sqlite"
         self.cache_file_name = os.path.join(self.cache_dir, cache_filename)
+        self.response_cache = get_response_cache(
+            self.cache_file_name,
+            max_bytes=int(global_config.llm_cache_max_mb * 1024 * 1024) if global_config.llm_cache_max_mb else None,
+            memory_entries=global_config.llm_cache_memory_entries,
+            memory_bytes=int(global_config.llm_cache_memory_mb * 1024 * 1024) if global_config.llm_cache_memory_mb else None,
+            ttl=global_config.llm_cache_ttl_hours * 3600 if global_config.llm_cache_ttl_hours else None,
+            compress=global_config.llm_cache_compress)
+        # rows are tagged with model + prompt template version, so stale template versions can be purged
+        self.cache_namespace = global_config.llm_cache_namespace or \
+            f"{self.llm_name}@{fingerprint_dir(PROMPT_TEMPLATES_DIR)}"
 
         self._init_llm_config()
         if high_throughput:
@@ -143,6 +166,9 @@ class CacheOpenAI(BaseLLM):
             client = None
 
         self.max_retries = kwargs.get("max_retries", 2)
+        # record/replay of API calls (off unless llm_cassette_mode is set)
+        self.cassette = get_cassette(global_config.llm_cassette_path, global_config.llm_cassette_mode,
+                                     replay_latency=global_config.llm_cassette_replay_latency)
 
         if self.global_config.azure_endpoint is None:
             self.openai_client = OpenAI(base_url=self.llm_base_url, http_client=client, max_retries=self.max_retries)
@@ -167,12 +193,148 @@ class CacheOpenAI(BaseLLM):
         logger.debug(f"Init {self.__class__.__name__}'s llm_config: {self.llm_config}")
 
     @cache_response
-    @dynamic_retry_decorator
     def infer(
         self,
         messages: List[TextChatMessage],
         **kwargs
     ) -> Tuple[List[TextChatMessage], dict]:
+        return self._call_api(messages, **kwargs)
+
+    def batch_infer(
+        self,
+        batch_messages: List[List[TextChatMessage]],
+        max_workers: Optional[int] = None,
+        return_exceptions: bool = False,
+        progress_desc: Optional[str] = None,
+        **kwargs
+    ) -> Tuple[List[str], List[dict]]:
+        """
+        Cached inference over a whole batch of prompts.
+
+        All prompts are hashed up front and resolved against the cache with a single bulk lookup; only the misses
+        (each distinct prompt once, joining any identical call already in flight) are sent to the API, concurrently on
+        up to `max_workers` threads. Results come back in input order, with `cache_hit` set in every metadata dict.
+        While a cassette is active the cache is bypassed and every prompt goes through the cassette.
+
+        Args:
+            batch_messages: one chat history per prompt.
+            max_workers: thread count for the misses (ThreadPoolExecutor default when None).
+            return_exceptions: if True, a failed prompt yields the exception in place of its response and
+                `{"error": ...}` as metadata; otherwise the first failure is raised once the batch has finished.
+            progress_desc: if set, show a per-prompt tqdm bar with this description; cache hits are counted at once,
+                misses as each call completes, with running token and cache-hit totals as postfix.
+
+        Returns:
+            Tuple[List[str], List[dict]]: responses and metadata, aligned with `batch_messages`.
+        """
+        start = time.perf_counter()
+        cache = self.response_cache if self.cassette is None else None
+        keys = [_cache_key_hash(self, messages, kwargs) for messages in batch_messages]
+        cached = cache.get_many(keys) if cache is not None else {}
+        # one bulk lookup serves every hit, so each is charged its share rather than the whole lookup time
+        hit_latency = (time.perf_counter() - start) / max(1, len(keys))
+        for key in keys:
+            if key in cached:
+                get_metrics().record_call(type(self).__name__, hit_latency, cache="hit")
+
+        misses: Dict[str, List[TextChatMessage]] = {}
+        for key, messages in zip(keys, batch_messages):
+            if key not in cached and key not in misses:
+                misses[key] = messages
+        logger.info(f"batch_infer: {len(batch_messages)} prompts, {len(batch_messages) - sum(k in misses for k in keys)} "
+                    f"served from cache, {len(misses)} sent to {self.llm_name}")
+
+        pbar = tqdm(total=len(keys), desc=progress_desc) if progress_desc else None
+        prompts_per_key = Counter(keys)
+        totals = {"total_prompt_tokens": 0, "total_completion_tokens": 0, "num_cache_hit": 0}
+
+        def _advance(key, metadata, hit):
+            # every prompt sharing `key` is resolved by the same lookup or call
+            if pbar is None:
+                return
+            n = prompts_per_key[key]
+            if isinstance(metadata, dict):
+                totals["total_prompt_tokens"] += n * int(metadata.get("prompt_tokens") or 0)
+                totals["total_completion_tokens"] += n * int(metadata.get("completion_tokens") or 0)
+            totals["num_cache_hit"] += n if hit else 0
+            pbar.update(n)
+            pbar.set_postfix(totals)
+
+        def _fetch(key):
+            message, metadata = self._call_api(misses[key], **kwargs)
+            if cache is not None:
+                cache.put(key, message, metadata, namespace=self.cache_namespace)
+            return message, metadata
+
+        labels = current_labels()  # worker threads do not inherit the caller's stage / template labels
+
+        def _run(key):
+            started = time.perf_counter()
+            leader = []
+
+            def fetch():
+                leader.append(True)
+                return _fetch(key)
+
+            with metric_labels(**labels):
+                try:
+                    result = _IN_FLIGHT.do(key, fetch)
+                except Exception as e:
+                    _record_call(self, started, "miss" if leader else "shared", ok=False)
+                    return key, e
+                _record_call(self, started, "miss" if leader else "shared", result[1] if leader else None)
+            return key, result
+
+        fresh: Dict[str, Any] = {}
+        try:
+            for key in prompts_per_key:
+                if key in cached:
+                    _advance(key, cached[key][1], True)
+            if misses:
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for future in as_completed([executor.submit(_run, key) for key in misses]):
+                        key, result = future.result()
+                        fresh[key] = result
+                        _advance(key, None if isinstance(result, Exception) else result[1], False)
+        finally:
+            if pbar is not None:
+                pbar.close()
+
+        responses, metadatas = [], []
+        for key in keys:
+            if key in cached:
+                message, metadata = cached[key]
+                metadata = dict(metadata, cache_hit=True)
+            else:
+                result = fresh[key]
+                if isinstance(result, Exception):
+                    if not return_exceptions:
+                        raise result
+                    message, metadata = result, {"error": str(result), "cache_hit": False}
+                else:
+                    message, metadata = result[0], dict(result[1], cache_hit=False)
+            responses.append(message)
+            metadatas.append(metadata)
+        return responses, metadatas
+
+    def _call_api(
+        self,
+        messages: List[TextChatMessage],
+        **kwargs
+    ) -> Tuple[str, dict]:
+        if self.cassette is None:
+            return self._call_api_live(messages, **kwargs)
+        request = dict(self.llm_config.generate_params, **kwargs, messages=messages)
+        message, metadata = self.cassette.call(self.__class__.__name__, request,
+                                               lambda: list(self._call_api_live(messages, **kwargs)))
+        return message, metadata
+
+    @dynamic_retry_decorator
+    def _call_api_live(
+        self,
+        messages: List[TextChatMessage],
+        **kwargs
+    ) -> Tuple[str, dict]:
         params = deepcopy(self.llm_config.generate_params)
         if kwargs:
             params.update(kwargs)
@@ -1,17 +1,23 @@
-from typing import List
+import time
+from typing import TYPE_CHECKING, List
 
 from src.extraction.llm.base import LLMConfig
+from src.extraction.llm.cassette import get_cassette
 from src.extraction.utils.llm_utils import TextChatMessage
 from src.extraction.utils.logging_utils import get_logger
+from src.extraction.utils.metrics_utils import get_metrics, metric_labels
+from src.utils.tracing import span
 
 logger = get_logger(__name__)
 
-from transformers import PreTrainedTokenizer
+# vllm / transformers are imported lazily, so replaying a cassette works without a GPU stack installed
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizer
 
-def convert_text_chat_messages_to_strings(messages: List[TextChatMessage], tokenizer: PreTrainedTokenizer, add_assistant_header=True) -> List[str]:
+def convert_text_chat_messages_to_strings(messages: List[TextChatMessage], tokenizer: "PreTrainedTokenizer", add_assistant_header=True) -> List[str]:
     return tokenizer.apply_chat_template(conversation=messages, tokenize=False)
 
-def convert_text_chat_messages_to_input_ids(messages: List[TextChatMessage], tokenizer: PreTrainedTokenizer, add_assistant_header=True) -> List[List[int]]:
+def convert_text_chat_messages_to_input_ids(messages: List[TextChatMessage], tokenizer: "PreTrainedTokenizer", add_assistant_header=True) -> List[List[int]]:
     prompt = tokenizer.apply_chat_template(
         conversation=messages,
         chat_template=None,
@@ -23,8 +29,6 @@ def convert_text_chat_messages_to_input_ids(messages: List[TextChatMessage], tok
     )
     encoded = tokenizer(prompt, add_special_tokens=False)
     return encoded['input_ids']
-from vllm import SamplingParams, LLM
-from vllm.sampling_params import StructuredOutputsParams
 class VLLMOffline:
 
     def _init_llm_config(self) -> None:
@@ -51,6 +55,23 @@ class VLLMOffline:
         os.environ['VLLM_WORKER_MULTIPROC_METHOD'] = 'spawn' #启动多个 GPU 工作进程
         self.model_name = model_name
 
+        if cache_filename is None:
+            cache_filename = f'{model_name.replace("/", "_")}_cache.sqlite'
+        if cache_dir is None:
+            cache_dir = os.path.join(global_config.save_dir, "llm_cache")#outputs/musique
+        self.cache_file_name = os.path.join(cache_dir, cache_filename)
+
+        # 录制/回放：回放模式不加载模型，也不需要 vllm
+        self.cassette = get_cassette(getattr(global_config, "llm_cassette_path", None),
+                                     getattr(global_config, "llm_cassette_mode", "off"),
+                                     replay_latency=getattr(global_config, "llm_cassette_replay_latency", False))
+        if self.cassette is not None and self.cassette.mode == "replay":
+            self.client = None
+            self.tokenizer = None
+            return
+
+        from vllm import LLM
+
         # engine_args = EngineArgs(
         #     max_seq_len=max_model_len,
         #     # 如果需要，可以在这里加其他 EngineArgs 参数
@@ -79,14 +100,35 @@ class VLLMOffline:
         )
 
         self.tokenizer = self.client.get_tokenizer()
-        if cache_filename is None:
-            cache_filename = f'{model_name.replace("/", "_")}_cache.sqlite'
-        if cache_dir is None:
-            cache_dir = os.path.join(global_config.save_dir, "llm_cache")#outputs/musique
-        self.cache_file_name = os.path.join(cache_dir, cache_filename)
-    
+
+    def _record_or_replay(self, request, live, num_requests=1):
+        start = time.perf_counter()
+        with span("llm_call", cat="llm", backend=self.__class__.__name__, method=request["method"],
+                  num_requests=num_requests):
+            if self.cassette is None:
+                response, metadata = live()
+            else:
+                response, metadata = tuple(self.cassette.call(self.__class__.__name__, request, lambda: list(live())))
+        self._record_metrics(time.perf_counter() - start, metadata, num_requests)
+        return response, metadata
+
+    def _record_metrics(self, latency, metadata, num_requests):
+        # 离线生成按整批计时；调用次数按批内请求数累加，回放 cassette 时 cache 记为 replay
+        metrics = get_metrics()
+        backend = self.__class__.__name__
+        cache = "replay" if self.cassette is not None and self.cassette.mode == "replay" else "miss"
+        metrics.observe("llm_batch_latency_seconds", latency, backend=backend, cache=cache)
+        metrics.inc("llm_calls_total", num_requests, backend=backend, cache=cache, status="ok")
+        metrics.inc("llm_prompt_tokens_total", int(metadata.get("prompt_tokens") or 0), backend=backend)
+        metrics.inc("llm_completion_tokens_total", int(metadata.get("completion_tokens") or 0), backend=backend)
+
     def infer(self, messages: List[TextChatMessage], max_tokens=2048):
         logger.info(f"Calling VLLM offline, # of messages {len(messages)}")
+        return self._record_or_replay({"method": "infer", "messages": messages, "max_tokens": max_tokens},
+                                      lambda: self._infer_live(messages, max_tokens))
+
+    def _infer_live(self, messages: List[TextChatMessage], max_tokens=2048):
+        from vllm import SamplingParams
         messages_list = [messages]
         prompt_ids = convert_text_chat_messages_to_input_ids(messages_list, self.tokenizer)
 
@@ -112,6 +154,16 @@ class VLLMOffline:
         messages_list: List[List[TextChatMessage]]  每条列表表示一条对话历史
         返回: parsed_responses, metadata
         """
+        request = {"method": "batch_infer", "messages_list": messages_list, "max_tokens": max_tokens,
+                   "json_template": json_template, "temp": temp, "tp": tp}
+        with metric_labels(template=json_template):
+            return self._record_or_replay(
+                request, lambda: self._batch_infer_live(messages_list, max_tokens, json_template, temp, tp),
+                num_requests=len(messages_list))
+
+    def _batch_infer_live(self, messages_list, max_tokens, json_template, temp, tp):
+        from vllm import SamplingParams
+        from vllm.sampling_params import StructuredOutputsParams
 
         # -----------------------------
         # 配置结构化输出 (JSON)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：按 endpoint 自适应调整在途请求上限（AIMD），以及识别 Retry-After 的重试退避。
+- 请求成功且延迟正常、并且上限已被用满时，上限加性增加（每个"往返窗口"约 +1）；首次过载或延迟变差之前为慢启动，
+  每个成功请求 +1，尽快逼近服务端容量；
+- 遇到 429 / 503 / 超时时上限乘性减小（同一窗口内只减一次），并按 Retry-After 暂停该 endpoint 的新请求；
+- 同一个控制器同时服务同步（线程）与异步（任意事件循环）调用方，吞吐最终稳定在服务端的实际承载能力附近。
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+
+from .logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# 视为"服务端过载"的状态码：触发乘性减小
+OVERLOAD_STATUS = (429, 503)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数；缺失或无法解析时返回 None"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None, cap: float = 10.0) -> float:
+    """
+    第 attempt 次（从 1 开始）失败后的等待时间：有 Retry-After 时按其等待（加少量抖动），
+    否则指数退避 min(2**attempt, cap) 并随机抖动，避免大量请求同时重试。
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, 0.1 * max(retry_after, 1.0))
+    return min(2 ** attempt, cap) * random.uniform(0.5, 1.0)
+
+
+class AIMDLimiter:
+    """
+    单个 endpoint 的自适应并发上限。
+    - acquire() / aacquire() 获取在途名额，release() 归还并上报结果（延迟、状态码、Retry-After、是否超时）；
+    - 延迟"正常"指不超过 latency_tolerance × 基线延迟，基线取近期延迟的慢速衰减最小值；latency_tolerance<=0 时只看过载信号。
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 256,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0, name: str = "") -> None:
+        if not 0 < backoff < 1:
+            raise ValueError(f"backoff 必须在 (0, 1) 之间: {backoff}")
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.backoff = float(backoff)
+        self.latency_tolerance = float(latency_tolerance)
+
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: Deque[asyncio.Future] = deque()
+        self._limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._baseline: Optional[float] = None
+        self._ewma_latency = 0.0
+        self._last_decrease = 0.0
+        self._slow_start = True
+        self._counts = {"ok": 0, "overloaded": 0, "decreases": 0, "peak_in_flight": 0}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    # ---------------------------- 获取名额 ----------------------------
+    def _try_acquire(self) -> float:
+        """调用方需持有锁。成功返回 0；否则返回建议等待的秒数（负数表示等待名额释放）"""
+        wait = self._blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self._in_flight < int(self._limit):
+            self._in_flight += 1
+            self._counts["peak_in_flight"] = max(self._counts["peak_in_flight"], self._in_flight)
+            return 0.0
+        return -1.0
+
+    def acquire(self) -> None:
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0.0:
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+                if wait == 0.0:
+                    return
+                if wait < 0:
+                    fut = loop.create_future()
+                    self._async_waiters.append(fut)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # 已被唤醒却在恢复运行前被取消：把唤醒交给下一个等待者
+                if fut.done() and not fut.cancelled():
+                    with self._lock:
+                        self._wake(1)
+                raise
+
+    # ---------------------------- 归还名额并调整上限 ----------------------------
+    def release(self, latency: float, status: Optional[int] = None, retry_after: Optional[str] = None,
+                timeout: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            saturated = self._in_flight >= int(self._limit)
+            self._in_flight -= 1
+            if timeout or status in OVERLOAD_STATUS:
+                self._counts["overloaded"] += 1
+                self._on_overload(now, parse_retry_after(retry_after) if status in OVERLOAD_STATUS else None)
+            elif status is not None and 200 <= status < 300:
+                self._counts["ok"] += 1
+                self._on_success(latency, saturated)
+            self._wake(max(1, int(self._limit) - self._in_flight))
+
+    def _on_success(self, latency: float, saturated: bool) -> None:
+        if self._baseline is None or latency < self._baseline:
+            self._baseline = latency
+        else:
+            # 慢速上漂，服务端负载形态变化（如输出变长）后基线能跟上
+            self._baseline += 0.005 * (latency - self._baseline)
+        self._ewma_latency = latency if not self._ewma_latency else 0.9 * self._ewma_latency + 0.1 * latency
+        healthy = self.latency_tolerance <= 0 or latency <= self.latency_tolerance * self._baseline
+        if not healthy:
+            self._slow_start = False
+        # 只有上限真正被用满时才探测更高的并发，否则低负载下上限会无意义地涨到 max_limit
+        elif saturated and self._limit < self.max_limit:
+            step = 1.0 if self._slow_start else 1.0 / self._limit
+            self._limit = min(self.max_limit, self._limit + step)
+
+    def _on_overload(self, now: float, retry_after: Optional[float]) -> None:
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        # 同一窗口内的一批过载响应来自同一次过载，只减一次
+        if now - self._last_decrease < max(self._ewma_latency, 0.05):
+            return
+        old = self.limit
+        self._slow_start = False
+        self._limit = max(float(self.min_limit), self._limit * self.backoff)
+        self._last_decrease = now
+        self._counts["decreases"] += 1
+        logger.debug(f"AIMD {self.name}: limit {old} -> {self.limit} (in flight {self._in_flight})")
+
+    def _wake(self, n: int) -> None:
+        """调用方需持有锁：唤醒最多 n 个等待者，让它们重新尝试获取"""
+        self._cond.notify(n)
+        for _ in range(n):
+            while self._async_waiters:
+                fut = self._async_waiters.popleft()
+                if not fut.done():
+                    fut.get_loop().call_soon_threadsafe(self._resolve, fut)
+                    break
+
+    def _resolve(self, fut: asyncio.Future) -> None:
+        if fut.done():
+            # 等待者已被取消：把这次唤醒交给下一个
+            with self._lock:
+                self._wake(1)
+        else:
+            fut.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"limit": self.limit, "in_flight": self._in_flight,
+                    "baseline_latency": round(self._baseline, 4) if self._baseline is not None else None,
+                    "blocked_for": round(max(0.0, self._blocked_until - time.monotonic()), 3), **self._counts}
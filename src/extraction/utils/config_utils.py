@@ -65,6 +65,44 @@ class BaseConfig:
         default=5,
         metadata={"help": "Max number of retry attempts for an asynchronous API calling."}
     )
+    ## LLM specific attributes -> Response cache
+    llm_cache_memory_entries: int = field(
+        default=4096,
+        metadata={"help": "Max number of responses kept in the in-memory LRU tier in front of the SQLite cache, 0 disables it."}
+    )
+    llm_cache_memory_mb: Union[None, float] = field(
+        default=64,
+        metadata={"help": "Max total size (MB) of the in-memory LRU tier, None for no size bound."}
+    )
+    llm_cache_max_mb: Union[None, float] = field(
+        default=None,
+        metadata={"help": "Max size (MB) of the SQLite response cache, least recently used rows are evicted beyond it. None for no bound."}
+    )
+    llm_cache_ttl_hours: Union[None, float] = field(
+        default=None,
+        metadata={"help": "Hours after which a cached response expires. None means cached responses never expire."}
+    )
+    llm_cache_compress: bool = field(
+        default=True,
+        metadata={"help": "Store cached responses compressed with a dictionary trained on the cache's own rows (zstd if installed, else zlib)."}
+    )
+    llm_cache_namespace: Optional[str] = field(
+        default=None,
+        metadata={"help": "Namespace cached responses are tagged with and keyed on. If none, uses '<llm_name>@<prompt templates fingerprint>'."}
+    )
+    ## LLM specific attributes -> Record/replay
+    llm_cassette_mode: Literal["off", "record", "replay"] = field(
+        default="off",
+        metadata={"help": "'record' saves every LLM request/response with its latency to llm_cassette_path, 'replay' serves them back without calling the model. The response cache is bypassed while a cassette is active."}
+    )
+    llm_cassette_path: Optional[str] = field(
+        default=None,
+        metadata={"help": "Cassette (JSONL) file used by llm_cassette_mode."}
+    )
+    llm_cassette_replay_latency: bool = field(
+        default=False,
+        metadata={"help": "If set to True, replayed responses wait for their recorded latency instead of returning instantly."}
+    )
     # Storage specific attributes
     force_openie_from_scratch: bool = field(
         default=False,
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：对冲请求（hedged requests），压低 LLM 调用的长尾延迟。
+- 请求耗时超过近期延迟的第 percentile 分位数仍未返回时，再发一份相同请求（由路由器挑选副本，
+  原请求所在副本在途数更高，通常会落到另一个副本），先返回的结果生效，另一份被取消（异步）或丢弃（同步）；
+- 额外负载受预算约束：每个请求积累 max_extra 份对冲额度，对冲一次消耗 1 份，即对冲请求数不超过原请求数的 max_extra；
+- 延迟分布按请求类别（如 max_tokens 不同的 1-token logprob 验证与完整抽取）分别统计，样本不足 min_samples 时不对冲。
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+
+class _LatencyWindow:
+    """最近 size 个延迟样本；分位数每新增 refresh 个样本重算一次"""
+
+    def __init__(self, size: int = 1000, refresh: int = 50) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.refresh = refresh
+        self._since = 0
+        self._cache: Dict[float, float] = {}
+
+    def add(self, latency: float) -> None:
+        self.samples.append(latency)
+        self._since += 1
+        if self._since >= self.refresh:
+            self._since = 0
+            self._cache.clear()
+
+    def percentile(self, q: float) -> float:
+        value = self._cache.get(q)
+        if value is None:
+            ordered = sorted(self.samples)
+            value = ordered[min(len(ordered) - 1, int(len(ordered) * q / 100.0))]
+            self._cache[q] = value
+        return value
+
+
+class Hedger:
+    def __init__(self, percentile: float = 95.0, max_extra: float = 0.05, min_samples: int = 20,
+                 min_delay: float = 0.0, max_workers: int = 256) -> None:
+        self.percentile = float(percentile)
+        self.max_extra = float(max_extra)
+        self.min_samples = int(min_samples)
+        self.min_delay = float(min_delay)
+        self.max_workers = int(max_workers)
+        self._lock = threading.Lock()
+        self._windows: Dict[Hashable, _LatencyWindow] = {}
+        self._budget = 0.0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.counts = {"requests": 0, "hedged": 0, "hedge_won": 0, "skipped_budget": 0}
+
+    # ---------------------------- 延迟统计与预算 ----------------------------
+    def _delay(self, kind: Hashable) -> Optional[float]:
+        """本次请求的对冲等待时间；样本不足时返回 None（不对冲）"""
+        with self._lock:
+            self.counts["requests"] += 1
+            # 预算上限：避免长时间无需对冲后积累的额度在一次抖动中集中爆发
+            self._budget = min(self._budget + self.max_extra, max(1.0, 100 * self.max_extra))
+            window = self._windows.get(kind)
+            if window is None or len(window.samples) < self.min_samples:
+                return None
+            return max(window.percentile(self.percentile), self.min_delay)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            if self._budget >= 1.0:
+                self._budget -= 1.0
+                self.counts["hedged"] += 1
+                return True
+            self.counts["skipped_budget"] += 1
+            return False
+
+    def _record(self, kind: Hashable, latency: float, hedge_won: bool = False) -> None:
+        with self._lock:
+            self._windows.setdefault(kind, _LatencyWindow()).add(latency)
+            if hedge_won:
+                self.counts["hedge_won"] += 1
+
+    # ---------------------------- 异步 ----------------------------
+    async def arun(self, call: Callable[[], Awaitable[Any]], kind: Hashable = None) -> Any:
+        delay = self._delay(kind)
+        start = time.monotonic()
+        primary = asyncio.ensure_future(call())
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done and self._take_budget():
+                    return await self._arace(primary, asyncio.ensure_future(call()), kind, start)
+            result = await primary
+            self._record(kind, time.monotonic() - start)
+            return result
+        finally:
+            # 调用方被取消或对冲请求胜出时，不再等待原请求
+            if not primary.done():
+                primary.cancel()
+
+    async def _arace(self, primary: "asyncio.Future[Any]", hedge: "asyncio.Future[Any]", kind: Hashable, start: float) -> Any:
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self._record(kind, time.monotonic() - start, hedge_won=task is hedge)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    # ---------------------------- 同步 ----------------------------
+    def run(self, call: Callable[[], Any], kind: Hashable = None) -> Any:
+        delay = self._delay(kind)
+        start = time.monotonic()
+        if delay is None:
+            result = call()
+            self._record(kind, time.monotonic() - start)
+            return result
+        # 同步请求无法中途取消：原请求放到线程池，超时后再提交一份，先完成者生效，另一份跑完后丢弃
+        # 每份请求在调用方上下文的副本中执行，埋点标签等 contextvars 随之进入工作线程
+        primary = self._pool().submit(contextvars.copy_context().run, call)
+        done, _ = wait({primary}, timeout=delay)
+        if done or not self._take_budget():
+            result = primary.result()
+            self._record(kind, time.monotonic() - start)
+            return result
+        hedge = self._pool().submit(contextvars.copy_context().run, call)
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    self._record(kind, time.monotonic() - start, hedge_won=fut is hedge)
+                    return fut.result()
+                error = error or fut.exception()
+        raise error
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="llm-hedge")
+            return self._executor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counts)
+            stats["thresholds"] = {str(kind): round(w.percentile(self.percentile), 4)
+                                   for kind, w in self._windows.items() if len(w.samples) >= self.min_samples}
+            return stats
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：HTTP 连接池工具。为 client.py 中的 LLM 客户端提供按 endpoint 共享的 keep-alive 连接池。
+- 同一个 base_url 的所有客户端实例共用一组连接（HTTP/1.1 keep-alive；安装 h2 且服务端支持时走 HTTP/2 多路复用）；
+- 异步路径用 Semaphore 限制每个 endpoint 的在途请求数，超出的请求在本地排队，而不是继续开新连接；
+- 开启 adaptive 后改由 AIMDLimiter 同时限制同步与异步路径，上限在 [min, max_in_flight] 之间随服务端负载自动调整；
+- 传入 on_line 时按流式读取响应，on_line 对某一行返回 True 即停止读取并关闭连接；on_end 在读取结束后调用，
+  可抛出异常把“状态码 200 但流本身出错 / 不完整”的响应计为失败（自适应上限不把它当作成功）。
+"""
+
+import asyncio
+import importlib.util
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from .concurrency_utils import AIMDLimiter
+from .logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+# httpx 的 HTTP/2 依赖可选包 h2；未安装时自动退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class EndpointPool:
+    """
+    单个 endpoint 的共享连接池：
+    - 同步：httpx.Client（线程安全）；
+    - 异步：httpx.AsyncClient + Semaphore，按事件循环惰性创建（asyncio 对象不能跨事件循环复用）；
+    - adaptive 非空时两条路径都经过同一个 AIMDLimiter（跨线程、跨事件循环共享），Semaphore 不再使用。
+    adaptive 的键：initial（初始上限）、min（下限）、backoff（过载时的缩减系数）、latency_tolerance（延迟超过基线多少倍不再加并发）。
+    """
+
+    def __init__(self, base_url: str, max_connections: int = 64, max_keepalive: int = 32,
+                 max_in_flight: int = 256, http2: bool = True, timeout: float = 60,
+                 adaptive: Optional[Dict[str, Any]] = None):
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = int(max_in_flight)
+        self.http2 = bool(http2) and HTTP2_AVAILABLE
+        self.limiter: Optional[AIMDLimiter] = None
+        if adaptive:
+            self.limiter = AIMDLimiter(initial=int(adaptive.get("initial", 8)), min_limit=int(adaptive.get("min", 1)),
+                                       max_limit=self.max_in_flight, backoff=float(adaptive.get("backoff", 0.5)),
+                                       latency_tolerance=float(adaptive.get("latency_tolerance", 2.0)),
+                                       name=self.base_url)
+        self._limits = httpx.Limits(max_connections=int(max_connections),
+                                    max_keepalive_connections=int(max_keepalive))
+        # pool=None：等待空闲连接不计入超时，排队长度已由 max_in_flight 约束
+        self._timeout = httpx.Timeout(float(timeout), pool=None)
+
+        self._lock = threading.Lock()
+        self._sync_client: Optional[httpx.Client] = None
+        self._loop_state: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+    # ---------------------------- 同步 ----------------------------
+    def sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync_client is None:
+                self._sync_client = httpx.Client(limits=self._limits, timeout=self._timeout, http2=self.http2)
+            return self._sync_client
+
+    def _send(self, url: str, on_line: Optional[Callable[[str], bool]], on_end: Optional[Callable[[], None]],
+              kwargs: Dict[str, Any]) -> httpx.Response:
+        client = self.sync_client()
+        if on_line is None:
+            return client.post(url, **kwargs)
+        with client.stream("POST", url, **kwargs) as r:
+            if r.status_code != 200:
+                r.read()
+                return r
+            for line in r.iter_lines():
+                if on_line(line):
+                    break
+            if on_end is not None:
+                on_end()
+        return r
+
+    def post(self, url: str, on_line: Optional[Callable[[str], bool]] = None,
+             on_end: Optional[Callable[[], None]] = None, **kwargs: Any) -> httpx.Response:
+        if self.limiter is None:
+            return self._send(url, on_line, on_end, kwargs)
+        self.limiter.acquire()
+        start = time.monotonic()
+        try:
+            r = self._send(url, on_line, on_end, kwargs)
+        except httpx.TimeoutException:
+            self.limiter.release(time.monotonic() - start, timeout=True)
+            raise
+        except BaseException:
+            self.limiter.release(time.monotonic() - start)
+            raise
+        self.limiter.release(time.monotonic() - start, status=r.status_code, retry_after=r.headers.get("Retry-After"))
+        return r
+
+    # ---------------------------- 异步 ----------------------------
+    def _async_state(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loop_state.get(loop)
+            if state is None:
+                client = httpx.AsyncClient(limits=self._limits, timeout=self._timeout, http2=self.http2)
+                state = (client, asyncio.Semaphore(self.max_in_flight))
+                self._loop_state[loop] = state
+            return state
+
+    @staticmethod
+    async def _asend(client: httpx.AsyncClient, url: str, on_line: Optional[Callable[[str], bool]],
+                     on_end: Optional[Callable[[], None]], kwargs: Dict[str, Any]) -> httpx.Response:
+        if on_line is None:
+            return await client.post(url, **kwargs)
+        async with client.stream("POST", url, **kwargs) as r:
+            if r.status_code != 200:
+                await r.aread()
+                return r
+            async for line in r.aiter_lines():
+                if on_line(line):
+                    break
+            if on_end is not None:
+                on_end()
+        return r
+
+    async def apost(self, url: str, on_line: Optional[Callable[[str], bool]] = None,
+                    on_end: Optional[Callable[[], None]] = None, **kwargs: Any) -> httpx.Response:
+        client, sem = self._async_state()
+        if self.limiter is None:
+            async with sem:
+                return await self._asend(client, url, on_line, on_end, kwargs)
+        await self.limiter.aacquire()
+        start = time.monotonic()
+        try:
+            r = await self._asend(client, url, on_line, on_end, kwargs)
+        except httpx.TimeoutException:
+            self.limiter.release(time.monotonic() - start, timeout=True)
+            raise
+        except BaseException:
+            self.limiter.release(time.monotonic() - start)
+            raise
+        self.limiter.release(time.monotonic() - start, status=r.status_code, retry_after=r.headers.get("Retry-After"))
+        return r
+
+    # ---------------------------- 关闭 ----------------------------
+    def close(self) -> None:
+        with self._lock:
+            if self._sync_client is not None:
+                self._sync_client.close()
+                self._sync_client = None
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的异步连接（asyncio.run 结束前调用，避免连接泄漏告警）"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._loop_state.pop(loop, None)
+        if state is not None:
+            await state[0].aclose()
+
+
+_POOLS: Dict[str, EndpointPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_endpoint_pool(base_url: str, **kwargs: Any) -> EndpointPool:
+    """
+    获取（或创建）base_url 对应的共享连接池。
+    同一 base_url 只在第一次创建时使用 kwargs 中的参数。
+    """
+    key = base_url.rstrip("/")
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = EndpointPool(key, **kwargs)
+            _POOLS[key] = pool
+            logger.debug(f"Created endpoint pool for {key} (http2={pool.http2}, max_in_flight={pool.max_in_flight})")
+        return pool
+
+
+async def aclose_all_pools() -> None:
+    """关闭所有连接池在当前事件循环上的异步客户端"""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        await pool.aclose()
+
+
+def pool_stats() -> Dict[str, Dict[str, Any]]:
+    """各 endpoint 自适应并发的当前状态（未开启 adaptive 的 endpoint 不列出）"""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return {pool.base_url: pool.limiter.stats() for pool in pools if pool.limiter is not None}
+
+
+def close_all_pools() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：LLM 调用的统一埋点。
+- 按 backend（客户端类名）、stage（extract / verify / ner / triples / openie 等）、template（prompt 模板或模式）分别统计
+  调用次数、缓存命中、token 用量、重试与解析失败；调用延迟记入对数分桶直方图（HDR 风格，相对误差约 1%），可求任意分位数；
+- stage / template 由调用方用 metric_labels() 声明，经 contextvars 传给下层（异步任务自动继承，线程池需显式传递）；
+- 运行中按 interval_s 周期性、结束时再写一次 <dir>/metrics.json（机器可读快照）与 <dir>/metrics.prom（Prometheus 文本格式）。
+"""
+
+import contextlib
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+LABEL_NAMES = ("backend", "stage", "template")
+_LABELS: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("llm_metric_labels", default={})
+
+
+@contextlib.contextmanager
+def metric_labels(**labels: Any) -> Iterator[None]:
+    """在当前上下文中声明（覆盖）埋点标签，如 with metric_labels(stage="ner", template="ner"): ..."""
+    merged = dict(_LABELS.get())
+    merged.update({k: str(v) for k, v in labels.items() if v is not None})
+    token = _LABELS.set(merged)
+    try:
+        yield
+    finally:
+        _LABELS.reset(token)
+
+
+def current_labels() -> Dict[str, str]:
+    return dict(_LABELS.get())
+
+
+class LatencyHistogram:
+    """
+    对数分桶直方图：桶边界按 (1 + precision) 等比增长，任意分位数的相对误差不超过 precision；
+    只保存非空桶，合并与导出都很便宜。单位为秒，下限 1 微秒。
+    """
+
+    MIN_VALUE = 1e-6
+
+    def __init__(self, precision: float = 0.01) -> None:
+        self.precision = precision
+        self._log_base = math.log1p(precision)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        value = max(float(value), self.MIN_VALUE)
+        idx = int(math.ceil(math.log(value / self.MIN_VALUE) / self._log_base))
+        self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _upper(self, idx: int) -> float:
+        return self.MIN_VALUE * math.exp(idx * self._log_base)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(self.count * q / 100.0)))
+        seen = 0
+        for idx in sorted(self.buckets):
+            seen += self.buckets[idx]
+            if seen >= rank:
+                return min(self._upper(idx), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"count": self.count, "sum": round(self.total, 6)}
+        if self.count:
+            out.update({"min": round(self.min, 6), "max": round(self.max, 6), "mean": round(self.total / self.count, 6)})
+            out.update({f"p{q:g}": round(self.percentile(q), 6) for q in (50, 90, 95, 99, 99.9)})
+        return out
+
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class MetricsRegistry:
+    COUNTER_HELP = {
+        "llm_calls_total": "LLM calls by cache outcome (hit / miss / shared) and status (ok / error)",
+        "llm_prompt_tokens_total": "Prompt tokens sent to the model (cache hits excluded)",
+        "llm_completion_tokens_total": "Completion tokens generated by the model (cache hits excluded)",
+        "llm_retries_total": "Retried attempts by reason (HTTP status or exception type)",
+        "llm_parse_failures_total": "Items whose final answer could not be parsed into the expected structure",
+        "llm_batch_fallbacks_total": "Batch-verify candidates the batch answer left undecided, re-asked one by one",
+    }
+    HISTOGRAM_HELP = {
+        "llm_call_latency_seconds": "End-to-end latency of one LLM call, including cache lookup and retries",
+        "llm_batch_latency_seconds": "Latency of one offline batch generation",
+    }
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: Dict[Key, float] = {}
+        self.histograms: Dict[Key, LatencyHistogram] = {}
+        self.started = time.time()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.out_dir: Optional[str] = None
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, str]) -> Key:
+        merged = {k: "" for k in LABEL_NAMES}
+        merged.update(current_labels())
+        merged.update({k: str(v) for k, v in labels.items() if v is not None})
+        return name, tuple(sorted(merged.items()))
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        if not value:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = LatencyHistogram()
+            hist.record(value)
+
+    # ---------------------------- 常用埋点 ----------------------------
+    def record_call(self, backend: str, latency: float, cache: str = "miss", ok: bool = True,
+                    prompt_tokens: int = 0, completion_tokens: int = 0, **labels: Any) -> None:
+        """一次完整调用：cache 为 hit（响应缓存）/ miss（发往模型）/ shared（合并到在途的相同请求）"""
+        self.inc("llm_calls_total", backend=backend, cache=cache, status="ok" if ok else "error", **labels)
+        self.observe("llm_call_latency_seconds", latency, backend=backend, cache=cache, **labels)
+        self.inc("llm_prompt_tokens_total", prompt_tokens, backend=backend, **labels)
+        self.inc("llm_completion_tokens_total", completion_tokens, backend=backend, **labels)
+
+    def record_retry(self, backend: str, reason: Any, **labels: Any) -> None:
+        self.inc("llm_retries_total", backend=backend, reason=reason, **labels)
+
+    def record_parse_failure(self, count: int = 1, **labels: Any) -> None:
+        self.inc("llm_parse_failures_total", count, **labels)
+
+    # ---------------------------- 导出 ----------------------------
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), **hist.to_dict()}
+                          for (name, labels), hist in sorted(self.histograms.items())]
+        return {"started": self.started, "updated": time.time(), "counters": counters, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式：计数器为 counter，延迟直方图以 summary（分位数 + _sum / _count）导出"""
+        snap = self.snapshot()
+        lines: List[str] = []
+        declared = set()
+
+        def fmt(labels: Dict[str, str]) -> str:
+            parts = [f'{k}="{_escape(v)}"' for k, v in labels.items() if v != ""]
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for c in snap["counters"]:
+            if c["name"] not in declared:
+                declared.add(c["name"])
+                lines.append(f"# HELP {c['name']} {self.COUNTER_HELP.get(c['name'], c['name'])}")
+                lines.append(f"# TYPE {c['name']} counter")
+            lines.append(f"{c['name']}{fmt(c['labels'])} {c['value']:g}")
+        for h in snap["histograms"]:
+            if h["name"] not in declared:
+                declared.add(h["name"])
+                lines.append(f"# HELP {h['name']} {self.HISTOGRAM_HELP.get(h['name'], h['name'])}")
+                lines.append(f"# TYPE {h['name']} summary")
+            for q in (50, 90, 95, 99, 99.9):
+                if f"p{q:g}" in h:
+                    lines.append(f"{h['name']}{fmt(dict(h['labels'], quantile=f'{q / 100:g}'))} {h[f'p{q:g}']:g}")
+            lines.append(f"{h['name']}_sum{fmt(h['labels'])} {h['sum']:g}")
+            lines.append(f"{h['name']}_count{fmt(h['labels'])} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, out_dir: Optional[str] = None) -> Optional[str]:
+        """写出 metrics.json 与 metrics.prom（先写临时文件再替换，读取方不会看到半个文件）；返回 json 路径"""
+        out_dir = out_dir or self.out_dir
+        if not out_dir:
+            return None
+        os.makedirs(out_dir, exist_ok=True)
+        json_path = os.path.join(out_dir, "metrics.json")
+        for path, text in ((json_path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2)),
+                           (os.path.join(out_dir, "metrics.prom"), self.to_prometheus())):
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+        return json_path
+
+    def start_flush(self, out_dir: str, interval: float = 30.0) -> None:
+        """后台线程每 interval 秒写一次；重复调用只更新输出目录"""
+        self.out_dir = out_dir
+        if self._flusher is not None or interval <= 0:
+            return
+        self._stop.clear()
+
+        def _loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.write()
+                except OSError as e:
+                    logger.warning(f"Failed to flush metrics to {self.out_dir}: {e}")
+
+        self._flusher = threading.Thread(target=_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def close(self) -> Optional[str]:
+        """停止周期写出并写最后一次"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        return self.write()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_METRICS = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """进程内共享的埋点注册表"""
+    return _METRICS
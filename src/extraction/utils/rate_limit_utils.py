@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：按服务商配额（RPM / TPM）限速，避免撞上 429 后陷入盲目重试。
+- 令牌桶：补充速率为 headroom × 配额 / 60 秒，桶容量为 (1 - headroom) × 配额，
+  因此任意 60 秒窗口内放行的量都不超过配额；单个请求超过桶容量时，桶满即可放行（之后欠账慢慢补回）；
+- 预约式放行：获取时立即扣除（余额可为负），调用方按算出的等待时间睡眠，先到先得，无需轮询；
+- 发送前按 prompt 长度 + max_tokens 估算 token 数，响应返回后用 usage 的实际用量多退少补，
+  并用实际 prompt token 数持续校准估算系数。
+"""
+
+import asyncio
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# 汉字约 1 token/字，其余文本约 4 字符/token；每条消息另计少量格式开销
+_CJK_RE = re.compile(r"[一-鿿]")
+_MESSAGE_OVERHEAD = 4
+
+
+def estimate_prompt_tokens(messages: Any) -> int:
+    total = 0
+    for m in messages or []:
+        text = str(m.get("content", "")) if isinstance(m, dict) else str(m)
+        cjk = len(_CJK_RE.findall(text))
+        total += cjk + (len(text) - cjk + 3) // 4 + _MESSAGE_OVERHEAD
+    return total
+
+
+class _Bucket:
+    def __init__(self, per_minute: float, headroom: float) -> None:
+        self.rate = headroom * per_minute / 60.0
+        self.capacity = max(1.0, (1.0 - headroom) * per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float, now: float) -> float:
+        """扣除 cost 并返回需要等待的秒数"""
+        self._refill(now)
+        need = min(cost, self.capacity)
+        wait = max(0.0, (need - self.level) / self.rate)
+        self.level -= cost
+        return wait
+
+    def adjust(self, delta: float, now: float) -> None:
+        self._refill(now)
+        self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """
+    一个账号 / 部署的 RPM 与 TPM 限速器（二者可只配其一）。线程与事件循环之间共享。
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None, headroom: float = 0.9) -> None:
+        if not 0 < headroom < 1:
+            raise ValueError(f"headroom 必须在 (0, 1) 之间: {headroom}")
+        self.rpm = _Bucket(float(rpm), headroom) if rpm else None
+        self.tpm = _Bucket(float(tpm), headroom) if tpm else None
+        self._lock = threading.Lock()
+        # 实际 prompt token / 估算值，用返回的 usage 持续校准
+        self._ratio = 1.0
+        self.counts = {"requests": 0, "waited_s": 0.0, "estimated_tokens": 0, "actual_tokens": 0}
+
+    def _reserve(self, payload: Dict[str, Any], max_tokens: int) -> Tuple[Tuple[int, int], float]:
+        raw = estimate_prompt_tokens(payload.get("messages"))
+        now = time.monotonic()
+        with self._lock:
+            prompt = int(raw * self._ratio) + 1
+            cost = prompt + int(max_tokens)
+            wait = 0.0
+            if self.rpm is not None:
+                wait = self.rpm.reserve(1, now)
+            if self.tpm is not None:
+                wait = max(wait, self.tpm.reserve(cost, now))
+            self.counts["requests"] += 1
+            self.counts["waited_s"] += wait
+            self.counts["estimated_tokens"] += cost
+        return (raw, cost), wait
+
+    def acquire(self, payload: Dict[str, Any], max_tokens: int) -> Tuple[int, int]:
+        """按估算用量预约配额并阻塞到可以发送；返回的凭据交给 settle()"""
+        ticket, wait = self._reserve(payload, max_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return ticket
+
+    async def aacquire(self, payload: Dict[str, Any], max_tokens: int) -> Tuple[int, int]:
+        ticket, wait = self._reserve(payload, max_tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return ticket
+
+    def settle(self, ticket: Tuple[int, int], prompt_tokens: Optional[int], total_tokens: Optional[int]) -> None:
+        """用响应里的实际用量修正预约（没有 usage 时保持估算值）"""
+        raw, cost = ticket
+        with self._lock:
+            if prompt_tokens and raw > 0:
+                self._ratio = 0.9 * self._ratio + 0.1 * (prompt_tokens / raw)
+            if total_tokens is None:
+                self.counts["actual_tokens"] += cost
+                return
+            self.counts["actual_tokens"] += total_tokens
+            if self.tpm is not None:
+                self.tpm.adjust(cost - total_tokens, time.monotonic())
+
+    def penalize(self) -> None:
+        """服务端仍返回 429：清空余额，后续请求至少等一个补充周期"""
+        now = time.monotonic()
+        with self._lock:
+            for bucket in (self.rpm, self.tpm):
+                if bucket is not None:
+                    bucket.adjust(-bucket.capacity, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counts, "waited_s": round(self.counts["waited_s"], 2), "prompt_ratio": round(self._ratio, 3)}
+
+
+_LIMITERS: Dict[str, RateLimiter] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(key: str, **kwargs: Any) -> RateLimiter:
+    """同一配额（如同一服务商账号 + 模型）的客户端共享一个限速器，只在第一次创建时使用 kwargs"""
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(key)
+        if limiter is None:
+            limiter = RateLimiter(**kwargs)
+            _LIMITERS[key] = limiter
+        return limiter
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：多个 LLM 副本（vLLM / Ollama）之间的负载均衡。
+- 最少在途请求路由：每次请求发往当前在途数最少的健康副本，在途数相同时轮转；
+- 被动健康检查：连续 eject_after 次失败（连接错误、超时或 5xx）的副本被摘除 cooldown 秒，
+  到期后进入半开状态：只放行一个试探请求，成功即恢复、失败则再摘除 cooldown 秒，试探返回前不分配其他请求；
+  摘除前已发出、之后才返回的请求不再影响该副本的健康状态（只计入统计）；
+  全部副本都不可用时选最早到期的一个，避免整体停摆；
+- 同一组 endpoint 的路由器在进程内共享，抽取与验证的请求一起参与均衡，并按副本汇总统计。
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .logging_utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class EndpointState:
+    """单个副本的路由状态与统计（字段由 EndpointRouter 在锁内更新）"""
+
+    def __init__(self, base_url: str) -> None:
+        self.base_url = base_url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        # 非 0 表示被摘除：到期前不分配请求，到期后（半开）只放行一个试探请求，成功后清零
+        self.ejected_until = 0.0
+        self.ejected_at = 0.0
+        self.probing = False
+        self.latency_total = 0.0
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        done = self.requests - self.outstanding
+        return {"base_url": self.base_url, "requests": self.requests, "failures": self.failures,
+                "outstanding": self.outstanding, "ejections": self.ejections,
+                "ejected_for": round(max(0.0, self.ejected_until - now), 1),
+                "avg_latency": round(self.latency_total / done, 4) if done > 0 else None}
+
+
+class EndpointLease:
+    """acquire() 的返回值：一次请求占用的副本，release() 据此判断它是否为试探请求、是否早于摘除发出"""
+
+    __slots__ = ("endpoint", "started", "probe")
+
+    def __init__(self, endpoint: EndpointState, started: float, probe: bool) -> None:
+        self.endpoint = endpoint
+        self.started = started
+        self.probe = probe
+
+    @property
+    def base_url(self) -> str:
+        return self.endpoint.base_url
+
+
+class EndpointRouter:
+    def __init__(self, base_urls: Sequence[str], eject_after: int = 3, cooldown: float = 30.0) -> None:
+        if not base_urls:
+            raise ValueError("至少需要一个 endpoint")
+        self.endpoints = [EndpointState(url.rstrip("/")) for url in base_urls]
+        self.eject_after = max(1, int(eject_after))
+        self.cooldown = float(cooldown)
+        self._lock = threading.Lock()
+        self._rr = 0
+
+    def acquire(self) -> EndpointLease:
+        """选出本次请求的副本并计入在途；请求结束后必须调用 release()"""
+        now = time.monotonic()
+        with self._lock:
+            n = len(self.endpoints)
+            self._rr = (self._rr + 1) % n
+            rotated = self.endpoints[self._rr:] + self.endpoints[:self._rr]
+            # 冷却到期、还没有试探请求在途的副本先放行一个试探请求
+            probe = next((ep for ep in rotated if 0.0 < ep.ejected_until <= now and not ep.probing), None)
+            healthy = [ep for ep in rotated if ep.ejected_until == 0.0]
+            if probe is not None:
+                ep = probe
+                ep.probing = True
+            elif healthy:
+                ep = min(healthy, key=lambda e: e.outstanding)
+            else:
+                ep = min(rotated, key=lambda e: e.ejected_until)
+            ep.outstanding += 1
+            ep.requests += 1
+            return EndpointLease(ep, now, probe is not None)
+
+    def release(self, lease: EndpointLease, latency: float, ok: Optional[bool]) -> None:
+        """
+        ok=None 表示结果未知（如被对冲请求取代而取消），不影响副本健康状态；若它是试探请求，之后可再发一个。
+        被摘除期间只有试探请求（以及全部副本不可用时、摘除之后发出的请求）的结果决定副本是否恢复。
+        """
+        now = time.monotonic()
+        ep = lease.endpoint
+        with self._lock:
+            ep.outstanding -= 1
+            ep.latency_total += latency
+            if ok is False:
+                ep.failures += 1
+            if lease.probe:
+                ep.probing = False
+                if ok:
+                    self._restore(ep)
+                elif ok is False:
+                    self._eject(ep, now, "probe failed")
+                return
+            if ok is None:
+                return
+            if ep.ejected_until:
+                # 摘除前发出的慢请求只反映摘除之前的状态
+                if ok and lease.started >= ep.ejected_at:
+                    self._restore(ep)
+                return
+            if ok:
+                ep.consecutive_failures = 0
+                return
+            ep.consecutive_failures += 1
+            if ep.consecutive_failures >= self.eject_after and len(self.endpoints) > 1:
+                self._eject(ep, now, f"{ep.consecutive_failures} consecutive failures")
+
+    def _eject(self, ep: EndpointState, now: float, reason: str) -> None:
+        ep.ejected_at = now
+        ep.ejected_until = now + self.cooldown
+        ep.ejections += 1
+        logger.warning(f"Ejected {ep.base_url} for {self.cooldown:g}s after {reason}")
+
+    @staticmethod
+    def _restore(ep: EndpointState) -> None:
+        ep.consecutive_failures = 0
+        ep.ejected_until = 0.0
+        ep.probing = False
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return [ep.snapshot(now) for ep in self.endpoints]
+
+
+_ROUTERS: Dict[Tuple[str, ...], EndpointRouter] = {}
+_ROUTERS_LOCK = threading.Lock()
+
+
+def get_router(base_urls: Sequence[str], **kwargs: Any) -> EndpointRouter:
+    """
+    获取（或创建）一组 endpoint 共享的路由器，只在第一次创建时使用 kwargs（eject_after / cooldown）。
+    """
+    key = tuple(url.rstrip("/") for url in base_urls)
+    with _ROUTERS_LOCK:
+        router = _ROUTERS.get(key)
+        if router is None:
+            router = EndpointRouter(key, **kwargs)
+            _ROUTERS[key] = router
+        return router
+
+
+def routing_stats() -> Dict[str, List[Dict[str, Any]]]:
+    """所有多副本路由器的按副本统计（单 endpoint 的路由器不列出）"""
+    with _ROUTERS_LOCK:
+        routers = list(_ROUTERS.items())
+    return {",".join(key): router.stats() for key, router in routers if len(key) > 1}
+
+
+def normalize_base_urls(base_url: Any) -> List[str]:
+    """llm.base_url 可以是单个地址、逗号分隔的字符串或列表"""
+    if isinstance(base_url, str):
+        urls = [u.strip() for u in base_url.split(",")]
+    else:
+        urls = [str(u).strip() for u in (base_url or [])]
+    urls = [u.rstrip("/") for u in urls if u]
+    if not urls:
+        raise ValueError("llm.base_url 为空")
+    return urls
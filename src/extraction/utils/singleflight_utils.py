@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：在途请求合并（single-flight）。
+- 同一个键同时只有一个请求真正发出（leader），其间到达的相同请求（follower）不再发送，等待并共享 leader 的结果或异常；
+- 同步（线程）与异步（任意事件循环）调用方可以互相合并：异步请求在独立任务中执行，某个调用方被取消只影响它自己的等待，
+  请求本身继续完成并交给其他等待者；
+- 请求完成后键即释放，之后的相同请求由响应缓存负责复用。
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+
+class _Flight:
+    """一次在途请求：结果就绪后唤醒所有线程与事件循环上的等待者"""
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._futures: List[asyncio.Future] = []
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.result, self.error = result, error
+            self.event.set()
+            futures, self._futures = self._futures, []
+        for fut in futures:
+            fut.get_loop().call_soon_threadsafe(_resolve, fut)
+
+    def wait(self) -> Any:
+        self.event.wait()
+        return self._outcome()
+
+    async def await_(self) -> Any:
+        with self._lock:
+            if not self.event.is_set():
+                fut = asyncio.get_running_loop().create_future()
+                self._futures.append(fut)
+            else:
+                fut = None
+        if fut is not None:
+            await fut
+        return self._outcome()
+
+    def _outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def _resolve(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        # 事件循环只弱引用任务，这里持有 leader 任务直到完成
+        self._tasks: Set["asyncio.Future[Any]"] = set()
+        self.counts = {"leaders": 0, "coalesced": 0}
+
+    def _join(self, key: Hashable):
+        """返回 (flight, 是否为 leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.counts["coalesced"] += 1
+                return flight, False
+            flight = self._flights[key] = _Flight()
+            self.counts["leaders"] += 1
+            return flight, True
+
+    def _done(self, key: Hashable, flight: _Flight, result: Any = None, error: Optional[BaseException] = None) -> None:
+        # 先摘除再唤醒：唤醒后到达的相同请求会发起新的一轮（通常直接命中缓存）
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key: Optional[Hashable], fn: Callable[[], Any]) -> Any:
+        """同步执行 fn()，键相同的并发调用只执行一次；key 为 None 时不合并"""
+        if key is None:
+            return fn()
+        flight, leader = self._join(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._done(key, flight, error=e)
+            raise
+        self._done(key, flight, result)
+        return result
+
+    async def ado(self, key: Optional[Hashable], fn: Callable[[], Awaitable[Any]]) -> Any:
+        """异步版本：leader 的请求在独立任务中执行，任一调用方被取消都不会中断其他调用方共享的请求"""
+        if key is None:
+            return await fn()
+        flight, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._tasks.add(task)
+
+            def _on_done(t: "asyncio.Future[Any]") -> None:
+                self._tasks.discard(t)
+                if t.cancelled():
+                    self._done(key, flight, error=asyncio.CancelledError())
+                elif t.exception() is not None:
+                    self._done(key, flight, error=t.exception())
+                else:
+                    self._done(key, flight, t.result())
+
+            task.add_done_callback(_on_done)
+        return await flight.await_()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self.counts, "in_flight": len(self._flights)}
+
+
+_GROUPS: Dict[str, SingleFlight] = {}
+_GROUPS_LOCK = threading.Lock()
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """按名称共享的合并组：同一进程内的抽取器与验证器共用，重复请求跨实例合并"""
+    with _GROUPS_LOCK:
+        group = _GROUPS.get(name)
+        if group is None:
+            group = _GROUPS[name] = SingleFlight()
+        return group
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：流式补全的增量解析与提前结束。
+- OpenAI 兼容接口按 SSE（data: {...}，以 data: [DONE] 结束）返回增量，Ollama 按 NDJSON（最后一行 done=true）返回；
+- JSON 模式下逐段扫描输出，第一个顶层 JSON 对象闭合（如 {"answer": ...} 的最后一个 "}"）即停止读取并关闭连接，
+  服务端随之中止生成，省去模型在答案之后继续输出空白或多余内容的解码时间；
+- 读完（或提前结束）后拼装成与非流式接口相同结构的响应，缓存、cassette 与下游解析无需区分两种模式；
+- 流中返回 {"error": ...} 事件，或既没读到结束标记也没有提前结束（连接中途断开）时 check() 抛出 StreamError，
+  由调用方的重试逻辑处理，残缺的响应不会被当作成功结果缓存。
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+
+class StreamError(RuntimeError):
+    """流式响应出错或不完整"""
+
+
+class JsonObjectScanner:
+    """增量扫描文本，跟踪字符串与括号嵌套，第一个顶层 JSON 对象 / 数组闭合时返回 True"""
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, text: str) -> bool:
+        if self.complete:
+            return True
+        for ch in text:
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = self.started
+            elif ch in "{[":
+                self.started = True
+                self.depth += 1
+            elif ch in "}]" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+                    return True
+        return False
+
+
+class StreamReader:
+    """
+    逐行消费一次流式补全。kind 为 "openai"（SSE）或 "ollama"（NDJSON）；
+    stop_at_json 为 True 时第一个 JSON 对象完整后 feed_line() 返回 True，调用方据此关闭连接。
+    """
+
+    def __init__(self, kind: str, stop_at_json: bool = False) -> None:
+        if kind not in ("openai", "ollama"):
+            raise ValueError(f"未知的流式协议: {kind}")
+        self.kind = kind
+        self.scanner = JsonObjectScanner() if stop_at_json else None
+        self.parts: List[str] = []
+        self.chunks = 0
+        self.finished = False
+        self.stopped_early = False
+        self.error: Optional[Any] = None
+        self.meta: Dict[str, Any] = {}
+
+    def feed_line(self, line: str) -> bool:
+        """处理一行，返回 True 表示无需再读"""
+        line = line.strip()
+        if not line:
+            return False
+        if self.kind == "openai":
+            if not line.startswith("data:"):
+                return False
+            line = line[5:].strip()
+            if line == "[DONE]":
+                self.finished = True
+                return True
+        event = json.loads(line)
+        if event.get("error"):
+            # OpenAI 兼容服务与 Ollama 都以 {"error": ...} 报告生成中途的错误，之后不会再有有效内容
+            self.error = event["error"]
+            return True
+        if self.kind == "openai":
+            return self._on_openai(event)
+        return self._on_ollama(event)
+
+    def _on_openai(self, event: Dict[str, Any]) -> bool:
+        for key in ("id", "model", "created"):
+            if key in event:
+                self.meta.setdefault(key, event[key])
+        if event.get("usage"):
+            self.meta["usage"] = event["usage"]
+        for choice in event.get("choices") or []:
+            if choice.get("finish_reason"):
+                self.meta["finish_reason"] = choice["finish_reason"]
+            piece = (choice.get("delta") or {}).get("content")
+            if piece and self._append(piece):
+                return True
+        return False
+
+    def _on_ollama(self, event: Dict[str, Any]) -> bool:
+        self.meta.setdefault("model", event.get("model"))
+        piece = (event.get("message") or {}).get("content")
+        if piece and self._append(piece):
+            return True
+        if event.get("done"):
+            self.finished = True
+            for key in ("done_reason", "prompt_eval_count", "eval_count", "total_duration"):
+                if key in event:
+                    self.meta[key] = event[key]
+            return True
+        return False
+
+    def _append(self, piece: str) -> bool:
+        self.parts.append(piece)
+        self.chunks += 1
+        if self.scanner is not None and self.scanner.feed(piece):
+            self.stopped_early = True
+            return True
+        return False
+
+    def check(self) -> None:
+        """流中报告了错误，或未读到结束标记且未提前结束时抛出 StreamError"""
+        if self.error is not None:
+            message = self.error.get("message", self.error) if isinstance(self.error, dict) else self.error
+            raise StreamError(f"流式响应返回错误: {message}")
+        if not (self.finished or self.stopped_early):
+            raise StreamError(f"流式响应未正常结束（已收到 {self.chunks} 个增量）")
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def response(self) -> Dict[str, Any]:
+        """拼装成非流式接口的响应结构；提前结束时服务端不会再返回用量，生成 token 数按收到的增量数计"""
+        if self.kind == "ollama":
+            resp: Dict[str, Any] = {"model": self.meta.get("model"), "message": {"role": "assistant", "content": self.text},
+                                    "done": True, "done_reason": self.meta.get("done_reason", "stop")}
+            for key in ("prompt_eval_count", "total_duration"):
+                if key in self.meta:
+                    resp[key] = self.meta[key]
+            resp["eval_count"] = self.meta.get("eval_count", self.chunks)
+        else:
+            usage: Optional[Dict[str, Any]] = self.meta.get("usage")
+            resp = {"id": self.meta.get("id"), "object": "chat.completion", "created": self.meta.get("created"),
+                    "model": self.meta.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": self.text},
+                                 "finish_reason": self.meta.get("finish_reason", "stop")}],
+                    "usage": usage or {"completion_tokens": self.chunks}}
+        if self.stopped_early:
+            resp["stopped_early"] = True
+        return resp
@@ -12,6 +12,11 @@ from .data.dataset import load_json_dataset
 from .extraction.gptner_extractor import EntityExtractor
 from .eval.evaluate import evaluate_ner
 from .eval.self_verify import SelfVerifier
+from .pipeline import run_extract_verify_pipeline
+from .extraction.utils.routing_utils import routing_stats
+from .extraction.utils.metrics_utils import get_metrics
+from .utils.tracing import get_tracer, span
+from .utils.memprof import MemoryProfiler, format_report
 
 from .retrieval.inverted_retrieval import InvertedRetrieval
 
@@ -20,18 +25,70 @@ def parse_args(argv=None):
     p = argparse.ArgumentParser()
     p.add_argument("--config", default="configs/default.yaml")
     p.add_argument("--split", default="dev", choices=["dev", "test"])
+    p.add_argument("--extract_mode", default=None, choices=["per_type", "multi_type"],
+                   help="覆盖 cfg.extraction.mode：per_type 每个粗粒度类型一次调用，multi_type 每个样例一次调用")
+    p.add_argument("--pipeline", action="store_true",
+                   help="流水线模式：每个样例抽取完成后立即验证（等价于 cfg.runtime.pipeline=true）")
+    p.add_argument("--cassette_mode", default=None, choices=["off", "record", "replay"],
+                   help="覆盖 cfg.llm.cassette.mode：record 录制 LLM 请求/响应，replay 不访问后端、从录制文件回放")
+    p.add_argument("--cassette_path", default=None, help="覆盖 cfg.llm.cassette.path")
+    p.add_argument("--no_resume", action="store_true",
+                   help="不续跑：丢弃已有的 <输出>.jsonl 断点，从头运行（等价于 cfg.runtime.resume=false）")
+    p.add_argument("--trace", action="store_true",
+                   help="记录各阶段耗时并导出 Chrome trace JSON（等价于 cfg.runtime.trace.enable=true）")
+    p.add_argument("--memory_profile", action="store_true",
+                   help="按阶段记录峰值 RSS 与 tracemalloc 增长最多的分配位置（等价于 cfg.runtime.memory_profile.enable=true）")
     return p.parse_args(argv)
 
 
+def report_llm_stats(extractor, verifier):
+    """打印本次运行的响应缓存命中情况、在途合并、多副本路由、对冲请求与配额限速统计"""
+    if extractor.cache is not None:
+        print(f"[INFO] LLM 响应缓存：{extractor.cache.stats()}")
+    print(f"[INFO] LLM 在途请求合并：{extractor.flights.stats()}")
+    for name, llm in (("抽取", extractor), ("验证", verifier)):
+        hedger = getattr(llm.client, "hedger", None)
+        if hedger is not None:
+            print(f"[INFO] {name}对冲请求：{hedger.stats()}")
+        limiter = getattr(llm.client, "rate_limiter", None)
+        if limiter is not None:
+            print(f"[INFO] {name}配额限速：{limiter.stats()}")
+    for endpoints in routing_stats().values():
+        for ep in endpoints:
+            print(f"[INFO] LLM 副本 {ep['base_url']}：{ep['requests']} 次请求，失败 {ep['failures']}，"
+                  f"摘除 {ep['ejections']} 次，平均耗时 {ep['avg_latency']} s")
+
+
 def main(argv=None):
     args = parse_args(argv)
     cfg = load_yaml(args.config)
+    if args.extract_mode:
+        cfg["extraction"]["mode"] = args.extract_mode
+    if args.no_resume:
+        cfg["runtime"]["resume"] = False
+    if args.cassette_mode or args.cassette_path:
+        cassette_cfg = cfg["llm"].setdefault("cassette", {})
+        if args.cassette_mode:
+            cassette_cfg["mode"] = args.cassette_mode
+        if args.cassette_path:
+            cassette_cfg["path"] = args.cassette_path
 
     set_global_seed(cfg["project"]["seed"])
 
     out_dir = Path(cfg["paths"]["output_dir"])
     ensure_dir(out_dir)
 
+    trace_cfg = cfg["runtime"].get("trace") or {}
+    tracer = get_tracer()
+    if args.trace or trace_cfg.get("enable", False):
+        tracer.enable()
+    mem_cfg = cfg["runtime"].get("memory_profile") or {}
+    profiler = None
+    if args.memory_profile or mem_cfg.get("enable", False):
+        profiler = MemoryProfiler(top_n=int(mem_cfg.get("top_n", 10)), frames=int(mem_cfg.get("frames", 4)),
+                                  sample_interval=float(mem_cfg.get("sample_interval_s", 0.05)))
+        profiler.start()
+
     # 递归查找数据文件
     data_dir = Path(cfg["paths"]["data_dir"])
     train_path = iter_find_file(data_dir, "train2.json")
@@ -67,21 +124,57 @@ def main(argv=None):
         verify_path = Path(cfg["paths"]["test_self_verify_path"])
         print(f"[INFO] 检测到测试集文件：{data_path}")
 
-    dataset = load_json_dataset(data_path, max_examples=cfg["runtime"]["max_examples"])
+    with span("load_dataset", path=str(data_path)):
+        dataset = load_json_dataset(data_path, max_examples=cfg["runtime"]["max_examples"])
 
     # LLM 抽取
     extractor = EntityExtractor(cfg)
+    verifier = SelfVerifier(cfg)
 
     # outputs = []
 
-    result = extractor.extract_and_save_all(dataset, save_path)
+    metrics_cfg = cfg["runtime"].get("metrics") or {}
+    metrics = get_metrics() if metrics_cfg.get("enable", True) else None
+    if metrics is not None:
+        metrics.start_flush(metrics_cfg.get("dir") or str(out_dir / "metrics"), float(metrics_cfg.get("interval_s", 30)))
+    try:
+        run_extract_verify(args, cfg, extractor, verifier, dataset, save_path, verify_path)
+    finally:
+        if metrics is not None:
+            print("[INFO] LLM 调用埋点：", metrics.close())
+        if tracer.enabled:
+            trace_path = tracer.export(trace_cfg.get("path") or out_dir / "trace.json")
+            print(f"[INFO] 阶段耗时追踪（chrome://tracing 或 ui.perfetto.dev 打开）：{trace_path}")
+            for name, row in list(tracer.summary().items())[:8]:
+                print(f"[INFO]   {name}: {row['count']} 次，合计 {row['total_ms']} ms，最长 {row['max_ms']} ms")
+        if profiler is not None:
+            mem_path = mem_cfg.get("path") or out_dir / "memory_report.json"
+            print(f"[INFO] 分阶段内存报告：{mem_path}\n{format_report(profiler.stop(mem_path))}")
+
+
+def run_extract_verify(args, cfg, extractor, verifier, dataset, save_path, verify_path):
+    if args.pipeline or cfg["runtime"].get("pipeline", False):
+        # 抽取与验证流水线重叠执行，无需写出后再加载
+        with span("extract_verify_pipeline"):
+            result, verify_path = run_extract_verify_pipeline(extractor, verifier, dataset, save_path, verify_path)
+        print("[OK] 抽取完成。路径：", result)
+        print(f"[INFO] 抽取模式：{extractor.extract_mode}，LLM 用量：{extractor.usage}")
+        print("[OK] 验证完成。路径：", verify_path)
+        report_llm_stats(extractor, verifier)
+        return
+
+    with span("extract"):
+        result = extractor.extract_and_save_all(dataset, save_path)
     print("[OK] 抽取完成。路径：", result)
+    print(f"[INFO] 抽取模式：{extractor.extract_mode}，LLM 用量：{extractor.usage}")
 
     # LLM 验证
-    verifier = SelfVerifier(cfg)
-    dataset = load_json_dataset(result, max_examples=cfg["runtime"]["max_examples"])
-    verifier.verify_and_save_all(dataset, verify_path)
+    with span("load_dataset", path=str(result)):
+        dataset = load_json_dataset(result, max_examples=cfg["runtime"]["max_examples"])
+    with span("verify"):
+        verifier.verify_and_save_all(dataset, verify_path)
     print("[OK] 验证完成。路径：", verify_path)
+    report_llm_stats(extractor, verifier)
     # for ex in dataset:
     #     result = extractor.extract(ex)
     #     outputs.append(result)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：抽取 -> 自我验证的流水线运行模式。
+每个样例抽取完成后立即通过有界队列交给验证阶段，两个阶段共享同一个 LLM 并发额度，
+不再需要“写出预测文件 -> 重新加载 -> 验证”的往返；最终产出的两个 JSON 文件与分阶段运行一致。
+"""
+
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .extraction.gptner_extractor import EntityExtractor
+from .extraction.utils.http_utils import aclose_all_pools
+from .eval.self_verify import SelfVerifier
+from .utils.io_tools import JsonlCheckpoint, record_hash
+
+_DONE = object()  # 队列结束标记
+
+
+def run_extract_verify_pipeline(
+    extractor: EntityExtractor,
+    verifier: SelfVerifier,
+    ex_list: List[Dict[str, Any]],
+    pred_path: Path,
+    verify_path: Path,
+    concurrency: Optional[int] = None,
+    queue_size: Optional[int] = None,
+    resume: Optional[bool] = None,
+) -> Tuple[Path, Path]:
+    """
+    流水线执行抽取与验证，返回 (抽取结果路径, 验证结果路径)。
+    - concurrency：两个阶段合计的在途 LLM 请求上限（默认 cfg.runtime.concurrency）；
+    - queue_size：阶段间有界队列长度（默认 cfg.runtime.pipeline_queue_size，缺省为 2 * concurrency）；
+    - resume：续跑（默认 cfg.runtime.resume）。已抽取但未验证的样例直接进入验证队列；
+      两个阶段各自按运行指纹与输入摘要判断断点是否可用（见 JsonlCheckpoint）。
+    抽取失败的样例不会进入验证阶段，与分阶段运行时一致。
+    """
+    runtime = extractor.cfg.get("runtime", {})
+    if concurrency is None:
+        concurrency = int(runtime.get("concurrency", 1))
+    concurrency = max(1, concurrency)
+    if queue_size is None:
+        queue_size = int(runtime.get("pipeline_queue_size", 2 * concurrency))
+    if resume is None:
+        resume = bool(runtime.get("resume", True))
+
+    for idx, ex in enumerate(ex_list):
+        # 与 extract_and_save_all 相同：id 为空则按顺序生成
+        if not ex.get("id", ""):
+            ex["id"] = f"{idx}"
+
+    pred_ckpt = JsonlCheckpoint(Path(pred_path), resume=resume, fingerprint=extractor.run_fingerprint())
+    verify_ckpt = JsonlCheckpoint(Path(verify_path), resume=resume, fingerprint=verifier.run_fingerprint())
+    order_ids = [ex["id"] for ex in ex_list]
+
+    try:
+        asyncio.run(_run(extractor, verifier, ex_list, pred_ckpt, verify_ckpt, concurrency, queue_size))
+    finally:
+        pred_ckpt.close()
+        verify_ckpt.close()
+
+    return pred_ckpt.finalize(order_ids), verify_ckpt.finalize(order_ids)
+
+
+async def _run(extractor: EntityExtractor, verifier: SelfVerifier, ex_list: List[Dict[str, Any]],
+               pred_ckpt: JsonlCheckpoint, verify_ckpt: JsonlCheckpoint,
+               concurrency: int, queue_size: int) -> None:
+    sem = asyncio.Semaphore(concurrency)
+    extract_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    verify_q: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+    extracted = pred_ckpt.records_by_id()
+
+    async def feed() -> None:
+        for ex in ex_list:
+            if pred_ckpt.is_done(ex["id"], record_hash(ex)):
+                one = extracted[str(ex["id"])]
+                if verify_ckpt.is_done(ex["id"], record_hash(one)):
+                    continue
+                # 续跑：已抽取未验证（或验证时的预测已过期），直接进入验证阶段
+                await verify_q.put(one)
+            else:
+                await extract_q.put(ex)
+        for _ in range(concurrency):
+            await extract_q.put(_DONE)
+
+    async def extract_worker() -> None:
+        while True:
+            ex = await extract_q.get()
+            if ex is _DONE:
+                return
+            try:
+                input_hash = record_hash(ex)
+                one = await extractor.aextract_for_one_example(ex, sem)
+            except Exception as e:
+                pred_ckpt.write_failure(ex["id"], e)
+                continue
+            pred_ckpt.write(one, input_hash)
+            await verify_q.put(one)
+
+    async def verify_worker() -> None:
+        while True:
+            one = await verify_q.get()
+            if one is _DONE:
+                return
+            try:
+                input_hash = record_hash(one)
+                verify_ckpt.write(await verifier.averify_for_one_example(one, sem), input_hash)
+            except Exception as e:
+                verify_ckpt.write_failure(one["id"], e)
+
+    try:
+        verifiers = [asyncio.create_task(verify_worker()) for _ in range(concurrency)]
+        await asyncio.gather(feed(), *[extract_worker() for _ in range(concurrency)])
+        for _ in range(concurrency):
+            await verify_q.put(_DONE)
+        await asyncio.gather(*verifiers)
+    finally:
+        await aclose_all_pools()
@@ -17,6 +17,7 @@ from pathlib import Path
 from typing import Dict, List, Any, Tuple, Optional, Set
 
 from src.utils.io_tools import load_json_or_jsonl, file_sha256, ensure_dir, write_json_overwrite
+from src.utils.tracing import traced
 
 COARSE_INDEX_FILENAME = "coarse_index.json"
 REL_INDEX_FILENAME = "relationship_index.json"
@@ -36,6 +37,7 @@ class InvertedRetrieval:
 
     # ========== 阶段1：构建并写出索引（只在需要时执行一次） ==========
 
+    @traced("build_index")
     def build_indexes(
             self,
             dataset: Optional[List[Dict[str, Any]]] = None
@@ -72,6 +74,7 @@ class InvertedRetrieval:
 
     # ========== 阶段2：加载数据集和索引到内存 ==========
 
+    @traced("load_index")
     def load_indexes(self) -> None:
         """
         从磁盘加载数据集和索引到内存。
@@ -10,6 +10,8 @@ import hashlib
 from typing import Any, List, Dict, Optional
 import collections.abc as cabc
 
+from .tracing import span
+
 def load_yaml(path):
     with open(path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
@@ -128,4 +130,139 @@ def load_json_or_jsonl(path: Path) -> List[Dict[str, Any]]:
         if not isinstance(obj, dict):
             raise ValueError(f"JSONL 第 {i+1} 行不是对象。")
         records.append(obj)
-    return records
\ No newline at end of file
+    return records
+
+def record_hash(obj: Any) -> str:
+    """记录内容的摘要（规范化 JSON 的 SHA256），续跑时据此判断同一 id 的输入是否已变化。"""
+    text = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+_INPUT_HASH = "_input_hash"  # JSONL 行内记录输入摘要的字段，汇总输出时去掉
+
+
+class JsonlCheckpoint:
+    """
+    断点续跑的流式写出器（抽取 / 验证共用）：
+      - <out>.jsonl：每完成一个样例立即追加一行并 flush，崩溃后已完成的结果不丢；
+      - <out>.failed.jsonl：本次运行中失败的样例（id + 错误信息），不影响其余样例；
+      - <out>.run.json：产生该 JSONL 的运行指纹（模型、模式、prompt 指纹、生成参数等）；
+      - finalize()：按输入顺序把 JSONL 汇总为原有的 JSON 数组文件 <out>。
+    resume=True 时保留已有 JSONL，已完成的样例可直接跳过；否则从头开始。
+    给出 fingerprint 时，与 <out>.run.json 不一致（或旧 JSONL 没有指纹）的断点视为过期并丢弃，
+    避免换了模型 / 模式 / prompt 后把新旧结果混在一起；write() 传入 input_hash 时，
+    is_done() 还要求同一 id 的输入摘要一致（如验证阶段的输入预测已变化则重新验证）。
+    """
+
+    def __init__(self, out_json_path: Path, resume: bool = True, fingerprint: Optional[Dict[str, Any]] = None):
+        self.out_path = Path(out_json_path)
+        self.jsonl_path = self.out_path.with_suffix(".jsonl")
+        self.failed_path = self.out_path.with_name(self.out_path.stem + ".failed.jsonl")
+        self.run_path = self.out_path.with_name(self.out_path.stem + ".run.json")
+        self.out_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # 经一次 JSON 往返，与文件中读回的指纹可直接比较（tuple -> list 等）
+        fingerprint = None if fingerprint is None else json.loads(json.dumps(fingerprint, default=str))
+        if resume and fingerprint is not None and self.jsonl_path.exists():
+            previous = self._read_fingerprint()
+            if previous != fingerprint:
+                changed = sorted(k for k in set(fingerprint) | set(previous or {})
+                                 if (previous or {}).get(k) != fingerprint.get(k))
+                print(f"[WARN] {self.jsonl_path} 由不同配置产生（{', '.join(changed) or '缺少运行指纹'} 不一致），"
+                      f"丢弃旧断点、从头运行。")
+                resume = False
+        if not resume and self.jsonl_path.exists():
+            self.jsonl_path.unlink()
+        if fingerprint is not None:
+            with self.run_path.open("w", encoding="utf-8") as f:
+                json.dump(fingerprint, f, ensure_ascii=False, indent=2)
+        # 失败记录只反映本次运行；上次失败的样例会在本次重试
+        if self.failed_path.exists():
+            self.failed_path.unlink()
+
+        # id -> 输入摘要（未记录摘要时为 None）
+        self.done_ids: Dict[str, Optional[str]] = {str(r.get("id")): r.get(_INPUT_HASH) for r in self._read_records()}
+
+        self._f = self.jsonl_path.open("a", encoding="utf-8")
+        # 上次崩溃可能留下半行，补换行避免与新记录粘连
+        if self.jsonl_path.stat().st_size > 0:
+            with self.jsonl_path.open("rb") as rf:
+                rf.seek(-1, os.SEEK_END)
+                if rf.read(1) != b"\n":
+                    self._f.write("\n")
+        self._failed_f = None
+
+    def _read_records(self) -> List[Dict[str, Any]]:
+        if not self.jsonl_path.exists():
+            return []
+        records = []
+        with self.jsonl_path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue  # 崩溃时写了一半的行
+        return records
+
+    def _read_fingerprint(self) -> Optional[Dict[str, Any]]:
+        try:
+            with self.run_path.open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    @staticmethod
+    def _strip(record: Dict[str, Any]) -> Dict[str, Any]:
+        record.pop(_INPUT_HASH, None)
+        return record
+
+    def records_by_id(self) -> Dict[str, Dict[str, Any]]:
+        """已写入 JSONL 的记录（按 id 索引，同一 id 以最后一次为准）"""
+        self._f.flush()
+        return {str(r.get("id")): self._strip(r) for r in self._read_records()}
+
+    def is_done(self, ex_id: Any, input_hash: Optional[str] = None) -> bool:
+        """ex_id 已完成；给出 input_hash 时还要求完成时的输入摘要与之相同"""
+        key = str(ex_id)
+        if key not in self.done_ids:
+            return False
+        return input_hash is None or self.done_ids[key] == input_hash
+
+    def write(self, record: Dict[str, Any], input_hash: Optional[str] = None) -> None:
+        line = record if input_hash is None else {**record, _INPUT_HASH: input_hash}
+        with span("write", cat="io"):
+            self._f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            self._f.flush()
+        self.done_ids[str(record.get("id"))] = input_hash
+
+    def write_failure(self, ex_id: Any, error: BaseException) -> None:
+        print(f"[WARN] 样例 {ex_id} 处理失败，已记录到 {self.failed_path}：{error!r}")
+        if self._failed_f is None:
+            self._failed_f = self.failed_path.open("a", encoding="utf-8")
+        self._failed_f.write(json.dumps({"id": ex_id, "error": repr(error)}, ensure_ascii=False) + "\n")
+        self._failed_f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+        if self._failed_f is not None:
+            self._failed_f.close()
+
+    def finalize(self, order_ids: List[Any]) -> Path:
+        """按 order_ids 的顺序汇总 JSONL 为 JSON 数组（覆盖写入 <out>），失败样例不出现在结果中"""
+        self.close()
+        with span("write_output", path=str(self.out_path)):
+            by_id = {str(r.get("id")): self._strip(r) for r in self._read_records()}
+            results = [by_id[str(i)] for i in order_ids if str(i) in by_id]
+
+            tmp = self.out_path.with_suffix(self.out_path.suffix + ".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+            tmp.replace(self.out_path)
+
+        missing = len(order_ids) - len(results)
+        if missing:
+            print(f"[WARN] {missing} 个样例未完成，详见 {self.failed_path}；重新运行即可续跑。")
+        return self.out_path
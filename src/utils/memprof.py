@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：按阶段统计内存（可选开启，用于排查大语料下的 OOM）。
+- 挂在 tracing 的 span 上：每个 cat="stage" 的阶段（数据加载、build_docs、batch_openie、解析、写出等）记录
+  进入 / 退出时的 RSS、阶段内的峰值 RSS（后台线程按 sample_interval_s 采样），以及 tracemalloc 统计的
+  Python 分配量与阶段内峰值；
+- 阶段结束时对比进入时的 tracemalloc 快照，列出净增长最多的分配位置（文件:行号 + 源码），
+  即这一阶段留下来、会随语料规模增长的数据结构；
+- tracemalloc 会明显拖慢运行并占用额外内存，只在排查时开启；报告写到 memory_report.json。
+"""
+
+from __future__ import annotations
+
+import json
+import linecache
+import os
+import sysconfig
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .tracing import get_tracer
+
+_MB = 1024 * 1024
+_STDLIB = sysconfig.get_paths()["stdlib"]
+_SITE_PACKAGES = (sysconfig.get_paths()["purelib"], sysconfig.get_paths()["platlib"])
+
+
+def _is_site(filename: str) -> bool:
+    """可以归因的位置：排除标准库（第三方包除外）与 <frozen ...> / <string> 等动态代码"""
+    if not filename or filename.startswith("<"):
+        return False
+    return not filename.startswith(_STDLIB) or filename.startswith(_SITE_PACKAGES)
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss() -> Optional[int]:
+    """当前常驻内存（字节）；Linux 读 /proc，其他平台需安装 psutil，否则返回 None"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def process_peak_rss() -> Optional[int]:
+    """进程启动以来的峰值 RSS（字节）"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def _mb(value: Optional[int]) -> Optional[float]:
+    return None if value is None else round(value / _MB, 2)
+
+
+class _Stage:
+    def __init__(self, name: str, snapshot: tracemalloc.Snapshot) -> None:
+        self.name = name
+        self.start = time.perf_counter()
+        self.snapshot = snapshot
+        self.rss_start = current_rss()
+        self.peak_rss = self.rss_start or 0
+        self.traced_start = tracemalloc.get_traced_memory()[0]
+        self.peak_traced = self.traced_start
+
+
+class MemoryProfiler:
+    """
+    用法：
+        profiler = MemoryProfiler(top_n=10)
+        profiler.start()
+        ...  # 运行，各阶段的 span 自动被记录
+        profiler.stop("outputs/memory_report.json")
+    """
+
+    def __init__(self, top_n: int = 10, frames: int = 4, sample_interval: float = 0.05,
+                 categories: Sequence[str] = ("stage",)) -> None:
+        self.top_n = top_n
+        self.frames = max(1, int(frames))
+        self.sample_interval = sample_interval
+        self.categories = set(categories)
+        self.stages: List[Dict[str, Any]] = []
+        self._stack: List[_Stage] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._owns_tracemalloc = False
+        self._t0 = time.perf_counter()
+        # 排除 tracemalloc 自身与导入机制的分配
+        self._filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                         tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                         tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                         tracemalloc.Filter(False, __file__, all_frames=True)]
+
+    # ---------------------------- 生命周期 ----------------------------
+    def start(self) -> None:
+        self._t0 = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._owns_tracemalloc = True
+        self._stop.clear()
+        get_tracer().add_listener(self)
+        if self.sample_interval > 0:
+            self._sampler = threading.Thread(target=self._sample_loop, name="memprof-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self, report_path: Optional[str | os.PathLike] = None) -> Dict[str, Any]:
+        """停止采样并生成报告；给出 report_path 时写出 JSON"""
+        get_tracer().remove_listener(self)
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        report = self.report()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        if report_path is not None:
+            path = Path(report_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            if rss is None:
+                return
+            with self._lock:
+                for st in self._stack:
+                    st.peak_rss = max(st.peak_rss, rss)
+
+    # ---------------------------- span 监听 ----------------------------
+    def _fold_peak(self) -> None:
+        """把当前的 tracemalloc 峰值计入所有未结束的阶段（嵌套阶段进入前会重置峰值）"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for st in self._stack:
+            st.peak_traced = max(st.peak_traced, peak)
+
+    def on_enter(self, name: str, cat: str) -> None:
+        if cat not in self.categories or not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+        with self._lock:
+            self._fold_peak()
+            tracemalloc.reset_peak()
+            self._stack.append(_Stage(name, snapshot))
+
+    def on_exit(self, name: str, cat: str) -> None:
+        if cat not in self.categories or not tracemalloc.is_tracing():
+            return
+        with self._lock:
+            idx = next((i for i in range(len(self._stack) - 1, -1, -1) if self._stack[i].name == name), None)
+            if idx is None:
+                return
+            self._fold_peak()
+            st = self._stack.pop(idx)
+            for parent in self._stack:
+                parent.peak_rss = max(parent.peak_rss, st.peak_rss)
+        end = tracemalloc.take_snapshot().filter_traces(self._filters)
+        rss_end = current_rss()
+        row = {
+            "name": name,
+            "depth": idx,
+            "start_s": round(st.start - self._t0, 3),
+            "wall_s": round(time.perf_counter() - st.start, 3),
+            "rss_start_mb": _mb(st.rss_start),
+            "rss_end_mb": _mb(rss_end),
+            "rss_peak_mb": _mb(max(st.peak_rss, rss_end or 0) or None),
+            "traced_start_mb": _mb(st.traced_start),
+            "traced_end_mb": _mb(tracemalloc.get_traced_memory()[0]),
+            "traced_peak_mb": _mb(st.peak_traced),
+            "top_growth": self._top_growth(end, st.snapshot),
+        }
+        with self._lock:
+            self.stages.append(row)
+
+    # ---------------------------- 报告 ----------------------------
+    def _key_type(self) -> str:
+        return "traceback" if self.frames > 1 else "lineno"
+
+    @staticmethod
+    def _where(traceback: tracemalloc.Traceback) -> Dict[str, Any]:
+        """调用栈（由外到内）与最内层的非标准库位置：json.loads 等分配记到调用它的业务代码上"""
+        frames = [f"{f.filename}:{f.lineno}  {linecache.getline(f.filename, f.lineno).strip()}" for f in traceback]
+        site = next((line for f, line in zip(reversed(traceback), reversed(frames))
+                     if _is_site(f.filename)), frames[-1])
+        return {"site": site, "stack": frames}
+
+    def _top_growth(self, end: tracemalloc.Snapshot, start: tracemalloc.Snapshot) -> List[Dict[str, Any]]:
+        diffs = [d for d in end.compare_to(start, self._key_type()) if d.size_diff > 0]
+        diffs.sort(key=lambda d: d.size_diff, reverse=True)
+        return [{**self._where(d.traceback), "size_diff_mb": _mb(d.size_diff), "size_mb": _mb(d.size),
+                 "count_diff": d.count_diff} for d in diffs[:self.top_n]]
+
+    def report(self) -> Dict[str, Any]:
+        live: List[Dict[str, Any]] = []
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(self._filters)
+            live = [{**self._where(s.traceback), "size_mb": _mb(s.size), "count": s.count}
+                    for s in snapshot.statistics(self._key_type())[:self.top_n]]
+        with self._lock:
+            stages = sorted(self.stages, key=lambda r: (r["start_s"], r["depth"]))
+        return {
+            "process_peak_rss_mb": _mb(process_peak_rss()),
+            "rss_end_mb": _mb(current_rss()),
+            "tracemalloc_frames": self.frames,
+            "stages": stages,
+            "live_top": live,
+        }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """按阶段输出一行摘要（峰值 RSS / Python 分配峰值 / 净增长最多的位置）"""
+    lines = [f"进程峰值 RSS {report.get('process_peak_rss_mb')} MB"]
+    for row in report.get("stages", []):
+        top = row["top_growth"][0] if row["top_growth"] else None
+        where = f"，净增长最多：{top['site']}（+{top['size_diff_mb']} MB）" if top else ""
+        lines.append(f"{'  ' * row['depth']}{row['name']}: RSS 峰值 {row['rss_peak_mb']} MB，"
+                     f"Python 分配峰值 {row['traced_peak_mb']} MB，耗时 {row['wall_s']} s{where}")
+    return "\n".join(lines)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+文件功能：阶段级耗时追踪（span），导出 Chrome / Perfetto trace JSON（chrome://tracing 或 ui.perfetto.dev 直接打开）。
+- with span("load_dataset"): ... 或 @traced("parse") 标注一个阶段；未启用时只有一次布尔判断的开销；
+- 每个 span 记为一个完整事件（ph="X"），同一轨道上的 span 按嵌套关系形成火焰图；
+- 线程各占一条轨道；asyncio 任务各自分配一条轨道（同一线程上交错执行的协程共用轨道会互相穿插，无法嵌套显示），
+  任务结束后轨道回收复用，轨道数大致等于并发度；
+- cat 区分粒度："stage" 为整批阶段（数据加载、索引、抽取、写出等），"example" 为逐样例 / 逐段落的步骤，
+  "llm" 为单次模型调用，"io" 为逐条写出；
+- summary() 按 span 名称汇总次数、总耗时与最大耗时，便于不打开时间线也能看出时间花在哪；
+- add_listener() 注册的监听器在 span 进入 / 退出时被调用（如内存分析），不依赖是否记录时间线。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        self._meta: List[Dict[str, Any]] = []
+        self._t0 = time.perf_counter_ns()
+        self._pid = os.getpid()
+        self._threads: Dict[int, int] = {}
+        self._tasks: Dict[asyncio.Task, int] = {}
+        self._free_tracks: List[int] = []
+        self._next_track = 1
+        self._task_tracks = 0
+        self._listeners: List[Any] = []
+
+    def add_listener(self, listener: Any) -> None:
+        """listener 需实现 on_enter(name, cat) 与 on_exit(name, cat)"""
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener: Any) -> None:
+        self._listeners = [x for x in self._listeners if x is not listener]
+
+    def enable(self) -> None:
+        """开始记录（清空之前的事件，时间线从此刻起算）"""
+        with self._lock:
+            self._events, self._meta = [], []
+            self._threads, self._tasks, self._free_tracks = {}, {}, []
+            self._next_track, self._task_tracks = 1, 0
+            self._t0 = time.perf_counter_ns()
+            self._meta.append({"ph": "M", "name": "process_name", "pid": self._pid, "tid": 0,
+                               "args": {"name": "ccf-ner"}})
+            self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    # ---------------------------- 轨道分配 ----------------------------
+    def _new_track(self, name: str) -> int:
+        tid = self._next_track
+        self._next_track += 1
+        self._meta.append({"ph": "M", "name": "thread_name", "pid": self._pid, "tid": tid, "args": {"name": name}})
+        self._meta.append({"ph": "M", "name": "thread_sort_index", "pid": self._pid, "tid": tid,
+                           "args": {"sort_index": tid}})
+        return tid
+
+    def _track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        with self._lock:
+            if task is None:
+                ident = threading.get_ident()
+                tid = self._threads.get(ident)
+                if tid is None:
+                    tid = self._threads[ident] = self._new_track(threading.current_thread().name)
+                return tid
+            tid = self._tasks.get(task)
+            if tid is None:
+                if self._free_tracks:
+                    tid = self._free_tracks.pop()
+                else:
+                    self._task_tracks += 1
+                    tid = self._new_track(f"async-{self._task_tracks}")
+                self._tasks[task] = tid
+                task.add_done_callback(self._release)
+            return tid
+
+    def _release(self, task: asyncio.Task) -> None:
+        with self._lock:
+            tid = self._tasks.pop(task, None)
+            if tid is not None:
+                self._free_tracks.append(tid)
+
+    # ---------------------------- 记录 ----------------------------
+    def _now_us(self) -> float:
+        return (time.perf_counter_ns() - self._t0) / 1000.0
+
+    @contextlib.contextmanager
+    def _span(self, name: str, cat: str, args: Dict[str, Any]) -> Iterator[None]:
+        listeners = self._listeners
+        for listener in listeners:
+            listener.on_enter(name, cat)
+        record = self.enabled
+        if record:
+            tid = self._track()
+            start = self._now_us()
+        try:
+            yield
+        finally:
+            if record:
+                event = {"ph": "X", "name": name, "cat": cat, "pid": self._pid, "tid": tid,
+                         "ts": round(start, 3), "dur": round(self._now_us() - start, 3)}
+                if args:
+                    event["args"] = args
+                with self._lock:
+                    self._events.append(event)
+            for listener in reversed(listeners):
+                listener.on_exit(name, cat)
+
+    def span(self, name: str, cat: str = "stage", **args: Any):
+        """标注一个阶段；args 会显示在时间线的事件详情中"""
+        if not self.enabled and not self._listeners:
+            return _NULL_SPAN
+        return self._span(name, cat, args)
+
+    # ---------------------------- 导出 ----------------------------
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """按 span 名称汇总：次数、总耗时、最大耗时（毫秒，含嵌套的子 span），按总耗时降序"""
+        with self._lock:
+            events = list(self._events)
+        agg: Dict[str, Dict[str, Any]] = {}
+        for e in events:
+            row = agg.setdefault(e["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            row["count"] += 1
+            row["total_ms"] += e["dur"] / 1000.0
+            row["max_ms"] = max(row["max_ms"], e["dur"] / 1000.0)
+        for row in agg.values():
+            row["total_ms"] = round(row["total_ms"], 3)
+            row["max_ms"] = round(row["max_ms"], 3)
+        return dict(sorted(agg.items(), key=lambda kv: -kv[1]["total_ms"]))
+
+    def export(self, path: str | os.PathLike) -> Path:
+        """写出 Chrome trace JSON（先写临时文件再替换）"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            events = self._meta + sorted(self._events, key=lambda e: e["ts"])
+        trace = {"traceEvents": events, "displayTimeUnit": "ms",
+                 "otherData": {"summary": self.summary()}}
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False, default=str)
+        tmp.replace(path)
+        return path
+
+
+_NULL_SPAN = contextlib.nullcontext()
+_TRACER = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """进程内共享的追踪器"""
+    return _TRACER
+
+
+def span(name: str, cat: str = "stage", **args: Any):
+    """with span("build_index"): ...；追踪未启用时为空操作"""
+    return _TRACER.span(name, cat, **args)
+
+
+def traced(name: Optional[str] = None, cat: str = "stage") -> Callable:
+    """函数装饰器：整个调用记为一个 span（缺省以函数名命名），支持 async 函数"""
+
+    def deco(func: Callable) -> Callable:
+        label = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def awrapper(*args: Any, **kwargs: Any) -> Any:
+                with _TRACER.span(label, cat):
+                    return await func(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with _TRACER.span(label, cat):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return deco